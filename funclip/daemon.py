@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Copyright FunASR (https://github.com/alibaba-damo-academy/FunClip). All Rights Reserved.
+#  MIT License  (https://opensource.org/licenses/MIT)
+"""
+Long-running FunClip worker.
+
+Keeps the FunASR models resident and runs videoclipper jobs (stage 1
+recognition, stage 2 clipping) sent over a Unix socket or localhost HTTP.
+While it is running, ``python videoclipper.py ...`` forwards to it instead of
+loading the models itself.
+
+    python daemon.py --preload zh                      # unix:$XDG_RUNTIME_DIR/funclip/daemon.sock
+    python daemon.py --address http://127.0.0.1:7870  # clients: export FUNCLIP_DAEMON=http://127.0.0.1:7870
+
+Endpoints: ``GET /health`` -> status and loaded models; ``POST /run`` with the
+videoclipper keyword arguments as JSON -> ``{"ok": true, "result": ...}``.
+
+Jobs write files wherever their arguments say, so ``/run`` only accepts
+``Content-Type: application/json`` requests carrying the per-daemon token
+(``Authorization: Bearer ...``) and only runner keyword arguments. The token
+is regenerated at start-up and written to a file readable only by the owner
+(see ``utils.daemon_client.token_path``); the Unix socket is created 0600.
+A web page can reach a localhost port, but it cannot read the token file.
+"""
+
+import argparse
+import hmac
+import inspect
+import json
+import logging
+import os
+import secrets
+import socketserver
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.daemon_client import DEFAULT_DAEMON_ADDRESS, parse_address, token_path
+from videoclipper import FUNASR_MODELS, _funasr_models, load_funasr_model, runner
+
+# Keys a /run request may carry: exactly the runner keyword arguments.
+RUNNER_PARAMS = frozenset(inspect.signature(runner).parameters)
+
+# Jobs share the resident models (and usually one GPU), so they run one at a time;
+# health checks are answered immediately while a job is running.
+_job_lock = threading.Lock()
+_started = time.time()
+_jobs_done = 0
+
+
+class DaemonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send(404, {"error": "not found"})
+            return
+        self._send(200, {
+            "status": "busy" if _job_lock.locked() else "ok",
+            "pid": os.getpid(),
+            "models": sorted(_funasr_models),
+            "jobs_done": _jobs_done,
+            "uptime": round(time.time() - _started, 1),
+        })
+
+    def _authorized(self):
+        auth = self.headers.get("Authorization", "")
+        token = auth[len("Bearer "):] if auth.startswith("Bearer ") else ""
+        return hmac.compare_digest(token.encode("utf-8"), self.server.token.encode("utf-8"))
+
+    def do_POST(self):
+        global _jobs_done
+        if self.path != "/run":
+            self._send(404, {"error": "not found"})
+            return
+        # Browsers can send text/plain or form posts cross-origin without a preflight;
+        # requiring JSON plus a custom header rules those out before the body is read.
+        if self.headers.get_content_type() != "application/json":
+            self.close_connection = True  # the unread body must not be parsed as the next request
+            self._send(415, {"error": "Content-Type must be application/json"})
+            return
+        if not self._authorized():
+            self.close_connection = True
+            self._send(401, {"error": "missing or invalid daemon token"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+        except ValueError as e:
+            self._send(400, {"error": f"invalid request: {e}"})
+            return
+        if not isinstance(job, dict):
+            self._send(400, {"error": "invalid request: expected a JSON object"})
+            return
+        unknown = sorted(set(job) - RUNNER_PARAMS)
+        if unknown:
+            self._send(400, {"error": "invalid request: unknown parameters {}".format(unknown)})
+            return
+        logging.warning("Daemon job: stage {} on {}".format(job.get("stage"), job.get("file")))
+        try:
+            with _job_lock:
+                result = runner(**job)
+                _jobs_done += 1
+        except SystemExit as e:
+            # runner exits on invalid input; report it instead of stopping the daemon
+            self._send(200, {"ok": False, "error": f"job aborted (exit code {e.code})"})
+            return
+        except Exception as e:
+            logging.error(traceback.format_exc())
+            self._send(200, {"ok": False, "error": f"{type(e).__name__}: {e}"})
+            return
+        self._send(200, {"ok": True, "result": result})
+
+    def address_string(self):
+        # Unix socket peers have no (host, port)
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.server_address)), mode=0o700, exist_ok=True)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        # Create the socket owner-only from the start, not chmod it after others could connect.
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+        os.chmod(self.server_address, 0o600)
+        self.server_name, self.server_port = "localhost", 0
+
+
+def write_token(address):
+    """Generate this daemon's token and store it in a 0600 file for clients to read."""
+    token = secrets.token_urlsafe(32)
+    path = token_path(address)
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        os.fchmod(f.fileno(), 0o600)  # the file may already exist with wider permissions
+        f.write(token)
+    return token
+
+
+def make_server(address):
+    kind, target = parse_address(address)
+    if kind == "unix":
+        server = ThreadingUnixHTTPServer(target, DaemonHandler)
+    else:
+        server = ThreadingHTTPServer(target, DaemonHandler)
+    server.token = write_token(address)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FunClip daemon")
+    parser.add_argument("--address", type=str, default=DEFAULT_DAEMON_ADDRESS,
+                        help="unix:/path/to/socket (default) or http://127.0.0.1:PORT")
+    parser.add_argument("--preload", type=str, default="zh",
+                        help="Comma separated languages whose models are loaded at start-up ('' to load on first use)")
+    args = parser.parse_args()
+
+    for lang in [l.strip() for l in args.preload.split(",") if l.strip()]:
+        if lang not in FUNASR_MODELS:
+            parser.error("unknown language: {}".format(lang))
+        load_funasr_model(lang)
+
+    server = make_server(args.address)
+    logging.warning("FunClip daemon listening on {}".format(args.address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        kind, target = parse_address(args.address)
+        for path in ([target] if kind == "unix" else []) + [token_path(args.address)]:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,15 +8,17 @@ import os
 import logging
 import argparse
 import gradio as gr
-from funasr import AutoModel
-from videoclipper import VideoClipper
-from llm.openai_api import openai_call
-from llm.qwen_api import call_qwen_model
-from llm.g4f_openai_api import g4f_openai_call
+from videoclipper import VideoClipper, load_funasr_model
+from llm.gateway import LLMGateway, LLMError
 from utils.trans_utils import extract_timestamps
 from introduction import top_md_1, top_md_3, top_md_4
 from utils.preview_components import create_integrated_preview_export_ui
 from utils.style_manager import StyleTemplateManager
+from utils.lazy_loader import SubsystemRegistry
+from utils.job_scheduler import JobScheduler, JobCancelled, QueueFullError
+from utils.reader_pool import video_readers
+import inspect
+import contextlib
 import time
 import logging
 from accelerate.logging import get_logger
@@ -37,32 +39,107 @@ if __name__ == "__main__":
     parser.add_argument('--share', '-s', action='store_true', help="if to establish gradio share link")
     parser.add_argument('--port', '-p', type=int, default=7860, help='port number')
     parser.add_argument('--listen', action='store_true', help="if to listen to all hosts")
+    parser.add_argument('--warmup', type=str, default="asr",
+                        help="comma separated subsystems (asr, vlm, style) to load in the background at start-up; "
+                             "the others are loaded on first use")
+    parser.add_argument('--vlm_path', type=str, default="/remote-home/share/huggingface/Qwen3-VL-8B-Instruct",
+                        help="path of the video understanding model")
+    parser.add_argument('--asr_workers', type=int, default=1, help="concurrent ASR jobs")
+    parser.add_argument('--vlm_workers', type=int, default=1, help="concurrent video understanding jobs")
+    parser.add_argument('--render_workers', type=int, default=2, help="concurrent clip/music/style render jobs")
+    parser.add_argument('--export_workers', type=int, default=2, help="concurrent export jobs")
+    parser.add_argument('--max_queue', type=int, default=8, help="jobs allowed to wait in each pool")
+    parser.add_argument('--llm_workers', type=int, default=4, help="concurrent LLM requests")
+    parser.add_argument('--llm_timeout', type=float, default=60.0,
+                        help="seconds to wait for the LLM service between streamed chunks")
+    parser.add_argument('--llm_retries', type=int, default=3, help="retries of failed LLM requests")
     args = parser.parse_args()
     
-    if args.lang == 'zh':
-        funasr_model = AutoModel(model="iic/speech_seaco_paraformer_large_asr_nat-zh-cn-16k-common-vocab8404-pytorch",
-                                vad_model="damo/speech_fsmn_vad_zh-cn-16k-common-pytorch",
-                                punc_model="damo/punc_ct-transformer_zh-cn-common-vocab272727-pytorch",
-                                spk_model="damo/speech_campplus_sv_zh-cn_16k-common",
-                                )
-    else:
-        funasr_model = AutoModel(model="iic/speech_paraformer_asr-en-16k-vocab4199-pytorch",
-                                vad_model="damo/speech_fsmn_vad_zh-cn-16k-common-pytorch",
-                                punc_model="damo/punc_ct-transformer_zh-cn-common-vocab272727-pytorch",
-                                spk_model="damo/speech_campplus_sv_zh-cn_16k-common",
-                                )
-    audio_clipper = VideoClipper(funasr_model)
+    audio_clipper = VideoClipper(None)
     audio_clipper.lang = args.lang
-    
-    # Initialize Video Semantic Understander
-    audio_clipper.init_semantic_understander("/remote-home/share/huggingface/Qwen3-VL-8B-Instruct")
-    
-    # Initialize Style Template Manager
-    print("[启动] 正在初始化风格模板管理器...")
-    style_manager = StyleTemplateManager()
-    template_count = len(style_manager.get_available_templates())
-    print(f"[启动] ✅ 风格模板管理器已初始化，可用模板: {template_count} 个")
-    print(f"[启动] 📋 模板列表: {', '.join(style_manager.get_available_templates()[:3])}...")
+
+    # 各子系统在第一次使用时才加载 (只用音频裁剪时不会占用视觉模型的显存)；
+    # --warmup 指定的子系统在后台线程中提前加载，不阻塞 UI 绑定端口
+    subsystems = SubsystemRegistry()
+
+    def _load_asr():
+        audio_clipper.funasr_model = load_funasr_model(args.lang)
+        return audio_clipper.funasr_model
+
+    def _load_vlm():
+        audio_clipper.init_semantic_understander(args.vlm_path)
+        if audio_clipper.video_understander is None:
+            raise RuntimeError("Video Semantic Understander failed to load, see the log for details")
+        return audio_clipper.video_understander
+
+    def _load_style():
+        manager = StyleTemplateManager()
+        templates = manager.get_available_templates()
+        print(f"[启动] ✅ 风格模板管理器已初始化，可用模板: {len(templates)} 个")
+        print(f"[启动] 📋 模板列表: {', '.join(templates[:3])}...")
+        return manager
+
+    subsystems.register("asr", _load_asr, "FunASR ASR + VAD + punctuation + speaker")
+    subsystems.register("vlm", _load_vlm, "Video semantic understanding (Qwen3-VL)")
+    subsystems.register("style", _load_style, "Style template manager")
+
+    # 风格模板列表用于构建界面，只读取 JSON 配置，直接加载
+    style_manager = subsystems.get("style")
+
+    # 耗时任务按功能分池调度：每个池有独立的并发上限和排队上限，不同功能互不阻塞，
+    # 超出排队上限的请求立即返回提示，而不是无限堆积
+    scheduler = JobScheduler({
+        "asr": {"concurrency": args.asr_workers, "max_queue": args.max_queue},
+        "vlm": {"concurrency": args.vlm_workers, "max_queue": args.max_queue},
+        "render": {"concurrency": args.render_workers, "max_queue": args.max_queue},
+        "export": {"concurrency": args.export_workers, "max_queue": args.max_queue},
+    })
+
+    def scheduled(pool, fn):
+        """
+        把界面回调包装成 pool 中的任务
+        包装函数在原参数后追加 progress / request 两个参数，由 Gradio 注入：
+        前者用于显示排队位置和任务进度，后者提供会话 ID 以便取消本会话的任务
+        """
+        def job(*args):
+            *inputs, progress, request = args
+            session = getattr(request, "session_hash", None)
+            try:
+                return scheduler.pools[pool].run(
+                    fn, inputs, name=fn.__name__, session=session,
+                    progress_callback=lambda fraction, message: progress(fraction, desc=message))
+            except QueueFullError:
+                raise gr.Error(f"当前 {pool} 任务较多，请稍后再试")
+            except JobCancelled:
+                raise gr.Error("任务已取消")
+
+        params = list(inspect.signature(fn).parameters.values())
+        params += [
+            inspect.Parameter("progress", inspect.Parameter.POSITIONAL_OR_KEYWORD, default=gr.Progress()),
+            inspect.Parameter("request", inspect.Parameter.POSITIONAL_OR_KEYWORD, default=None,
+                              annotation=gr.Request),
+        ]
+        job.__signature__ = inspect.Signature(params)
+        job.__annotations__ = {"request": gr.Request}
+        job.__name__ = fn.__name__
+        return job
+
+    # LLM 请求由网关在事件循环上限流，不进入上面的线程任务池
+    llm_gateway = LLMGateway(max_concurrency=args.llm_workers, timeout=args.llm_timeout,
+                             max_retries=args.llm_retries)
+
+    def cancel_session_jobs(request: gr.Request):
+        count = scheduler.cancel(getattr(request, "session_hash", None))
+        # 排队中的任务立即取消，运行中的任务在下一个检查点 (阶段、镜头、帧或 ffmpeg 调用之间) 停止
+        return f"已请求取消 {count} 个任务 (运行中的任务会在当前步骤结束时停止)" + "\n" + job_status_text(request)
+
+    def job_status_text(request: gr.Request):
+        lines = [f"{name}: 运行 {st['running']}/{st['concurrency']}, 排队 {st['queued']}/{st['max_queue']}"
+                 for name, st in scheduler.status().items()]
+        for job in scheduler.session_jobs(getattr(request, "session_hash", None)):
+            lines.append(f"#{job['id']} [{job['pool']}] {job['name']}: {job['state']} "
+                         f"{job['progress'] * 100:.0f}% {job['message']}")
+        return "\n".join(lines)
 
     server_name='127.0.0.1'
     if args.listen:
@@ -72,6 +149,7 @@ if __name__ == "__main__":
     def video_semantic_understanding_wrapper(video_input):
         if video_input is None:
             return "Please upload a video first.", None
+        subsystems.get("vlm")
         # 调用 videoclipper，获取 (UI文本, 结构化数据)
         ui_text, raw_data = audio_clipper.semantic_understand(video_input)
         return ui_text, raw_data
@@ -96,20 +174,33 @@ if __name__ == "__main__":
         if custom_audio is not None:
             custom_path = custom_audio # Gradio 返回的是文件路径
             print(f"🎵 Using custom audio: {custom_path}")
-        
+
         path, msg = audio_clipper.generate_musical_video(
             video_path=video, 
             music_root=m_root, 
             output_path=out_path, 
             shots_data_wrapper=semantic_state,
-            custom_bgm_path=custom_path # [新增参数]
+            custom_bgm_path=custom_path, # [新增参数]
+            recog_fn=music_recog
         )
         return path, f"✅ 生成成功 (版本 {timestamp})\n{msg}"
 
+    def music_recog(video_path):
+        """源视频的人声区间没有缓存时由配乐任务调用：识别作为子任务进入 asr 池，受 ASR 并发上限约束"""
+        def recog():
+            subsystems.get("asr")
+            return audio_clipper.video_recog(video_path)
+        try:
+            return scheduler.pools["asr"].run(recog, name="music_recog")
+        except QueueFullError:
+            raise gr.Error("当前 asr 任务较多，请稍后再试")
+
     def audio_recog(audio_input, sd_switch, hotwords, output_dir):
+        subsystems.get("asr")
         return audio_clipper.recog(audio_input, sd_switch, None, hotwords, output_dir=output_dir)
 
     def video_recog(video_input, sd_switch, hotwords, output_dir):
+        subsystems.get("asr")
         return audio_clipper.video_recog(video_input, sd_switch, hotwords, output_dir=output_dir)
 
     def video_clip(dest_text, video_spk_input, start_ost, end_ost, state, output_dir):
@@ -176,18 +267,21 @@ if __name__ == "__main__":
             add_sub=True, dest_spk=video_spk_input, output_dir=output_dir
             )
         
-    def llm_inference(system_content, user_content, srt_text, model, apikey):
-        SUPPORT_LLM_PREFIX = ['qwen', 'gpt', 'g4f', 'moonshot', 'deepseek']
-        if model.startswith('qwen'):
-            return call_qwen_model(apikey, model, user_content+'\n'+srt_text, system_content)
-        if model.startswith('gpt') or model.startswith('moonshot') or model.startswith('deepseek'):
-            return openai_call(apikey, model, system_content, user_content+'\n'+srt_text)
-        elif model.startswith('g4f'):
-            model = "-".join(model.split('-')[1:])
-            return g4f_openai_call(model, system_content, user_content+'\n'+srt_text)
-        else:
-            logging.error("LLM name error, only {} are supported as LLM name prefix."
-                          .format(SUPPORT_LLM_PREFIX))
+    async def llm_inference(system_content, user_content, srt_text, model, apikey):
+        # 在事件循环上流式返回，等待 LLM 服务时不占用工作线程
+        # 客户端断开或界面取消时 Gradio 不再迭代本生成器，aclosing 保证网关的流随之关闭、释放并发名额
+        text = ""
+        try:
+            async with contextlib.aclosing(llm_gateway.stream(
+                    model, user_content+'\n'+srt_text, system_content, apikey or None)) as stream:
+                async for part in stream:
+                    text += part
+                    yield text
+        except ValueError as e:
+            logging.error(str(e))
+            raise gr.Error(str(e))
+        except LLMError as e:
+            raise gr.Error(f"LLM 调用失败: {e}")
     
     def AI_clip(LLM_res, dest_text, video_spk_input, start_ost, end_ost, video_state, audio_state, output_dir):
         timestamp_list = extract_timestamps(LLM_res)
@@ -228,6 +322,7 @@ if __name__ == "__main__":
     def video_semantic_understanding(video_input):
         if video_input is None:
             return "Please upload a video first."
+        subsystems.get("vlm")
         return audio_clipper.semantic_understand(video_input)
     
     # 风格模板相关函数
@@ -292,6 +387,15 @@ if __name__ == "__main__":
             print(f"{'='*60}\n")
             return None, message
 
+    mix_recog = scheduled("asr", mix_recog)
+    mix_recog_speaker = scheduled("asr", mix_recog_speaker)
+    video_semantic_understanding_wrapper = scheduled("vlm", video_semantic_understanding_wrapper)
+    mix_clip = scheduled("render", mix_clip)
+    video_clip_addsub = scheduled("render", video_clip_addsub)
+    AI_clip = scheduled("render", AI_clip)
+    AI_clip_subti = scheduled("render", AI_clip_subti)
+    run_music = scheduled("render", run_music)
+
     # gradio interface
     theme = gr.Theme.load("funclip/utils/theme.json")
     with gr.Blocks(theme=theme) as funclip_service:
@@ -341,7 +445,7 @@ if __name__ == "__main__":
                             with gr.Row():
                                 llm_model = gr.Dropdown(
                                     choices=["gpt-5",
-                                        "deepseek-chat"
+                                        "deepseek-chat",
                                         "qwen-plus",
                                              "gpt-3.5-turbo", 
                                              "gpt-3.5-turbo-0125", 
@@ -436,6 +540,11 @@ if __name__ == "__main__":
                 audio_output = gr.Audio(label="裁剪结果 | Audio Clipped")
                 clip_message = gr.Textbox(label="⚠️ 裁剪信息 | Clipping Log")
                 srt_clipped = gr.Textbox(label="📖 裁剪部分SRT字幕内容 | Clipped RST Subtitles")            
+                with gr.Accordion("📋 任务队列 | Jobs", open=False):
+                    job_status = gr.Textbox(label="任务状态 | Job Status", lines=6)
+                    with gr.Row():
+                        refresh_jobs_btn = gr.Button("🔄 刷新 | Refresh")
+                        cancel_jobs_btn = gr.Button("⏹ 取消我的任务 | Cancel My Jobs", variant="stop")
                 
         recog_button.click(mix_recog, 
                             inputs=[video_input, 
@@ -534,7 +643,7 @@ if __name__ == "__main__":
                 return None, message, None, ""
         
         apply_style_btn.click(
-            apply_style_with_preview,
+            scheduled("render", apply_style_with_preview),
             inputs=[
                 video_output,  # 使用裁剪后的视频
                 style_template_dropdown,
@@ -617,7 +726,7 @@ if __name__ == "__main__":
         
         # 绑定导出按钮
         preview_export_components['export_btn'].click(
-            smart_export,
+            scheduled("export", smart_export),
             inputs=[
                 video_output,  # 裁剪结果
                 style_output_video,  # 风格化结果
@@ -639,7 +748,8 @@ if __name__ == "__main__":
 
         # 导出预览：优先使用风格化视频
         def smart_export_preview(clip_video, styled_video, resolution, platform,
-                                custom_width, custom_height, custom_bitrate, custom_fps):
+                                custom_width, custom_height, custom_bitrate, custom_fps,
+                                preview_start):
             """智能选择预览源：优先风格化视频"""
             source_video = styled_video if styled_video else clip_video
             if not source_video:
@@ -648,12 +758,13 @@ if __name__ == "__main__":
             print(f"[导出预览] 预览源: {'风格化视频' if styled_video else '裁剪视频'}")
             return ui_manager.handle_export_preview(
                 source_video, resolution, platform,
-                custom_width, custom_height, custom_bitrate, custom_fps
+                custom_width, custom_height, custom_bitrate, custom_fps,
+                preview_start=preview_start
             )
         
-        # 绑定导出预览按钮（仅生成前3秒轻量预览）
+        # 绑定导出预览按钮（从所选位置生成3秒轻量预览）
         preview_export_components['export_preview_btn'].click(
-            smart_export_preview,
+            scheduled("export", smart_export_preview),
             inputs=[
                 video_output,
                 style_output_video,
@@ -662,7 +773,8 @@ if __name__ == "__main__":
                 preview_export_components['custom_width'],
                 preview_export_components['custom_height'],
                 preview_export_components['custom_bitrate'],
-                preview_export_components['custom_fps']
+                preview_export_components['custom_fps'],
+                preview_export_components['preview_start']
             ],
             outputs=[
                 preview_export_components['preview_video'],
@@ -686,7 +798,7 @@ if __name__ == "__main__":
         
         # 绑定批量导出按钮
         preview_export_components['batch_export_btn'].click(
-            smart_batch_export,
+            scheduled("export", smart_batch_export),
             inputs=[
                 video_output,
                 style_output_video,
@@ -701,9 +813,35 @@ if __name__ == "__main__":
                 preview_export_components['video_info_text']
             ]
         )
-    
+
+        refresh_jobs_btn.click(job_status_text, inputs=None, outputs=[job_status], queue=False)
+        cancel_jobs_btn.click(cancel_session_jobs, inputs=None, outputs=[job_status], queue=False)
+
+    # 并发由上面的任务池控制；Gradio 同时处理的请求数不超过各池 运行+排队 的总数，
+    # 多出的请求留在 Gradio 队列中，不在 JobPool.run 里占着工作线程等待
+    funclip_service.queue(default_concurrency_limit=scheduler.capacity())
+
+    # 就绪检查: GET /ready 返回各子系统、任务池、视频读取器和 LLM 网关状态，?require=asr,vlm 时仅在这些子系统加载完成后返回 200
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route
+
+    async def readiness(request):
+        status = subsystems.status(request.query_params.get("require", "").split(","))
+        status["jobs"] = scheduler.status()
+        status["video_readers"] = video_readers.stats()
+        status["llm"] = llm_gateway.stats()
+        return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+    app_kwargs = {"routes": [Route("/ready", readiness, methods=["GET"])]}
+    subsystems.warm_up([name.strip() for name in args.warmup.split(",") if name.strip()])
+
+    # 工作线程数在任务占满时仍留出余量，状态刷新、下拉框联动等轻量事件不会被排队的任务饿死
+    max_threads = scheduler.capacity() + 8
+
     # start gradio service in local or share
     if args.listen:
-        funclip_service.launch(share=args.share, server_port=args.port, server_name=server_name, inbrowser=False)
+        funclip_service.launch(share=args.share, server_port=args.port, server_name=server_name, inbrowser=False,
+                               app_kwargs=app_kwargs, max_threads=max_threads)
     else:
-        funclip_service.launch(share=args.share, server_port=args.port, server_name=server_name)
+        funclip_service.launch(share=args.share, server_port=args.port, server_name=server_name,
+                               app_kwargs=app_kwargs, max_threads=max_threads)
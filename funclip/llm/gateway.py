@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# LLM 网关 - 统一的异步调用层：共享 HTTP 连接池、并发上限、指数退避重试、超时和流式输出
+
+import asyncio
+import concurrent.futures
+import logging
+import os
+import random
+import weakref
+from typing import AsyncIterator, Optional, Tuple
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+# 模型名前缀 -> OpenAI 兼容接口地址 (None 表示 SDK 默认地址)
+# 通义千问走 DashScope 的 OpenAI 兼容模式，和其他服务共用同一条调用路径
+PROVIDER_BASE_URLS = [
+    ("deepseek", "https://api.deepseek.com"),
+    ("gpt", "https://chatapi.zjt66.top/v1"),
+    ("moonshot", None),
+    ("qwen", "https://dashscope.aliyuncs.com/compatible-mode/v1"),
+]
+SUPPORT_LLM_PREFIX = ["qwen", "gpt", "g4f", "moonshot", "deepseek"]
+
+# 设置后所有 HTTP 服务都改用该地址 (本地代理或测试用的 mock 服务)
+BASE_URL_ENV = "FUNCLIP_LLM_BASE_URL"
+
+# 可重试的 HTTP 状态码：超时、冲突、限流和服务端错误
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMError(RuntimeError):
+    """LLM 调用失败 (已用完重试次数或遇到不可重试的错误)"""
+
+
+def resolve_model(model: str) -> Tuple[str, Optional[str], str]:
+    """
+    根据模型名确定调用方式
+    :return: (provider, base_url, 实际模型名)；provider 为 "openai" 或 "g4f"
+    """
+    if model.startswith("g4f"):
+        return "g4f", None, "-".join(model.split("-")[1:])
+    for prefix, base_url in PROVIDER_BASE_URLS:
+        if model.startswith(prefix):
+            return "openai", os.environ.get(BASE_URL_ENV) or base_url, model
+    raise ValueError("LLM name error, only {} are supported as LLM name prefix.".format(SUPPORT_LLM_PREFIX))
+
+
+def build_messages(user_content: str, system_content: Optional[str] = None):
+    if system_content is not None and len(system_content.strip()):
+        return [
+            {'role': 'system', 'content': system_content},
+            {'role': 'user', 'content': user_content}
+        ]
+    return [{'role': 'user', 'content': user_content}]
+
+
+def _retry_delay(error: Exception) -> Optional[float]:
+    """可重试的错误返回服务端建议的等待秒数 (没有建议时为 0)，不可重试时返回 None"""
+    # 流式读取过程中的断连和读取超时不经过 SDK 包装，直接是 httpx 的异常
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError, asyncio.TimeoutError)):
+        return 0.0
+    if isinstance(error, openai.APIStatusError) and error.status_code in RETRY_STATUS:
+        try:
+            return float(error.response.headers.get("retry-after", 0))
+        except ValueError:
+            return 0.0
+    return None
+
+
+class LLMGateway:
+    """
+    进程内共享的 LLM 调用层
+    - 所有请求共用一个 httpx.AsyncClient，按服务地址复用 keep-alive 连接，不再每次新建客户端
+    - 同时进行的请求数不超过 max_concurrency，其余在事件循环上等待，不占用工作线程
+    - 连接失败、超时、限流和 5xx 按指数退避 (带抖动，优先使用 Retry-After) 重试，
+      已经向调用方输出内容后不再重试，避免重复文本
+    - timeout 是相邻两次读取之间的超时，流式输出持续到达时长回答不会被截断
+    - g4f 是同步调用，在网关自己的有界线程池中执行；超时后线程无法中止，所以 g4f 请求不重试，
+      避免超时的线程和重试的线程越积越多
+    连接池和信号量绑定在创建它们的事件循环上，所以按事件循环分别创建。
+    """
+
+    def __init__(self, max_concurrency: int = 4, timeout: float = 60.0, connect_timeout: float = 10.0,
+                 max_retries: int = 3, backoff: float = 1.0, max_backoff: float = 30.0,
+                 max_connections: int = 20):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max(0, int(max_retries))
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_connections = max_connections
+        self._loops = weakref.WeakKeyDictionary()
+        self._g4f_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="g4f")
+        self._stats = {"requests": 0, "in_flight": 0, "retries": 0, "failures": 0}
+
+    def _loop_state(self):
+        loop = asyncio.get_running_loop()
+        state = self._loops.get(loop)
+        if state is None:
+            http_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+            state = {"http": http_client, "semaphore": asyncio.Semaphore(self.max_concurrency), "clients": {}}
+            self._loops[loop] = state
+        return state
+
+    def _client(self, state, base_url: Optional[str], api_key: Optional[str]) -> AsyncOpenAI:
+        key = (base_url, api_key)
+        client = state["clients"].get(key)
+        if client is None:
+            # 重试由网关统一处理，SDK 自身不再重试
+            client = AsyncOpenAI(api_key=api_key or os.environ.get("OPENAI_API_KEY") or "EMPTY",
+                                 base_url=base_url, http_client=state["http"], max_retries=0)
+            state["clients"][key] = client
+        return client
+
+    def _backoff_seconds(self, attempt: int, suggested: float) -> float:
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        return max(suggested, delay * random.uniform(0.5, 1.0))
+
+    async def stream(self, model: str, user_content: str, system_content: Optional[str] = None,
+                     api_key: Optional[str] = None) -> AsyncIterator[str]:
+        """逐段返回模型输出的文本"""
+        provider, base_url, model_name = resolve_model(model)
+        messages = build_messages(user_content, system_content)
+        state = self._loop_state()
+        self._stats["requests"] += 1
+        attempt = 0
+        while True:
+            emitted = False
+            try:
+                async with state["semaphore"]:
+                    self._stats["in_flight"] += 1
+                    try:
+                        if provider == "g4f":
+                            loop = asyncio.get_running_loop()
+                            text = await asyncio.wait_for(
+                                loop.run_in_executor(self._g4f_executor, self._g4f_complete, model_name, messages),
+                                self.timeout)
+                            emitted = True
+                            yield text
+                            return
+                        client = self._client(state, base_url, api_key)
+                        response = await client.chat.completions.create(
+                            model=model_name, messages=messages, stream=True)
+                        # 出错或调用方提前停止读取时关闭响应，连接回到连接池而不是一直挂着
+                        async with response:
+                            async for chunk in response:
+                                if not chunk.choices:
+                                    continue
+                                delta = chunk.choices[0].delta.content
+                                if delta:
+                                    emitted = True
+                                    yield delta
+                        return
+                    finally:
+                        self._stats["in_flight"] -= 1
+            except Exception as e:
+                # 超时的 g4f 线程仍在运行，重试只会再占一个线程
+                suggested = _retry_delay(e) if provider != "g4f" else None
+                if emitted or suggested is None or attempt >= self.max_retries:
+                    self._stats["failures"] += 1
+                    logging.error(f"LLM request to {model} failed after {attempt + 1} attempt(s): {e}")
+                    raise LLMError(f"{type(e).__name__}: {e}") from e
+                delay = self._backoff_seconds(attempt, suggested)
+                attempt += 1
+                self._stats["retries"] += 1
+                logging.warning(f"LLM request to {model} failed ({type(e).__name__}), "
+                                f"retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def complete(self, model: str, user_content: str, system_content: Optional[str] = None,
+                       api_key: Optional[str] = None) -> str:
+        """返回完整的回答"""
+        parts = [part async for part in self.stream(model, user_content, system_content, api_key)]
+        return "".join(parts)
+
+    @staticmethod
+    def _g4f_complete(model, messages):
+        # g4f 在进程内访问免费接口，没有可复用的 HTTP 服务，放到线程中执行以免阻塞事件循环
+        from g4f.client import Client
+        response = Client().chat.completions.create(model=model, messages=messages)
+        return response.choices[0].message.content
+
+    async def aclose(self):
+        """关闭当前事件循环上的连接池"""
+        state = self._loops.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state["http"].aclose()
+
+    def stats(self):
+        return dict(self._stats, max_concurrency=self.max_concurrency)
+
+
+if __name__ == '__main__':
+    # 流式输出示例，可用 FUNCLIP_LLM_BASE_URL 指向本地 OpenAI 兼容服务测试
+    import argparse
+    from llm.demo_prompt import demo_prompt
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, default="gpt-3.5-turbo")
+    parser.add_argument("--apikey", type=str, default=None)
+    args = parser.parse_args()
+
+    async def _demo():
+        gateway = LLMGateway()
+        async for part in gateway.stream(args.model, demo_prompt, api_key=args.apikey):
+            print(part, end="", flush=True)
+        print()
+        await gateway.aclose()
+
+    asyncio.run(_demo())
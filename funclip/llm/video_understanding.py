@@ -5,6 +5,7 @@ import logging
 from PIL import Image
 from transformers import AutoModelForImageTextToText, AutoProcessor
 from collections import Counter
+from utils.job_scheduler import JobCancelled, check_cancelled, report_progress
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -41,6 +42,12 @@ class ShotDetector:
             ret, frame = cap.read()
             if not ret:
                 break
+            if frame_idx % 250 == 0:
+                try:
+                    check_cancelled()
+                except JobCancelled:
+                    cap.release()
+                    raise
             
             hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
             hist = cv2.calcHist([hsv], [0], None, [256], [0, 256])
@@ -199,6 +206,9 @@ class VideoSemanticUnderstander:
         
         logger.info("Pass 1: Analyzing individual shots...")
         for i, (start, end) in enumerate(shots):
+            # 每个镜头一次推理，镜头之间检查取消
+            check_cancelled()
+            report_progress(i / (len(shots) + 1), f"分析镜头 {i+1}/{len(shots)}")
             mid_time = (start + end) / 2
             frame_img = self.extract_frame_from_video(video_path, mid_time)
             
@@ -231,6 +241,8 @@ class VideoSemanticUnderstander:
             })
             
         # Pass 2: 全局分析 (用于配乐)
+        check_cancelled()
+        report_progress(len(shots) / (len(shots) + 1), "分析整体氛围")
         logger.info("Pass 2: Analyzing global mood for music...")
         global_mood = self._generate_global_mood(video_path)
         
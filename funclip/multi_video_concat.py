@@ -2,18 +2,51 @@
 # -*- encoding: utf-8 -*-
 # Utility script to concatenate multiple videos after light normalization,
 # inserting 1s color-gradient transitions between clips.
+# Inputs that already match the target format are stream-copied; only the
+# others are re-encoded, and everything is joined with the concat demuxer.
 #
 # Usage example:
 #   python funclip/multi_video_concat.py --fps 25 --transition-duration 1.0 \
 #       examples/a.mp4 examples/b.mkv examples/c.mov
 
 import argparse
+import hashlib
+import json
+import math
 import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
-import numpy as np
-from moviepy.editor import VideoClip, VideoFileClip, concatenate_videoclips
+from utils.ffmpeg_utils import concat_segments, probe_media, run_ffmpeg
+
+# Encoding shared by every segment so the concat demuxer can stream-copy them.
+# Profile, level, SAR and track timescale are pinned as well: the demuxer keeps
+# the first segment's stream parameters, so any mismatch breaks decoding or
+# timestamps in the joined file.
+SEGMENT_VIDEO_CODEC = "h264"
+SEGMENT_PROFILE = "High"
+SEGMENT_PIX_FMT = "yuv420p"
+SEGMENT_SAR = "1:1"
+SEGMENT_TIMESCALE = 90000
+SEGMENT_AUDIO_CODEC = "aac"
+SEGMENT_AUDIO_CHANNELS = 2
+DEFAULT_AUDIO_FPS = 44100
+
+# H.264 levels (as reported by ffprobe) with their frame size and macroblock
+# rate limits, used to pick the smallest level that fits the output.
+H264_LEVELS = [
+    (31, 3600, 108000),
+    (40, 8192, 245760),
+    (41, 8192, 245760),
+    (42, 8704, 522240),
+    (50, 22080, 589824),
+    (51, 36864, 983040),
+    (52, 36864, 2073600),
+]
 
 
 def parse_size(size_str: Optional[str]) -> Optional[Tuple[int, int]]:
@@ -26,44 +59,154 @@ def parse_size(size_str: Optional[str]) -> Optional[Tuple[int, int]]:
     return (w, h)
 
 
-def mean_color_at(clip: VideoFileClip, t: float) -> Tuple[int, int, int]:
-    frame = clip.get_frame(t)
-    color = frame.mean(axis=(0, 1))
-    return tuple(int(c) for c in color)
+def mean_color_of(path: Path, t: float) -> Tuple[int, int, int]:
+    """Mean RGB color of the frame at ``t``, averaged by ffmpeg's area scaler."""
+    raw = run_ffmpeg(
+        [
+            "-ss", f"{max(0.0, t):.3f}", "-i", str(path),
+            "-frames:v", "1", "-vf", "scale=1:1:flags=area",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-",
+        ],
+        capture_stdout=True,
+    )
+    if len(raw) < 3:
+        return (0, 0, 0)
+    return tuple(int(c) for c in raw[:3])
+
+
+def _hex_color(color: Tuple[int, int, int]) -> str:
+    return "0x{:02x}{:02x}{:02x}".format(*color)
+
+
+def segment_level(size: Tuple[int, int], fps: int) -> int:
+    """Smallest H.264 level whose frame size and macroblock rate limits fit."""
+    frame_mbs = math.ceil(size[0] / 16) * math.ceil(size[1] / 16)
+    for level, max_fs, max_mbps in H264_LEVELS:
+        if frame_mbs <= max_fs and frame_mbs * fps <= max_mbps:
+            return level
+    return H264_LEVELS[-1][0]
 
 
-def gradient_transition(
+def segment_video_args(size: Tuple[int, int], fps: int) -> List[str]:
+    """x264 and muxer options shared by every segment this module encodes."""
+    level = segment_level(size, fps)
+    return [
+        "-c:v", "libx264", "-preset", "medium", "-pix_fmt", SEGMENT_PIX_FMT,
+        "-profile:v", SEGMENT_PROFILE.lower(), "-level:v", f"{level / 10:.1f}",
+        "-video_track_timescale", str(SEGMENT_TIMESCALE),
+    ]
+
+
+def encode_gradient_transition(
     start_color: Tuple[int, int, int],
     end_color: Tuple[int, int, int],
     size: Tuple[int, int],
+    fps: int,
+    audio_fps: int,
     duration: float,
-):
-    start = np.array(start_color, dtype=float)
-    end = np.array(end_color, dtype=float)
+    cache_dir: Path,
+) -> Path:
+    """
+    Encode a gradient transition as a small segment with silent audio, using
+    the same format as the normalized clips. Segments are cached by their
+    parameters, so each distinct transition is encoded only once.
+    """
+    key = json.dumps([start_color, end_color, size, fps, audio_fps, duration])
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    out_path = cache_dir / f"transition_{digest}.mp4"
+    if out_path.exists():
+        return out_path
 
-    def make_frame(t):
-        alpha = np.clip(t / duration, 0.0, 1.0)
-        color = (1 - alpha) * start + alpha * end
-        frame = np.ones((size[1], size[0], 3), dtype=np.uint8)
-        frame[:] = color.astype(np.uint8)
-        return frame
+    w, h = size
+    color_src = "color=c={}:s={}x{}:r={}:d={}"
+    # Concurrent runs may encode the same transition; each writes its own file.
+    tmp_path = out_path.with_suffix(f".part{os.getpid()}_{threading.get_ident()}.mp4")
+    try:
+        run_ffmpeg(
+            [
+                "-f", "lavfi", "-i", color_src.format(_hex_color(start_color), w, h, fps, duration),
+                "-f", "lavfi", "-i", color_src.format(_hex_color(end_color), w, h, fps, duration),
+                "-f", "lavfi", "-i", f"anullsrc=r={audio_fps}:cl=stereo",
+                "-filter_complex",
+                f"[0:v]format=gbrp[a];[1:v]format=gbrp[b];"
+                f"[a][b]blend=all_expr='A*(1-T/{duration})+B*(T/{duration})',"
+                f"setsar={SEGMENT_SAR},format={SEGMENT_PIX_FMT}[v]",
+                "-map", "[v]", "-map", "2:a", "-t", f"{duration}",
+            ]
+            + segment_video_args(size, fps)
+            + [
+                "-c:a", SEGMENT_AUDIO_CODEC, "-ar", str(audio_fps), "-ac", str(SEGMENT_AUDIO_CHANNELS),
+                str(tmp_path),
+            ]
+        )
+        os.replace(tmp_path, out_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return out_path
 
-    return VideoClip(make_frame=make_frame, duration=duration)
+
+def is_compliant(
+    info: Dict, target_size: Tuple[int, int], target_fps: int, audio_fps: int
+) -> bool:
+    """
+    True when a probed input can be stream-copied into the output as-is:
+    same codecs, H.264 profile/level, pixel format, SAR, timebase, size,
+    frame rate and audio layout as the segments this module encodes itself.
+    The level is only compared when the probe reports it: the ffmpeg -i
+    fallback used without ffprobe cannot, and rejecting every input then
+    would silently disable the stream-copy path.
+    """
+    level = info.get("level")
+    return (
+        info.get("video_codec") == SEGMENT_VIDEO_CODEC
+        and info.get("profile") == SEGMENT_PROFILE
+        and (level is None or level == segment_level(target_size, target_fps))
+        and info.get("pix_fmt") == SEGMENT_PIX_FMT
+        and info.get("sar") == SEGMENT_SAR
+        and info.get("time_base") == f"1/{SEGMENT_TIMESCALE}"
+        and (info.get("width"), info.get("height")) == tuple(target_size)
+        and abs(info.get("fps", 0.0) - target_fps) < 0.01
+        and info.get("has_audio", False)
+        and info.get("audio_codec") == SEGMENT_AUDIO_CODEC
+        and info.get("sample_rate") == audio_fps
+        and info.get("channels") == SEGMENT_AUDIO_CHANNELS
+    )
 
 
-def normalize_clip(
+def normalize_to_segment(
     path: Path,
+    out_path: Path,
+    info: Dict,
     target_size: Tuple[int, int],
     target_fps: int,
-    target_audio_fps: Optional[int],
-) -> VideoFileClip:
-    clip = VideoFileClip(str(path))
-    if clip.size != list(target_size):
-        clip = clip.resize(newsize=target_size)
-    clip = clip.set_fps(target_fps)
-    if clip.audio is not None and target_audio_fps is not None:
-        clip = clip.set_audio(clip.audio.set_fps(target_audio_fps))
-    return clip
+    audio_fps: int,
+    threads: int = 0,
+) -> Path:
+    """
+    Re-encode one input to the shared segment format (adds silence if it has
+    no audio). ``threads`` caps the encoder threads (0 lets ffmpeg decide).
+    """
+    w, h = target_size
+    has_audio = info.get("has_audio", False)
+    args = ["-i", str(path)]
+    if not has_audio:
+        args += ["-f", "lavfi", "-i", f"anullsrc=r={audio_fps}:cl=stereo"]
+    args += [
+        "-map", "0:v:0",
+        "-map", "0:a:0" if has_audio else "1:a",
+        "-vf", f"scale={w}:{h},setsar={SEGMENT_SAR},fps={target_fps},format={SEGMENT_PIX_FMT}",
+    ]
+    args += segment_video_args(target_size, target_fps) + [
+        "-threads", str(threads),
+        "-c:a", SEGMENT_AUDIO_CODEC, "-ar", str(audio_fps), "-ac", str(SEGMENT_AUDIO_CHANNELS),
+    ]
+    if not has_audio:
+        # The generated silence is endless; stop at the end of the video.
+        args += ["-shortest"]
+    args += [str(out_path)]
+    run_ffmpeg(args)
+    return out_path
 
 
 def build_output_name(inputs: List[Path], output_dir: Path) -> Path:
@@ -80,47 +223,80 @@ def concat_videos(
     transition_duration: float,
     output_dir: Path,
     overwrite: bool,
+    jobs: Optional[int] = None,
 ) -> Path:
+    """
+    Join ``inputs`` with gradient transitions. Non-conforming inputs are
+    normalized concurrently by ``jobs`` ffmpeg workers (default: one per two
+    cores, each encoder limited to its share of threads), so the final join
+    is a stream copy.
+    """
     if not inputs:
         raise ValueError("No input videos provided")
     output_dir.mkdir(parents=True, exist_ok=True)
-
-    # Use first clip as template when target_size is not specified.
-    with VideoFileClip(str(inputs[0])) as first_probe:
-        base_size = target_size or tuple(first_probe.size)
-    clips = []
-    for path in inputs:
-        clip = normalize_clip(path, base_size, target_fps, target_audio_fps)
-        clips.append(clip)
-
-    stitched = []
-    for idx, clip in enumerate(clips):
-        stitched.append(clip)
-        if idx + 1 < len(clips):
-            next_clip = clips[idx + 1]
-            start_sample_time = max(0.0, clip.duration - 1.0 / max(target_fps, 1))
-            start_color = mean_color_at(clip, start_sample_time)
-            end_color = mean_color_at(next_clip, 0.0)
-            trans = gradient_transition(
-                start_color, end_color, base_size, transition_duration
-            )
-            stitched.append(trans)
-
-    final = concatenate_videoclips(stitched, method="compose")
     output_path = build_output_name(inputs, output_dir)
     if output_path.exists() and not overwrite:
         raise FileExistsError(
             f"{output_path} exists. Use --overwrite to replace the existing file."
         )
-    final.write_videofile(
-        str(output_path),
-        fps=target_fps,
-        audio_codec="aac",
-    )
-    # Close clips to release resources
-    for clip in clips:
-        clip.close()
-    final.close()
+
+    infos = [probe_media(str(path)) for path in inputs]
+    # Use first clip as template when target_size is not specified.
+    base_size = target_size or (infos[0]["width"], infos[0]["height"])
+    audio_fps = target_audio_fps or infos[0].get("sample_rate") or DEFAULT_AUDIO_FPS
+
+    # Transitions are cached across runs; normalized copies go to a per-run
+    # directory that is removed even when a step fails.
+    cache_dir = output_dir / ".concat_cache"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    run_dir = Path(tempfile.mkdtemp(prefix="run_", dir=str(cache_dir)))
+    try:
+        # Stream-copy compliant inputs, re-encode only the others in parallel.
+        segments = list(inputs)
+        pending = [
+            idx for idx, info in enumerate(infos)
+            if not is_compliant(info, base_size, target_fps, audio_fps)
+        ]
+        if pending:
+            cores = os.cpu_count() or 2
+            workers = max(1, min(len(pending), jobs or max(1, cores // 2)))
+            threads = max(1, cores // workers)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    idx: pool.submit(
+                        normalize_to_segment,
+                        inputs[idx], run_dir / f"norm_{idx}.mp4", infos[idx],
+                        base_size, target_fps, audio_fps, threads,
+                    )
+                    for idx in pending
+                }
+                for idx, future in futures.items():
+                    segments[idx] = future.result()
+
+        # Transition colors only need one tiny frame grab each; fetch them concurrently too.
+        with ThreadPoolExecutor(max_workers=max(1, min(8, 2 * len(segments)))) as pool:
+            end_colors = [
+                pool.submit(mean_color_of, seg, info["duration"] - 1.0 / max(target_fps, 1))
+                for seg, info in zip(segments[:-1], infos[:-1])
+            ]
+            start_colors = [pool.submit(mean_color_of, seg, 0.0) for seg in segments[1:]]
+            end_colors = [f.result() for f in end_colors]
+            start_colors = [f.result() for f in start_colors]
+
+        stitched = []
+        for idx, segment in enumerate(segments):
+            stitched.append(segment)
+            if idx + 1 < len(segments) and transition_duration > 0:
+                stitched.append(
+                    encode_gradient_transition(
+                        end_colors[idx], start_colors[idx], base_size, target_fps, audio_fps,
+                        transition_duration, cache_dir,
+                    )
+                )
+
+        concat_segments([str(p) for p in stitched], str(output_path))
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
     return output_path
 
 
@@ -158,6 +334,12 @@ def main():
         default="examples",
         help="Directory to store the concatenated output.",
     )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of inputs normalized in parallel. Defaults to half the CPU cores.",
+    )
     parser.add_argument(
         "--overwrite",
         action="store_true",
@@ -178,6 +360,7 @@ def main():
         transition_duration=args.transition_duration,
         output_dir=output_dir,
         overwrite=args.overwrite,
+        jobs=args.jobs,
     )
     print(f"Saved concatenated video to {output}")
 
@@ -0,0 +1,140 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.job_scheduler import (JobCancelled, JobPool, QueueFullError, check_cancelled, current_job)
+
+
+def _wait_until(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def _submit(pool, fn, name, session=None, results=None):
+    # 在后台线程中提交任务 (JobPool.run 在调用线程中阻塞执行)，结果或异常记录到 results
+    def target():
+        try:
+            outcome = pool.run(fn, name=name, session=session)
+        except Exception as e:
+            outcome = e
+        if results is not None:
+            results[name] = outcome
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def _blocker(pool, session=None):
+    # 占住池中唯一的运行槽，直到 release 被设置
+    release = threading.Event()
+    thread = _submit(pool, release.wait, "blocker", session)
+    _wait_until(lambda: pool.status()["running"] == 1)
+    return release, thread
+
+
+def test_fifo_admission():
+    pool = JobPool("test", concurrency=1, max_queue=8)
+    release, blocker = _blocker(pool)
+    order, threads = [], []
+    for i in range(5):
+        threads.append(_submit(pool, lambda i=i: order.append(i), f"job{i}"))
+        # 逐个确认入队，保证提交顺序确定
+        _wait_until(lambda: pool.status()["queued"] == i + 1)
+    release.set()
+    for thread in [blocker] + threads:
+        thread.join(5)
+    assert order == [0, 1, 2, 3, 4]
+
+
+def test_queue_full():
+    pool = JobPool("test", concurrency=1, max_queue=2)
+    release, blocker = _blocker(pool)
+    threads = [_submit(pool, lambda: None, f"job{i}") for i in range(2)]
+    _wait_until(lambda: pool.status()["queued"] == 2)
+    # 运行槽和排队都已满，新任务立即被拒绝而不是阻塞
+    with pytest.raises(QueueFullError):
+        pool.run(lambda: None)
+    release.set()
+    for thread in [blocker] + threads:
+        thread.join(5)
+    assert pool.status() == {"concurrency": 1, "max_queue": 2, "running": 0, "queued": 0}
+
+
+def test_cancel_while_queued():
+    pool = JobPool("test", concurrency=1, max_queue=8)
+    release, blocker = _blocker(pool, session="a")
+    ran, results = [], {}
+    queued = _submit(pool, lambda: ran.append(True), "queued", session="b", results=results)
+    _wait_until(lambda: pool.status()["queued"] == 1)
+    # 只取消会话 b：排队的任务被取消，会话 a 的运行中任务不受影响
+    assert pool.cancel("b") == 1
+    queued.join(5)
+    assert isinstance(results["queued"], JobCancelled)
+    assert not ran
+    assert pool.status()["running"] == 1
+    release.set()
+    blocker.join(5)
+
+
+def test_cancel_while_running():
+    pool = JobPool("test", concurrency=1, max_queue=8)
+    started, results = threading.Event(), {}
+
+    def work():
+        started.set()
+        while True:
+            check_cancelled()
+            time.sleep(0.01)
+
+    thread = _submit(pool, work, "running", session="a", results=results)
+    assert started.wait(5)
+    assert pool.cancel("a") == 1
+    thread.join(5)
+    assert isinstance(results["running"], JobCancelled)
+    # 取消后运行槽被释放
+    assert pool.status()["running"] == 0
+    assert pool.run(lambda: "ok") == "ok"
+
+
+def test_nested_job_inherits_session():
+    outer, inner = JobPool("outer"), JobPool("inner")
+    progress, seen = [], {}
+
+    def child():
+        seen["inner"] = current_job().session
+
+    def parent():
+        seen["outer"] = current_job().session
+        inner.run(child, name="child")
+        # 子任务结束后恢复外层任务
+        seen["after"] = current_job().session
+
+    outer.run(parent, session="s1", progress_callback=lambda f, m: progress.append(m))
+    assert seen == {"outer": "s1", "inner": "s1", "after": "s1"}
+    # 子任务的进度也汇报到外层任务的进度显示
+    assert any(m.startswith("inner:") for m in progress)
+    assert current_job() is None
+
+
+def test_cancel_session_reaches_nested_job():
+    outer, inner = JobPool("outer"), JobPool("inner")
+    started, results = threading.Event(), {}
+
+    def child():
+        started.set()
+        while True:
+            check_cancelled()
+            time.sleep(0.01)
+
+    thread = _submit(outer, lambda: inner.run(child), "parent", session="s1", results=results)
+    assert started.wait(5)
+    assert inner.cancel("s1") == 1
+    thread.join(5)
+    assert isinstance(results["parent"], JobCancelled)
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("openai")
+
+from llm import gateway as gateway_module
+from llm.gateway import BASE_URL_ENV, LLMError, LLMGateway
+
+MODEL = "gpt-3.5-turbo"
+
+
+def _sse(*deltas):
+    # OpenAI 兼容接口的流式响应：每段一个 chat.completion.chunk 事件，最后是 [DONE]
+    events = []
+    for delta in deltas:
+        chunk = {"id": "1", "object": "chat.completion.chunk", "created": 0, "model": MODEL,
+                 "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]}
+        events.append(f"data: {json.dumps(chunk)}\n\n".encode())
+    return events + [b"data: [DONE]\n\n"]
+
+
+class _Events(httpx.AsyncByteStream):
+    # 逐个发送事件，fail 为 True 时在第一段之后断开连接
+    def __init__(self, events, fail=False):
+        self.events = events
+        self.fail = fail
+        self.closed = False
+
+    async def __aiter__(self):
+        for i, event in enumerate(self.events):
+            if self.fail and i == 1:
+                raise httpx.ReadError("connection reset")
+            yield event
+
+    async def aclose(self):
+        self.closed = True
+
+
+class MockServer:
+    """按顺序返回预设的响应，记录收到的请求"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+        self.streams = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        status, headers, events, fail = self.responses.pop(0)
+        if status != 200:
+            return httpx.Response(status, headers=headers, json={"error": {"message": "busy"}})
+        stream = _Events(events, fail)
+        self.streams.append(stream)
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=stream)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setenv(BASE_URL_ENV, "http://llm.test/v1")
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    mock = MockServer()
+    transport = httpx.MockTransport(mock)
+    real_client = httpx.AsyncClient
+
+    class _Client(real_client):
+        def __init__(self, **kwargs):
+            super().__init__(transport=transport, **kwargs)
+
+    # 网关创建的连接池改走 mock 服务，不访问网络
+    monkeypatch.setattr(gateway_module.httpx, "AsyncClient", _Client)
+    return mock
+
+
+async def _collect(gateway, parts):
+    try:
+        async for part in gateway.stream(MODEL, "hello", "system"):
+            parts.append(part)
+    finally:
+        await gateway.aclose()
+
+
+def test_stream_deltas(server):
+    server.responses = [(200, {}, _sse("Hello", ", ", "world"), False)]
+    gateway, parts = LLMGateway(backoff=0.0), []
+    asyncio.run(_collect(gateway, parts))
+    assert parts == ["Hello", ", ", "world"]
+    assert str(server.requests[0].url) == "http://llm.test/v1/chat/completions"
+    assert json.loads(server.requests[0].content)["messages"][0] == {"role": "system", "content": "system"}
+    assert server.streams[0].closed
+    assert gateway.stats()["in_flight"] == 0
+
+
+def test_retry_on_rate_limit(server):
+    server.responses = [
+        (429, {"retry-after": "0"}, None, False),
+        (503, {"retry-after": "0"}, None, False),
+        (200, {}, _sse("ok"), False),
+    ]
+    gateway, parts = LLMGateway(backoff=0.0), []
+    asyncio.run(_collect(gateway, parts))
+    assert parts == ["ok"]
+    assert len(server.requests) == 3
+    assert gateway.stats()["retries"] == 2
+
+
+def test_retry_honours_retry_after(server, monkeypatch):
+    server.responses = [(429, {"retry-after": "2"}, None, False), (200, {}, _sse("ok"), False)]
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(gateway_module.asyncio, "sleep", fake_sleep)
+    gateway, parts = LLMGateway(backoff=0.0), []
+    asyncio.run(_collect(gateway, parts))
+    assert parts == ["ok"]
+    # 退避时间不短于服务端建议的等待时间
+    assert delays and delays[0] >= 2.0
+
+
+def test_no_retry_after_first_chunk(server):
+    server.responses = [(200, {}, _sse("partial", "rest"), True), (200, {}, _sse("again"), False)]
+    gateway, parts = LLMGateway(backoff=0.0), []
+    with pytest.raises(LLMError):
+        asyncio.run(_collect(gateway, parts))
+    # 已输出的内容不会因重试而重复
+    assert parts == ["partial"]
+    assert len(server.requests) == 1
+    assert gateway.stats()["retries"] == 0
+    assert server.streams[0].closed
+
+
+def test_retry_on_disconnect_before_first_chunk(server):
+    server.responses = [(200, {}, [b": keep-alive\n\n"] + _sse("late"), True), (200, {}, _sse("ok"), False)]
+    gateway, parts = LLMGateway(backoff=0.0), []
+    asyncio.run(_collect(gateway, parts))
+    assert parts == ["ok"]
+    assert len(server.requests) == 2
+
+
+def test_client_error_is_not_retried(server):
+    server.responses = [(400, {}, None, False)]
+    gateway = LLMGateway(backoff=0.0)
+    with pytest.raises(LLMError):
+        asyncio.run(_collect(gateway, []))
+    assert len(server.requests) == 1
+
+
+def test_stream_closed_when_consumer_stops(server):
+    server.responses = [(200, {}, _sse("first", "second", "third"), False)]
+    gateway = LLMGateway(backoff=0.0)
+
+    async def first_part():
+        parts = gateway.stream(MODEL, "hello")
+        try:
+            return await parts.__anext__()
+        finally:
+            # 调用方只读第一段就停止 (如界面上取消)，响应要立即关闭，连接回到连接池
+            await parts.aclose()
+            assert server.streams[0].closed
+            await gateway.aclose()
+
+    assert asyncio.run(first_part()) == "first"
+    assert gateway.stats()["in_flight"] == 0
@@ -0,0 +1,118 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("moviepy")
+
+from utils import reader_pool
+from utils.reader_pool import VideoReaderPool
+
+
+class FakeClip:
+    # 代替 VideoFileClip，不启动 ffmpeg，只记录打开和关闭
+    opened = []
+
+    def __init__(self, path, audio=True):
+        self.path = path
+        self.audio = audio
+        self.closed = False
+        FakeClip.opened.append(self)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def videos(tmp_path, monkeypatch):
+    FakeClip.opened = []
+    monkeypatch.setattr(reader_pool, "VideoFileClip", FakeClip)
+    paths = []
+    for i in range(3):
+        # 读取器按文件大小/修改时间区分，需要真实存在的文件
+        path = tmp_path / f"video{i}.mp4"
+        path.write_bytes(b"0" * (i + 1))
+        paths.append(str(path))
+    return paths
+
+
+def _wait_until(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_leases_are_exclusive(videos):
+    pool = VideoReaderPool(max_open=4)
+    with pool.lease(videos[0]) as first, pool.lease(videos[0]) as second:
+        # 同一文件同时借用时各自独占一个读取器
+        assert first is not second
+        assert pool.stats()["in_use"] == 2
+    # 归还后同一文件的下一次借用复用空闲读取器
+    with pool.lease(videos[0]) as third:
+        assert third in (first, second)
+    assert len(FakeClip.opened) == 2
+    # 音频开关不同的读取器不共用
+    with pool.lease(videos[0], audio=False) as silent:
+        assert silent not in (first, second)
+
+
+def test_failed_lease_is_not_reused(videos):
+    pool = VideoReaderPool(max_open=4)
+    with pytest.raises(ValueError):
+        with pool.lease(videos[0]) as clip:
+            raise ValueError("decode error")
+    assert clip.closed
+    assert pool.stats()["open"] == 0
+
+
+def test_max_open_cap(videos):
+    pool = VideoReaderPool(max_open=2)
+    first = pool.acquire(videos[0])
+    second = pool.acquire(videos[1])
+    acquired = threading.Event()
+
+    def third():
+        lease = pool.acquire(videos[2])
+        acquired.set()
+        lease.release()
+
+    thread = threading.Thread(target=third, daemon=True)
+    thread.start()
+    # 全部借出时新的借用等待归还，而不是超过上限打开新的读取器
+    assert not acquired.wait(0.2)
+    assert pool.stats()["open"] == 2
+    first.release()
+    assert acquired.wait(5)
+    thread.join(5)
+    # 为打开新文件关闭了最久未用的空闲读取器
+    assert first.clip.closed
+    assert pool.stats()["open"] <= 2
+    second.release()
+
+
+def test_idle_readers_are_reaped(videos):
+    pool = VideoReaderPool(max_open=4, idle_timeout=0.05)
+    lease = pool.acquire(videos[0])
+    clip = lease.clip
+    lease.release()
+    assert pool.stats() == {"open": 1, "in_use": 0, "max_open": 4}
+    # 后台线程关闭空闲超时的读取器，池空后退出
+    _wait_until(lambda: pool.stats()["open"] == 0)
+    assert clip.closed
+    _wait_until(lambda: pool._reaper is None)
+
+
+def test_busy_readers_are_not_reaped(videos):
+    pool = VideoReaderPool(max_open=4, idle_timeout=0.05)
+    with pool.lease(videos[0]) as clip:
+        time.sleep(0.1)
+        pool.acquire(videos[1]).release()   # 借用时也会清理超时的空闲读取器
+        assert not clip.closed
+    pool.close_all()
+    assert pool.stats()["open"] == 0
@@ -0,0 +1,80 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.render_plan import RenderPlan, segment_frames
+
+FPS = 25.0
+VIDEO = {"path": "/tmp/source.mp4", "size": 1024, "mtime": 0}
+
+
+def _plan(durations):
+    plan = RenderPlan(video=VIDEO, bgm=None, seed=7)
+    beat = 0.0
+    for i, duration in enumerate(durations):
+        # 每个镜头取自源视频中固定的位置，只有时长变化
+        src = 10.0 * i
+        beat += duration
+        plan.add_shot(src, src + duration, duration, beat=beat,
+                      transition="crossfade" if i else "cut", transition_duration=0.3 if i else 0.0)
+    return plan
+
+
+def _timeline(plan):
+    # 与 VideoClipper._render_plan_visuals 相同的排布：每个镜头与上一个镜头重叠转场时长
+    starts, cursor = [], 0.0
+    for i, shot in enumerate(plan.shots):
+        overlap = shot["transition_duration"] if i else 0.0
+        start = max(cursor - overlap, 0.0)
+        starts.append(start)
+        cursor = start + shot["duration"]
+    return starts, cursor
+
+
+def _segments(plan):
+    starts, duration = _timeline(plan)
+    frames = segment_frames(starts, duration, FPS)
+    return starts, duration, frames, plan.segment_keys(frames, starts, FPS)
+
+
+def _check_boundaries(starts, duration, frames):
+    assert sum(count for _, count in frames) == int(round(duration * FPS))
+    assert frames[0][0] == 0
+    for i in range(1, len(frames)):
+        first, _ = frames[i]
+        prev_first, prev_count = frames[i - 1]
+        assert prev_first + prev_count == first
+        assert first == int(round(starts[i] * FPS))
+
+
+def test_rerender_after_one_shot_changes():
+    before = _plan([2.013, 1.5, 2.2, 1.7])
+    starts, duration, frames, keys = _segments(before)
+    _check_boundaries(starts, duration, frames)
+
+    # 第 2 个镜头变长不到一帧：后面镜头的位置整体后移，采样相位变化
+    after = _plan([2.013, 1.513, 2.2, 1.7])
+    new_starts, new_duration, new_frames, new_keys = _segments(after)
+    _check_boundaries(new_starts, new_duration, new_frames)
+
+    assert new_keys[0] == keys[0]
+    assert new_keys[1] != keys[1]
+    assert new_keys[2] != keys[2]
+    # 镜头 3 的参数未变，但相对帧网格的相位变了，不能复用旧片段
+    assert new_keys[3] != keys[3]
+
+
+def test_whole_frame_shift_reuses_segments():
+    before = _plan([2.013, 1.5, 2.2, 1.7])
+    _, _, frames, keys = _segments(before)
+
+    # 第 1 个镜头之后的位置整体后移正好一帧，后面的片段帧数和相位都不变
+    after = _plan([2.013, 1.54, 2.2, 1.7])
+    new_starts, new_duration, new_frames, new_keys = _segments(after)
+    _check_boundaries(new_starts, new_duration, new_frames)
+
+    assert new_keys[1] != keys[1]
+    assert new_keys[3] == keys[3]
+    assert new_frames[3][0] == frames[3][0] + 1
+    assert new_frames[3][1] == frames[3][1]
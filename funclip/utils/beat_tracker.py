@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# 流式节拍分析 - 分块计算整首曲目的起音包络，按曲目缓存节拍网格
+
+import os
+import json
+import hashlib
+import logging
+from typing import Dict, List, Optional
+
+import librosa
+import numpy as np
+
+from .ffmpeg_utils import stream_pcm
+from .file_utils import file_signature
+
+
+class BeatTracker:
+    """
+    流式节拍分析器
+    以较低的分析采样率分块读取整首曲目，逐块计算频谱通量(起音强度)，
+    块与块之间携带重叠样本和上一帧频谱，保证包络连续；音频本身的内存占用恒定。
+    节拍网格按曲目(路径+大小+修改时间)缓存为 JSON。
+    """
+
+    # 起音包络算法的版本，改变算法时递增，使旧的缓存失效
+    ENVELOPE_VERSION = 2
+
+    def __init__(self, cache_dir: Optional[str] = None, sr: int = 11025,
+                 hop_length: int = 256, n_fft: int = 1024, n_mels: int = 64,
+                 block_seconds: float = 30.0):
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "funclip", "beats")
+        self.cache_dir = cache_dir
+        self.sr = sr
+        self.hop_length = hop_length
+        self.n_fft = n_fft
+        self.n_mels = n_mels
+        # 块长度对齐到 hop，便于帧连续
+        self.block_samples = int(block_seconds * sr) // hop_length * hop_length
+        self._mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels)
+
+    def _cache_path(self, signature: Dict) -> str:
+        params = [self.sr, self.hop_length, self.n_fft, self.n_mels, self.ENVELOPE_VERSION]
+        key = json.dumps([signature, params], sort_keys=True, ensure_ascii=False)
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"beats_{digest}.json")
+
+    def onset_envelope(self, audio_path: str):
+        """
+        分块计算整首曲目的起音包络
+        :return: (onset_envelope, 曲目时长秒)
+        """
+        hop, n_fft = self.hop_length, self.n_fft
+        carry = np.zeros(0, dtype=np.float32)
+        prev_db = None
+        envelopes = []
+        total_samples = 0
+
+        for block in stream_pcm(audio_path, self.sr, self.block_samples):
+            total_samples += len(block)
+            y = np.concatenate([carry, block])
+            if len(y) < n_fft:
+                carry = y
+                continue
+            n_frames = 1 + (len(y) - n_fft) // hop
+            stft = librosa.stft(y[:(n_frames - 1) * hop + n_fft], n_fft=n_fft,
+                                hop_length=hop, center=False)
+            # 固定参考值、不按块截断动态范围：默认 top_db 以每块自己的最大值为基准，块边界处包络会跳变
+            mel_db = librosa.power_to_db(self._mel_basis @ (np.abs(stft) ** 2), ref=1.0, top_db=None)
+            # 频谱通量：相邻帧 dB 差值的正部分在 mel 维上取平均 (同 librosa.onset.onset_strength)
+            if prev_db is None:
+                flux = np.maximum(0.0, np.diff(mel_db, axis=1, prepend=mel_db[:, :1]))
+            else:
+                flux = np.maximum(0.0, np.diff(mel_db, axis=1, prepend=prev_db))
+            envelopes.append(flux.mean(axis=0))
+            prev_db = mel_db[:, -1:]
+            carry = y[n_frames * hop:]
+
+        if not envelopes:
+            return np.zeros(0, dtype=np.float32), total_samples / self.sr
+        return np.concatenate(envelopes), total_samples / self.sr
+
+    def analyze(self, audio_path: str) -> Dict:
+        """
+        分析整首曲目的节拍网格 (带缓存)
+        :return: {"tempo": BPM, "beats": [秒...], "duration": 秒}
+        """
+        signature = file_signature(audio_path)
+        cache_path = self._cache_path(signature)
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except Exception as e:
+                logging.warning(f"Failed to load beat cache {cache_path}: {e}")
+
+        env, duration = self.onset_envelope(audio_path)
+        beats = []
+        tempo = 0.0
+        if len(env) > 1:
+            tempo, beat_frames = librosa.beat.beat_track(onset_envelope=env, sr=self.sr,
+                                                         hop_length=self.hop_length)
+            # center=False 的帧对应窗口起点，补偿半个窗口长度
+            offset = self.n_fft / 2.0 / self.sr
+            beats = (librosa.frames_to_time(beat_frames, sr=self.sr, hop_length=self.hop_length)
+                     + offset).tolist()
+            tempo = float(np.atleast_1d(tempo)[0])
+
+        grid = {"tempo": tempo, "beats": beats, "duration": duration}
+        # 没有解出任何音频时不缓存，下次重新分析
+        if len(env):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(cache_path, "w", encoding="utf-8") as f:
+                json.dump(grid, f)
+        logging.info(f"Beat grid for {audio_path}: {len(beats)} beats, {tempo:.1f} BPM, {duration:.1f}s")
+        return grid
+
+
+def extend_beats(beats: List[float], loop_period: float, until: float) -> List[float]:
+    """
+    BGM 循环播放时，按曲目时长把节拍网格平移延伸到 until 秒
+    """
+    if not beats or loop_period <= 0 or until <= loop_period:
+        return list(beats)
+    base = np.asarray(beats)
+    base = base[base < loop_period]
+    n_loops = int(np.ceil(until / loop_period))
+    extended = np.concatenate([base + k * loop_period for k in range(n_loops)])
+    return extended[extended <= until].tolist()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# 色彩分级 - 把模板的亮度/对比度/Gamma/色温编译成逐通道查找表，饱和度编译成 3x3 矩阵
+
+from typing import Dict
+
+import numpy as np
+
+# Rec.601 亮度权重 (RGB)
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def colorx_curve(x: np.ndarray, factor: float) -> np.ndarray:
+    # 与 vfx.colorx 一致：乘系数后截断到 255 并取整
+    return np.floor(np.minimum(255.0, x * factor))
+
+
+def lum_contrast_curve(x: np.ndarray, lum: float = 0, contrast: float = 0, thr: float = 127) -> np.ndarray:
+    # 与 vfx.lum_contrast 一致
+    return np.floor(np.clip(x + lum + contrast * (x - thr), 0, 255))
+
+
+def gamma_curve(x: np.ndarray, gamma: float) -> np.ndarray:
+    # 与 vfx.gamma_corr 一致
+    return np.floor(255.0 * (x / 255.0) ** gamma)
+
+
+def temperature_gains(temperature: float) -> np.ndarray:
+    """
+    色温系数转换为 RGB 增益：>1 偏暖 (加红减蓝)，<1 偏冷
+    """
+    shift = float(temperature) - 1.0
+    return np.array([1.0 + shift, 1.0, 1.0 - shift], dtype=np.float64)
+
+
+class ColorGrader:
+    """
+    融合的色彩分级参数
+    色温、亮度、对比度、Gamma 都是逐像素逐通道的映射，按原有顺序复合成一张 256x3 的查找表；
+    饱和度是像素内三通道的线性组合 (向亮度混合)，编译成一个 3x3 矩阵。
+    两者由 FilterGraph.add_color_grading 加入滤镜图。
+    """
+
+    def __init__(self, color_config: Dict):
+        self.brightness = color_config.get("brightness", 1.0)
+        self.contrast = color_config.get("contrast", 1.0)
+        self.saturation = color_config.get("saturation", 1.0)
+        self.gamma = color_config.get("gamma", 1.0)
+        self.temperature = color_config.get("temperature", 1.0)
+        self.lut = self._build_lut()
+        self.matrix = self._build_saturation_matrix()
+
+    def _build_lut(self) -> np.ndarray:
+        x = np.arange(256, dtype=np.float64)
+        channels = []
+        for gain in temperature_gains(self.temperature):
+            y = colorx_curve(x, gain) if gain != 1.0 else x
+            if self.brightness != 1.0:
+                y = colorx_curve(y, self.brightness)
+            if self.contrast != 1.0:
+                y = lum_contrast_curve(y, lum=0, contrast=(self.contrast - 1.0) * 0.5)
+            if self.gamma != 1.0:
+                y = gamma_curve(y, self.gamma)
+            channels.append(np.clip(y, 0, 255))
+        return np.stack(channels, axis=-1).astype(np.uint8).reshape(1, 256, 3)
+
+    def _build_saturation_matrix(self):
+        if self.saturation == 1.0:
+            return None
+        s = float(self.saturation)
+        # out = luma + s * (rgb - luma)
+        return (s * np.eye(3, dtype=np.float32)
+                + (1.0 - s) * np.tile(_LUMA, (3, 1))).astype(np.float32)
+
+    @property
+    def is_identity(self) -> bool:
+        identity = np.arange(256, dtype=np.uint8)[:, None]
+        return self.matrix is None and bool((self.lut[0] == identity).all())
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# 常驻服务客户端 - 探测本地 FunClip 服务并把 CLI 任务转发过去 (只依赖标准库，导入开销可忽略)
+
+import http.client
+import json
+import os
+import socket
+from typing import Dict, Optional, Tuple
+
+
+
+def _runtime_dir() -> str:
+    """服务的 socket 和令牌文件所在目录 (只有当前用户可访问)"""
+    base = os.environ.get("XDG_RUNTIME_DIR") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "funclip")
+
+
+# 服务地址：unix:/path/to/funclip.sock 或 http://127.0.0.1:7870，可用环境变量 FUNCLIP_DAEMON 覆盖
+# 默认使用权限为 0600 的 Unix socket：本机网页无法像访问 localhost 端口那样跨域访问它
+DEFAULT_DAEMON_ADDRESS = ("unix:" + os.path.join(_runtime_dir(), "daemon.sock")
+                          if hasattr(socket, "AF_UNIX") else "http://127.0.0.1:7870")
+DAEMON_ENV = "FUNCLIP_DAEMON"
+
+
+def daemon_address() -> str:
+    return os.environ.get(DAEMON_ENV) or DEFAULT_DAEMON_ADDRESS
+
+
+def parse_address(address: str) -> Tuple[str, object]:
+    """
+    解析服务地址
+    :return: ("unix", socket 路径) 或 ("tcp", (host, port))
+    """
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    hostport = address.split("://", 1)[-1].rstrip("/")
+    host, _, port = hostport.rpartition(":")
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+def token_path(address: str) -> str:
+    """
+    服务令牌文件的路径：服务每次启动生成新的令牌写入该文件 (权限 0600)，客户端读取后随请求发送
+    Unix socket 为 <socket 路径>.token，TCP 为运行目录下的 daemon-<端口>.token
+    """
+    kind, target = parse_address(address)
+    if kind == "unix":
+        return target + ".token"
+    return os.path.join(_runtime_dir(), "daemon-{}.token".format(target[1]))
+
+
+def read_token(address: str) -> Optional[str]:
+    try:
+        with open(token_path(address), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self._socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self._socket_path)
+
+
+def _connection(address: str, timeout: Optional[float]) -> http.client.HTTPConnection:
+    kind, target = parse_address(address)
+    if kind == "unix":
+        return _UnixHTTPConnection(target, timeout=timeout)
+    host, port = target
+    return http.client.HTTPConnection(host, port, timeout=timeout)
+
+
+def _request(address: str, method: str, path: str, payload: Optional[Dict] = None,
+             timeout: Optional[float] = None) -> Dict:
+    conn = _connection(address, timeout)
+    try:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        token = read_token(address)
+        if token:
+            headers["Authorization"] = "Bearer " + token
+        conn.request(method, path, body=body, headers=headers)
+        resp = conn.getresponse()
+        data = json.loads(resp.read().decode("utf-8") or "{}")
+        if resp.status != 200:
+            raise RuntimeError(data.get("error") or f"daemon returned HTTP {resp.status}")
+        return data
+    finally:
+        conn.close()
+
+
+def daemon_status(address: Optional[str] = None, timeout: float = 0.5) -> Optional[Dict]:
+    """服务在运行时返回其状态 (已加载的模型等)，否则返回 None"""
+    try:
+        return _request(address or daemon_address(), "GET", "/health", timeout=timeout)
+    except (OSError, ValueError, RuntimeError, http.client.HTTPException):
+        return None
+
+
+def _absolute_job(job: Dict) -> Dict:
+    # 服务进程的工作目录与 CLI 不同，路径一律转成绝对路径
+    job = dict(job)
+    if job.get("file"):
+        job["file"] = ",".join(os.path.abspath(f.strip()) for f in job["file"].split(",") if f.strip())
+    for key in ("output_dir", "output_file"):
+        if job.get(key):
+            job[key] = os.path.abspath(job[key])
+    return job
+
+
+def submit_job(job: Dict, address: Optional[str] = None) -> Dict:
+    """
+    把一次 runner 调用 (stage 1 识别或 stage 2 裁剪) 交给服务执行，阻塞直到完成
+    :param job: runner 的关键字参数
+    :return: {"result": runner 的返回值}
+    """
+    data = _request(address or daemon_address(), "POST", "/run", payload=_absolute_job(job))
+    if not data.get("ok"):
+        raise RuntimeError(data.get("error", "daemon job failed"))
+    return data
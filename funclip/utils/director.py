@@ -1,3 +1,4 @@
+import random
 import numpy as np
 import logging
 from sentence_transformers import SentenceTransformer, util
@@ -108,12 +109,13 @@ class Director:
     #         })
     #     return plan
 
-    def decide_transitions(self, shots):
+    def decide_transitions(self, shots, seed=0):
         """
         基于语义相似度决定转场类型
+        :param seed: 随机种子，同样的输入和种子总是得到同样的转场规划
         """
         transitions = []
-        import random # 引入随机增加趣味性
+        rng = random.Random(seed) # 引入随机增加趣味性 (带种子，保证可复现)
         
         for i in range(len(shots) - 1):
             curr = shots[i]
@@ -133,7 +135,7 @@ class Director:
             # [修改] 更加丰富的转场决策逻辑
             if scene_sim < 0.4:
                 # 场景差异巨大 -> 使用推镜 (Slide) 或 划像 (Wipe)
-                t_type = random.choice(["slide_left", "slide_up", "zoom_in"])
+                t_type = rng.choice(["slide_left", "slide_up", "zoom_in"])
                 duration = 0.6
                 
             elif scene_sim < 0.7:
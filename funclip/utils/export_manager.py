@@ -3,9 +3,26 @@
 # 视频导出管理器 - 支持多分辨率、多平台格式适配
 
 import os
+import shutil
 import logging
-from moviepy.editor import VideoFileClip
-from typing import Dict, List, Tuple, Optional
+import tempfile
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple, Optional
+from .ffmpeg_utils import probe_media, run_ffmpeg
+from .file_utils import file_signature
+from .loudness import measure_file
+from .job_scheduler import JobCancelled, check_cancelled, moviepy_logger, report_progress
+from .reader_pool import video_readers
+
+
+@lru_cache(maxsize=64)
+def _source_loudness(path: str, size: int, mtime: int) -> Optional[Tuple[float, float]]:
+    """源文件的 (积分响度, 真峰值)，按文件签名缓存；没有音轨时为 None"""
+    if not probe_media(path).get("has_audio"):
+        return None
+    meter = measure_file(path)
+    return meter.integrated_loudness(), meter.true_peak_db()
+
 
 class ExportManager:
     """
@@ -60,6 +77,7 @@ class ExportManager:
             "bitrate": "2000k",
             "fps": 25,
             "preset": "fast",
+            "audio_bitrate": "128k",
             "max_size_mb": 25  # 微信视频限制25MB
         },
         "高质量/High Quality": {
@@ -71,9 +89,206 @@ class ExportManager:
         }
     }
     
+    # 按文件大小限制计算码率时预留给容器封装开销的比例
+    SIZE_SAFETY_MARGIN = 0.96
+    # 码率下限 (kbps)，低于此值画质已不可用，只给出警告
+    MIN_VIDEO_KBPS = 150
+    # 两遍编码的码率底线 (kbps) 和超出预算时最多重做第二遍的次数
+    FLOOR_VIDEO_KBPS = 50
+    MAX_SIZE_RETRIES = 4
+    
     def __init__(self):
         self.logger = logging.getLogger(__name__)
     
+    @staticmethod
+    def _parse_kbps(bitrate: str) -> float:
+        """把 "5000k" / "5M" / "128000" 形式的码率转换为 kbps"""
+        text = str(bitrate).strip().lower()
+        if text.endswith("k"):
+            return float(text[:-1])
+        if text.endswith("m"):
+            return float(text[:-1]) * 1000
+        return float(text) / 1000
+    
+    def size_constrained_bitrate(
+        self,
+        duration: float,
+        max_size_mb: float,
+        audio_bitrate: str = "128k",
+        preset_bitrate: Optional[str] = None
+    ) -> str:
+        """
+        根据时长和文件大小预算计算视频码率
+        
+        预算扣除音频码率和封装开销后平均分配到每一秒；不超过平台预设码率。
+        """
+        budget_kbits = max_size_mb * 1024 * 1024 * 8 / 1000 * self.SIZE_SAFETY_MARGIN
+        video_kbps = budget_kbits / max(duration, 0.1) - self._parse_kbps(audio_bitrate)
+        if preset_bitrate:
+            video_kbps = min(video_kbps, self._parse_kbps(preset_bitrate))
+        if video_kbps < self.MIN_VIDEO_KBPS:
+            print(f"[导出引擎] ⚠️ 时长 {duration:.1f}s 在 {max_size_mb}MB 内只能分配 {video_kbps:.0f}kbps，画质会明显下降")
+            self.logger.warning(f"大小预算过紧: {duration:.1f}s / {max_size_mb}MB -> {video_kbps:.0f}kbps")
+            video_kbps = max(video_kbps, self.FLOOR_VIDEO_KBPS)
+        return f"{int(video_kbps)}k"
+    
+    def _two_pass_encode(
+        self,
+        video_path: str,
+        output_path: str,
+        settings: Dict[str, Any],
+        duration: float,
+        max_size_mb: float
+    ) -> str:
+        """
+        两遍 ABR 编码：第一遍只做码率分析，第二遍按分析结果精确分配码率，
+        使输出大小落在预算内。万一仍超出 (封装开销估计偏小)，按超出比例降低码率只重做第二遍，
+        直到大小达标；码率降到 FLOOR_VIDEO_KBPS 仍超出时抛出异常，不把超限的文件当作成功。
+        
+        返回:
+            实际使用的视频码率
+        """
+        audio_bitrate = settings["platform_config"].get("audio_bitrate", "128k")
+        bitrate = self.size_constrained_bitrate(
+            duration, max_size_mb, audio_bitrate, settings["platform_config"].get("bitrate")
+        )
+        vf = f"scale={settings['width']}:{settings['height']},fps={settings['fps']}"
+        common = ["-i", video_path, "-vf", vf, "-c:v", settings["codec"],
+                  "-preset", settings["preset"], "-pix_fmt", "yuv420p"]
+        log_dir = tempfile.mkdtemp(prefix="funclip_2pass_")
+        passlog = os.path.join(log_dir, "pass")
+        try:
+            print(f"[导出引擎] 🔍 第一遍分析 (目标码率 {bitrate})...")
+            run_ffmpeg(common + ["-b:v", bitrate, "-pass", "1", "-passlogfile", passlog,
+                                 "-an", "-f", "null", "-"])
+            for attempt in range(self.MAX_SIZE_RETRIES + 1):
+                check_cancelled()
+                print(f"[导出引擎] ⏳ 第二遍编码 (码率 {bitrate})...")
+                run_ffmpeg(common + ["-b:v", bitrate, "-pass", "2", "-passlogfile", passlog,
+                                     "-c:a", settings["audio_codec"], "-b:a", audio_bitrate,
+                                     "-movflags", "+faststart", output_path])
+                size_mb = os.path.getsize(output_path) / (1024 * 1024)
+                if size_mb <= max_size_mb:
+                    return bitrate
+                current = self._parse_kbps(bitrate)
+                if current <= self.FLOOR_VIDEO_KBPS:
+                    break
+                scaled = max(current * max_size_mb / size_mb * self.SIZE_SAFETY_MARGIN, self.FLOOR_VIDEO_KBPS)
+                print(f"[导出引擎] ⚠️ 输出 {size_mb:.2f}MB 超出预算，降低码率重新编码")
+                bitrate = f"{int(scaled)}k"
+            raise RuntimeError(
+                f"输出 {size_mb:.2f}MB 超出 {max_size_mb}MB 大小限制 (视频码率已降至 {bitrate})，"
+                f"请缩短视频或降低分辨率")
+        finally:
+            shutil.rmtree(log_dir, ignore_errors=True)
+    
+    def resolve_export_settings(
+        self,
+        original_size: Tuple[int, int],
+        resolution: str = "原始/Original",
+        platform: str = "通用/Universal",
+        custom_width: Optional[int] = None,
+        custom_height: Optional[int] = None,
+        custom_bitrate: Optional[str] = None,
+        custom_fps: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        根据分辨率/平台预设和自定义参数计算最终的导出参数
+        
+        返回:
+            包含 width/height/codec/audio_codec/bitrate/fps/preset/platform_config 的字典
+        """
+        original_width, original_height = original_size
+        
+        # 获取平台配置
+        platform_config = self.PLATFORM_PRESETS.get(
+            platform, 
+            self.PLATFORM_PRESETS["通用/Universal"]
+        )
+        print(f"[导出引擎] 🎯 平台配置: {platform}")
+        
+        # 确定输出分辨率
+        if custom_width and custom_height:
+            target_width, target_height = custom_width, custom_height
+            print(f"[导出引擎] ⚙️ 使用自定义分辨率: {target_width}x{target_height}")
+        elif resolution != "原始/Original" and resolution in self.RESOLUTION_PRESETS:
+            target_width, target_height = self.RESOLUTION_PRESETS[resolution]
+            # 如果原始分辨率小于目标分辨率，则保持原始分辨率
+            if original_width < target_width or original_height < target_height:
+                target_width, target_height = original_width, original_height
+                print(f"[导出引擎] ℹ️ 原始分辨率小于目标，保持原始: {target_width}x{target_height}")
+                self.logger.warning(f"原始分辨率({original_width}x{original_height})小于目标分辨率，保持原始分辨率")
+            else:
+                print(f"[导出引擎] 📐 使用预设分辨率: {target_width}x{target_height}")
+        else:
+            target_width, target_height = original_width, original_height
+            print(f"[导出引擎] 📐 保持原始分辨率: {target_width}x{target_height}")
+        
+        return {
+            "width": target_width,
+            "height": target_height,
+            "codec": platform_config.get("codec", "libx264"),
+            "audio_codec": platform_config.get("audio_codec", "aac"),
+            "bitrate": custom_bitrate if custom_bitrate else platform_config.get("bitrate", "5000k"),
+            "fps": custom_fps if custom_fps else platform_config.get("fps", 30),
+            "preset": platform_config.get("preset", "medium"),
+            "platform_config": platform_config,
+        }
+    
+    def _loudness_report(self, video_path: str) -> str:
+        """
+        源视频的积分响度和真峰值 (BS.1770)，没有音轨或测量失败时返回空字符串
+        导出只重新编码音频、不改变响度，所以在源文件上测量一次，各导出版本 (含批量导出) 共用结果
+        """
+        try:
+            sig = file_signature(video_path)
+            measured = _source_loudness(sig["path"], sig["size"], sig["mtime"])
+        except Exception as e:
+            self.logger.warning(f"响度测量失败: {e}")
+            return ""
+        if measured is None:
+            return ""
+        lufs, peak = measured
+        print(f"[导出引擎] 🔊 源音频响度: {lufs:.1f} LUFS, 真峰值: {peak:.1f} dBTP")
+        report = f"\n🔊 源音频响度: {lufs:.1f} LUFS / 真峰值 {peak:.1f} dBTP"
+        if peak > -1.0:
+            report += "\n⚠️ 真峰值高于 -1 dBTP，平台转码后可能出现削波"
+        return report
+
+    def _finish_export_message(
+        self,
+        video_path: str,
+        output_path: str,
+        platform: str,
+        platform_config: Dict,
+        target_width: int,
+        target_height: int,
+        bitrate: str,
+        fps: int
+    ) -> str:
+        """检查导出文件大小并生成结果消息"""
+        file_size_mb = os.path.getsize(output_path) / (1024 * 1024)
+        max_size_mb = platform_config.get("max_size_mb")
+        
+        print(f"[导出引擎] 💾 文件大小: {file_size_mb:.2f} MB")
+        
+        size_warning = ""
+        if max_size_mb and file_size_mb > max_size_mb:
+            size_warning = f"\n⚠️ 警告: 文件大小({file_size_mb:.1f}MB)超过{platform}推荐的{max_size_mb}MB限制"
+            print(f"[导出引擎] ⚠️ 文件大小超出限制: {file_size_mb:.1f}MB > {max_size_mb}MB")
+        
+        success_msg = f"✅ 视频导出成功!\n"
+        success_msg += f"📁 路径: {output_path}\n"
+        success_msg += f"📐 分辨率: {target_width}x{target_height}\n"
+        success_msg += f"📊 比特率: {bitrate}\n"
+        success_msg += f"🎬 帧率: {fps} fps\n"
+        success_msg += f"💾 文件大小: {file_size_mb:.2f} MB"
+        success_msg += self._loudness_report(video_path)
+        success_msg += size_warning
+        
+        print(f"[导出引擎] ✅ 导出成功! {target_width}x{target_height}, {file_size_mb:.2f}MB")
+        return success_msg
+    
     def export_video(
         self,
         video_path: str,
@@ -101,6 +316,7 @@ class ExportManager:
         返回:
             (成功标志, 消息)
         """
+        lease = None
         try:
             print(f"\n[导出引擎] ⚙️ 开始视频导出处理")
             
@@ -128,36 +344,39 @@ class ExportManager:
 
             print(f"[导出引擎] 💾 输出文件: {output_path}")
             
-            # 加载视频
-            print(f"[导出引擎] 🔧 加载视频...")
-            video = VideoFileClip(video_path)
-            original_width, original_height = video.size
+            # 分辨率和时长从探测结果读取，只有 moviepy 编码路径才借用读取器
+            info = probe_media(video_path)
+            original_width, original_height = info["width"], info["height"]
             print(f"[导出引擎] 📏 原始分辨率: {original_width}x{original_height}")
             
-            # 获取平台配置
-            platform_config = self.PLATFORM_PRESETS.get(
-                platform, 
-                self.PLATFORM_PRESETS["通用/Universal"]
+            settings = self.resolve_export_settings(
+                (original_width, original_height), resolution, platform,
+                custom_width, custom_height, custom_bitrate, custom_fps
             )
-            print(f"[导出引擎] 🎯 平台配置: {platform}")
+            platform_config = settings["platform_config"]
+            target_width, target_height = settings["width"], settings["height"]
             
-            # 确定输出分辨率
-            if custom_width and custom_height:
-                target_width, target_height = custom_width, custom_height
-                print(f"[导出引擎] ⚙️ 使用自定义分辨率: {target_width}x{target_height}")
-            elif resolution != "原始/Original" and resolution in self.RESOLUTION_PRESETS:
-                target_width, target_height = self.RESOLUTION_PRESETS[resolution]
-                # 如果原始分辨率小于目标分辨率，则保持原始分辨率
-                if original_width < target_width or original_height < target_height:
-                    target_width, target_height = original_width, original_height
-                    print(f"[导出引擎] ℹ️ 原始分辨率小于目标，保持原始: {target_width}x{target_height}")
-                    self.logger.warning(f"原始分辨率({original_width}x{original_height})小于目标分辨率，保持原始分辨率")
-                else:
-                    print(f"[导出引擎] 📐 使用预设分辨率: {target_width}x{target_height}")
-            else:
-                target_width, target_height = original_width, original_height
-                print(f"[导出引擎] 📐 保持原始分辨率: {target_width}x{target_height}")
+            max_size_mb = platform_config.get("max_size_mb")
+            if max_size_mb and not custom_bitrate:
+                # 有大小限制的平台：按预算计算码率并两遍编码，一次导出即满足限制
+                duration = info["duration"]
+                print(f"[导出引擎] 📦 大小限制 {max_size_mb}MB，时长 {duration:.1f}s，使用两遍编码")
+                output_dir = os.path.dirname(output_path)
+                if output_dir:
+                    os.makedirs(output_dir, exist_ok=True)
+                bitrate = self._two_pass_encode(video_path, output_path, settings, duration, max_size_mb)
+                success_msg = self._finish_export_message(
+                    video_path, output_path, platform, platform_config, target_width, target_height,
+                    bitrate, settings["fps"]
+                )
+                self.logger.info(success_msg)
+                return True, success_msg
             
+            # 加载视频
+            print(f"[导出引擎] 🔧 加载视频...")
+            lease = video_readers.acquire(video_path)
+            video = lease.clip
+
             # 调整分辨率
             if (target_width, target_height) != (original_width, original_height):
                 print(f"[导出引擎] 🔄 调整分辨率: {original_width}x{original_height} → {target_width}x{target_height}")
@@ -165,11 +384,11 @@ class ExportManager:
                 self.logger.info(f"调整分辨率: {original_width}x{original_height} -> {target_width}x{target_height}")
             
             # 确定输出参数
-            codec = platform_config.get("codec", "libx264")
-            audio_codec = platform_config.get("audio_codec", "aac")
-            bitrate = custom_bitrate if custom_bitrate else platform_config.get("bitrate", "5000k")
-            fps = custom_fps if custom_fps else platform_config.get("fps", 30)
-            preset = platform_config.get("preset", "medium")
+            codec = settings["codec"]
+            audio_codec = settings["audio_codec"]
+            bitrate = settings["bitrate"]
+            fps = settings["fps"]
+            preset = settings["preset"]
             
             print(f"[导出引擎] ⚙️ 编码参数:")
             print(f"[导出引擎]    视频编码器: {codec}")
@@ -196,39 +415,28 @@ class ExportManager:
                 fps=fps,
                 preset=preset,
                 threads=4,
-                logger=None  # 禁用moviepy的进度条，避免干扰
+                logger=moviepy_logger("正在编码导出")  # 不输出 moviepy 的进度条，只作为任务进度
             )
             
-            video.close()
-            
-            # 检查文件大小
-            file_size_mb = os.path.getsize(output_path) / (1024 * 1024)
-            max_size_mb = platform_config.get("max_size_mb")
+            lease.release()
             
-            print(f"[导出引擎] 💾 文件大小: {file_size_mb:.2f} MB")
-            
-            size_warning = ""
-            if max_size_mb and file_size_mb > max_size_mb:
-                size_warning = f"\n⚠️ 警告: 文件大小({file_size_mb:.1f}MB)超过{platform}推荐的{max_size_mb}MB限制"
-                print(f"[导出引擎] ⚠️ 文件大小超出限制: {file_size_mb:.1f}MB > {max_size_mb}MB")
-            
-            success_msg = f"✅ 视频导出成功!\n"
-            success_msg += f"📁 路径: {output_path}\n"
-            success_msg += f"📐 分辨率: {target_width}x{target_height}\n"
-            success_msg += f"📊 比特率: {bitrate}\n"
-            success_msg += f"🎬 帧率: {fps} fps\n"
-            success_msg += f"💾 文件大小: {file_size_mb:.2f} MB"
-            success_msg += size_warning
-            
-            print(f"[导出引擎] ✅ 导出成功! {target_width}x{target_height}, {file_size_mb:.2f}MB")
+            success_msg = self._finish_export_message(
+                video_path, output_path, platform, platform_config, target_width, target_height, bitrate, fps
+            )
             self.logger.info(success_msg)
             return True, success_msg
             
+        except JobCancelled:
+            raise
         except Exception as e:
             error_msg = f"❌ 导出失败: {str(e)}"
             print(f"[导出引擎] ❌ 导出失败: {e}")
             self.logger.error(error_msg, exc_info=True)
             return False, error_msg
+        finally:
+            if lease is not None:
+                # 出错时读取器状态不确定，直接关闭 (成功路径上已归还，这里不再生效)
+                lease.release(reusable=False)
     
     def batch_export(
         self,
@@ -259,10 +467,56 @@ class ExportManager:
         base_name = os.path.splitext(os.path.basename(video_path))[0]
         
         total_tasks = len(platforms) * len(resolutions)
-        current_task = 0
         
         print(f"[批量导出引擎] 📊 总任务数: {total_tasks}")
         
+        # 生成所有导出任务
+        jobs = []
+        try:
+            probed = probe_media(video_path)
+            original_size = (probed["width"], probed["height"])
+            for platform in platforms:
+                for resolution in resolutions:
+                    platform_suffix = platform.split('/')[0]  # 取中文部分
+                    res_suffix = resolution.split('/')[0] if '/' in resolution else resolution
+                    output_filename = f"{base_name}_{platform_suffix}_{res_suffix}.mp4"
+                    if self.PLATFORM_PRESETS.get(platform, {}).get("max_size_mb"):
+                        # 有大小限制的版本需要两遍编码，单独走 export_video
+                        continue
+                    jobs.append({
+                        "filename": output_filename,
+                        "output_path": os.path.join(output_dir, output_filename),
+                        "platform": platform,
+                        "resolution": resolution,
+                        "settings": self.resolve_export_settings(original_size, resolution, platform),
+                    })
+        except Exception as e:
+            print(f"[批量导出引擎] ⚠️ 读取视频信息失败: {e}")
+            self.logger.warning(f"批量导出读取视频信息失败: {e}")
+            jobs = []
+        
+        # 一次解码、多路编码；失败时回退到逐个导出
+        if jobs:
+            try:
+                os.makedirs(output_dir, exist_ok=True)
+                print(f"\n[批量导出引擎] ⏳ 共享解码，同时编码 {len(jobs)} 个版本...")
+                self._shared_decode_export(video_path, jobs)
+                for job in jobs:
+                    settings = job["settings"]
+                    msg = self._finish_export_message(
+                        video_path, job["output_path"], job["platform"], settings["platform_config"],
+                        settings["width"], settings["height"], settings["bitrate"], settings["fps"]
+                    )
+                    results[job["filename"]] = (True, msg)
+            except JobCancelled:
+                raise
+            except Exception as e:
+                print(f"[批量导出引擎] ⚠️ 共享解码导出失败，回退到逐个导出: {e}")
+                self.logger.warning(f"共享解码批量导出失败，回退到逐个导出: {e}")
+                results = {}
+        
+        # 共享解码未覆盖的版本 (有大小限制或共享解码失败) 逐个导出
+        current_task = 0
         for platform in platforms:
             for resolution in resolutions:
                 current_task += 1
@@ -270,7 +524,11 @@ class ExportManager:
                 platform_suffix = platform.split('/')[0]  # 取中文部分
                 res_suffix = resolution.split('/')[0] if '/' in resolution else resolution
                 output_filename = f"{base_name}_{platform_suffix}_{res_suffix}.mp4"
+                if output_filename in results:
+                    continue  # 已在共享解码中完成
                 output_path = os.path.join(output_dir, output_filename)
+                check_cancelled()
+                report_progress((current_task - 1) / total_tasks, f"正在导出 {output_filename}")
                 
                 print(f"\n[批量导出引擎] ⏳ [{current_task}/{total_tasks}] 正在导出: {output_filename}")
                 print(f"[批量导出引擎]    平台: {platform}, 分辨率: {resolution}")
@@ -294,6 +552,41 @@ class ExportManager:
         
         return results
     
+    def _shared_decode_export(self, video_path: str, jobs: List[Dict[str, Any]]):
+        """
+        单个 ffmpeg 进程解码一次源视频，通过 filter_complex split 分发给多个编码器，
+        CPU 核心在各编码器之间平均分配
+        
+        参数:
+            video_path: 输入视频路径
+            jobs: 导出任务列表 (包含 output_path 和 settings)
+        """
+        n = len(jobs)
+        threads_per_encoder = max(1, (os.cpu_count() or 4) // n)
+        print(f"[批量导出引擎] 🧵 每个编码器线程数: {threads_per_encoder}")
+        
+        graph = [f"[0:v]split={n}" + "".join(f"[s{i}]" for i in range(n))]
+        for i, job in enumerate(jobs):
+            settings = job["settings"]
+            graph.append(f"[s{i}]scale={settings['width']}:{settings['height']},fps={settings['fps']}[v{i}]")
+        
+        args = ["-i", video_path, "-filter_complex", ";".join(graph)]
+        for i, job in enumerate(jobs):
+            settings = job["settings"]
+            args += [
+                "-map", f"[v{i}]", "-map", "0:a?",
+                "-c:v", settings["codec"],
+                "-b:v", settings["bitrate"],
+                "-preset", settings["preset"],
+                "-pix_fmt", "yuv420p",
+                "-threads", str(threads_per_encoder),
+                "-c:a", settings["audio_codec"],
+                "-movflags", "+faststart",
+                job["output_path"],
+            ]
+        self.logger.info(f"共享解码批量导出: {n} 个输出")
+        run_ffmpeg(args)
+    
     @staticmethod
     def get_available_resolutions() -> List[str]:
         """获取可用的分辨率列表"""
@@ -330,20 +623,20 @@ class VideoPreviewManager:
                 return {"error": "视频文件不存在"}
             
             print(f"[视频信息] 📊 读取视频信息: {video_path}")
-            video = VideoFileClip(video_path)
+            probed = probe_media(video_path)
+            if not probed.get("has_video"):
+                raise ValueError("未找到视频流")
             
             info = {
-                "width": video.size[0],
-                "height": video.size[1],
-                "duration": video.duration,
-                "fps": video.fps,
-                "has_audio": video.audio is not None,
-                "file_size_mb": os.path.getsize(video_path) / (1024 * 1024)
+                "width": probed["width"],
+                "height": probed["height"],
+                "duration": probed["duration"],
+                "fps": probed["fps"],
+                "has_audio": probed["has_audio"],
+                "file_size_mb": probed["file_size_mb"]
             }
             
             print(f"[视频信息] ✅ 分辨率: {info['width']}x{info['height']}, 时长: {info['duration']:.1f}s, 大小: {info['file_size_mb']:.2f}MB")
-            
-            video.close()
             return info
             
         except Exception as e:
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# ffmpeg 命令行辅助工具 (复用 moviepy 配置的 ffmpeg 可执行文件)
+
+import os
+import re
+import json
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+from moviepy.config import get_setting
+
+from .file_utils import file_signature
+from .job_scheduler import JobCancelled, check_cancelled
+
+
+def ffmpeg_binary() -> str:
+    return get_setting("FFMPEG_BINARY")
+
+
+def ffprobe_binary() -> Optional[str]:
+    """与 ffmpeg 同目录的 ffprobe，其次是 PATH 中的 ffprobe；都没有时返回 None"""
+    ffmpeg = ffmpeg_binary()
+    directory, name = os.path.split(ffmpeg)
+    candidate = os.path.join(directory, name.replace("ffmpeg", "ffprobe"))
+    if directory and candidate != ffmpeg and os.path.isfile(candidate):
+        return candidate
+    return shutil.which("ffprobe")
+
+
+def run_ffmpeg(args: List[str], capture_stdout: bool = False) -> Optional[bytes]:
+    """
+    执行一条 ffmpeg 命令，失败时抛出 RuntimeError (附带 stderr 末尾)
+    :param capture_stdout: 为 True 时返回 stdout 内容 (用于输出到管道 "-" 的命令)
+    """
+    cmd = [ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y"] + [str(a) for a in args]
+    logging.info("Running ffmpeg: " + " ".join(cmd))
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE if capture_stdout else subprocess.DEVNULL,
+                            stderr=subprocess.PIPE)
+    # 在调度器任务中执行时，等待期间定期检查取消，取消后结束 ffmpeg 进程
+    while True:
+        try:
+            stdout, stderr = proc.communicate(timeout=0.5)
+            break
+        except subprocess.TimeoutExpired:
+            try:
+                check_cancelled()
+            except JobCancelled:
+                proc.kill()
+                proc.communicate()
+                raise
+    if proc.returncode != 0:
+        err = stderr.decode("utf-8", errors="ignore").strip()
+        raise RuntimeError(f"ffmpeg failed ({proc.returncode}): {err[-2000:]}")
+    return stdout if capture_stdout else None
+
+
+def concat_segments(segment_paths: List[str], output_path: str, audio_path: Optional[str] = None):
+    """
+    使用 concat demuxer 无损拼接编码参数一致的片段，可选地混入一条新的音轨
+    """
+    fd, list_path = tempfile.mkstemp(suffix=".txt", prefix="funclip_concat_")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for path in segment_paths:
+                escaped = os.path.abspath(path).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        args = ["-f", "concat", "-safe", "0", "-i", list_path]
+        if audio_path is not None:
+            args += ["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0", "-c:a", "copy", "-shortest"]
+        else:
+            args += ["-c:a", "copy"]
+        args += ["-c:v", "copy", "-movflags", "+faststart", output_path]
+        run_ffmpeg(args)
+    finally:
+        if os.path.exists(list_path):
+            os.remove(list_path)
+
+
+def stream_pcm(path: str, sr: int, block_samples: int, channels: int = 1) -> Iterator[np.ndarray]:
+    """
+    通过 ffmpeg 管道按固定大小的块读取 float32 PCM，内存占用与音频长度无关
+    (支持 aac/mp3 等 soundfile 无法直接读取的格式)
+    单声道时产出一维数组，多声道时产出 (channels, n) 数组
+    ffmpeg 解码失败 (返回码非 0) 时在读完输出后抛出 RuntimeError (附带 stderr 末尾)，
+    不会把失败当作一段空音频
+    """
+    cmd = [ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-i", path, "-vn",
+           "-f", "f32le", "-acodec", "pcm_f32le", "-ac", str(channels), "-ar", str(sr), "-"]
+    # stderr 写到临时文件而不是管道，长时间解码时不会因管道写满而阻塞
+    stderr = tempfile.TemporaryFile()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr)
+    frame_bytes = 4 * channels
+    block_bytes = block_samples * frame_bytes
+    try:
+        while True:
+            data = proc.stdout.read(block_bytes)
+            if not data:
+                break
+            usable = len(data) - len(data) % frame_bytes
+            samples = np.frombuffer(data[:usable], dtype=np.float32)
+            yield samples if channels == 1 else samples.reshape(-1, channels).T
+        if proc.wait() != 0:
+            stderr.seek(0)
+            err = stderr.read().decode("utf-8", errors="ignore").strip()
+            raise RuntimeError(f"ffmpeg failed ({proc.returncode}) decoding {path}: {err[-2000:]}")
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        stderr.close()
+
+
+_PROBE_CACHE_SIZE = 256
+_probe_cache = OrderedDict()
+_probe_lock = threading.Lock()
+
+
+def _parse_rate(rate: Optional[str]) -> float:
+    # ffprobe 的帧率形如 "30000/1001"
+    if not rate or rate == "0/0":
+        return 0.0
+    if "/" in rate:
+        num, den = rate.split("/", 1)
+        return float(num) / float(den) if float(den) else 0.0
+    return float(rate)
+
+
+def _ffprobe(path: str, ffprobe: str) -> Dict:
+    cmd = [ffprobe, "-v", "error", "-show_entries",
+           "format=duration,bit_rate,format_name:"
+           "stream=codec_type,codec_name,profile,level,width,height,sample_aspect_ratio,time_base,"
+           "avg_frame_rate,r_frame_rate,pix_fmt,sample_rate,channels,bit_rate:"
+           "stream_tags=rotate:stream_side_data=rotation",
+           "-of", "json", path]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        err = proc.stderr.decode("utf-8", errors="ignore").strip()
+        raise RuntimeError(f"ffprobe failed ({proc.returncode}): {err[-2000:]}")
+    data = json.loads(proc.stdout.decode("utf-8", errors="ignore") or "{}")
+    fmt = data.get("format", {})
+    streams = data.get("streams", [])
+    video = next((st for st in streams if st.get("codec_type") == "video"), None)
+    audio = next((st for st in streams if st.get("codec_type") == "audio"), None)
+
+    info = {
+        "duration": float(fmt.get("duration") or 0.0),
+        "format_name": fmt.get("format_name"),
+        "bit_rate": int(fmt["bit_rate"]) if fmt.get("bit_rate") else None,
+        "has_video": video is not None,
+        "has_audio": audio is not None,
+    }
+    if video is not None:
+        avg_fps, r_fps = _parse_rate(video.get("avg_frame_rate")), _parse_rate(video.get("r_frame_rate"))
+        fps = avg_fps or r_fps
+        width, height = int(video.get("width") or 0), int(video.get("height") or 0)
+        if abs(_rotation(video)) % 180 == 90:
+            width, height = height, width
+        info.update({
+            "width": width,
+            "height": height,
+            "fps": fps,
+            # 平均帧率与基准帧率不一致说明是可变帧率
+            "variable_fps": bool(avg_fps and r_fps and abs(avg_fps - r_fps) > 0.01),
+            "video_codec": video.get("codec_name"),
+            "pix_fmt": video.get("pix_fmt"),
+            "profile": video.get("profile"),
+            "level": video.get("level"),
+            "sar": video.get("sample_aspect_ratio"),
+            "time_base": video.get("time_base"),
+            "video_bit_rate": int(video["bit_rate"]) if video.get("bit_rate") else None,
+        })
+    if audio is not None:
+        info.update({
+            "audio_codec": audio.get("codec_name"),
+            "sample_rate": int(audio.get("sample_rate") or 0),
+            "channels": int(audio.get("channels") or 0),
+            "audio_bit_rate": int(audio["bit_rate"]) if audio.get("bit_rate") else None,
+        })
+    return info
+
+
+def _rotation(video: Dict) -> int:
+    # 旧版 ffmpeg 写在 rotate 标签里，新版只在显示矩阵 (Display Matrix) 附加数据里给出
+    rotate = (video.get("tags") or {}).get("rotate")
+    if rotate is None:
+        rotate = next((sd["rotation"] for sd in video.get("side_data_list") or [] if "rotation" in sd), 0)
+    return int(float(rotate or 0))
+
+
+_CHANNEL_LAYOUTS = {"mono": 1, "stereo": 2, "2.1": 3, "quad": 4, "5.0": 5, "5.1": 6, "6.1": 7, "7.1": 8}
+
+
+def _parse_stream_lines(text: str) -> Dict:
+    """从 ffmpeg -i 的输出中解析编码器、像素格式和声道等 moviepy 不提供的字段"""
+    info = {}
+    video = re.search(r"Stream #\d+:\d+.*?: Video: (\w+)(?: \(([^)]*)\))?[^,]*, (\w+).*", text)
+    if video:
+        line = video.group(0)
+        profile = video.group(2)
+        sar = re.search(r"\[SAR (\d+:\d+)", line)
+        tbn = re.search(r"(\d+)(k?) tbn", line)
+        info.update({
+            "video_codec": video.group(1),
+            # 第一个括号可能直接是 fourcc (如 "avc1 / 0x31637661")，这时没有 profile
+            "profile": profile if profile and "/" not in profile else None,
+            "pix_fmt": video.group(3),
+            "sar": sar.group(1) if sar else None,
+            "time_base": f"1/{int(tbn.group(1)) * (1000 if tbn.group(2) else 1)}" if tbn else None,
+        })
+    audio = re.search(r"Stream #\d+:\d+.*?: Audio: (\w+)[^,]*, (\d+) Hz, ([^,]+)", text)
+    if audio:
+        layout = audio.group(3).strip()
+        count = re.match(r"(\d+) channels", layout)
+        channels = int(count.group(1)) if count else _CHANNEL_LAYOUTS.get(layout.split("(")[0])
+        info.update({"audio_codec": audio.group(1), "sample_rate": int(audio.group(2)), "channels": channels})
+    return info
+
+
+def _parse_infos_fallback(path: str) -> Dict:
+    # 没有 ffprobe 时退回 moviepy 的解析 (一次 ffmpeg -i，不启动读帧进程)，
+    # moviepy 不提供的编码信息从同一份 ffmpeg -i 输出中补充
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+    infos = ffmpeg_parse_infos(path)
+    proc = subprocess.run([ffmpeg_binary(), "-hide_banner", "-i", path],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    streams = _parse_stream_lines(proc.stderr.decode("utf-8", errors="ignore"))
+    info = {
+        "duration": float(infos.get("duration") or 0.0),
+        "has_video": bool(infos.get("video_found")),
+        "has_audio": bool(infos.get("audio_found")),
+    }
+    if info["has_video"]:
+        width, height = infos["video_size"]
+        if abs(int(infos.get("video_rotation") or 0)) % 180 == 90:
+            width, height = height, width
+        info.update({
+            "width": width,
+            "height": height,
+            "fps": float(infos.get("video_fps") or 0.0),
+            "video_codec": streams.get("video_codec"),
+            "pix_fmt": streams.get("pix_fmt"),
+            "profile": streams.get("profile"),
+            "level": None,  # ffmpeg -i 不输出 level
+            "sar": streams.get("sar"),
+            "time_base": streams.get("time_base"),
+            # moviepy 给出的是 kb/s
+            "video_bit_rate": int(infos["video_bitrate"] * 1000) if infos.get("video_bitrate") else None,
+        })
+    if info["has_audio"]:
+        info.update({
+            "audio_codec": streams.get("audio_codec"),
+            "sample_rate": int(infos.get("audio_fps") or streams.get("sample_rate") or 0),
+            "channels": int(streams.get("channels") or 0),
+            "audio_bit_rate": int(infos["audio_bitrate"] * 1000) if infos.get("audio_bitrate") else None,
+        })
+    return info
+
+
+def probe_media(path: str) -> Dict:
+    """
+    读取媒体文件的容器/流元数据 (一次短 ffprobe 调用)
+    结果按 路径+大小+修改时间 缓存，文件未变化时直接返回缓存，不再访问磁盘内容。
+    :return: duration/has_video/has_audio，以及视频流的 width/height/fps/variable_fps/video_codec/pix_fmt/
+             profile/level/sar/time_base/video_bit_rate、
+             音频流的 audio_codec/sample_rate/channels/audio_bit_rate 等
+    """
+    signature = file_signature(path)
+    key = (signature["path"], signature["size"], signature["mtime"])
+    with _probe_lock:
+        if key in _probe_cache:
+            _probe_cache.move_to_end(key)
+            return dict(_probe_cache[key])
+
+    ffprobe = ffprobe_binary()
+    info = _ffprobe(path, ffprobe) if ffprobe else _parse_infos_fallback(path)
+    info["file_size_mb"] = signature["size"] / (1024 * 1024)
+
+    with _probe_lock:
+        _probe_cache[key] = info
+        _probe_cache.move_to_end(key)
+        while len(_probe_cache) > _PROBE_CACHE_SIZE:
+            _probe_cache.popitem(last=False)
+    return dict(info)
@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# 文件工具 - 各缓存共用的文件签名
+
+import os
+from typing import Dict
+
+
+def file_signature(path: str) -> Dict:
+    """文件签名：路径 + 大小 + 修改时间，用于判断输入是否变化"""
+    st = os.stat(path)
+    return {
+        "path": os.path.abspath(path),
+        "size": st.st_size,
+        "mtime": int(st.st_mtime),
+    }
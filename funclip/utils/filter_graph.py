@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# 风格滤镜图 - 按 (模板, 画面尺寸) 编译一次，常量蒙版预先计算，每帧在同一块缓冲区上依次处理
+
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .color_grading import ColorGrader, colorx_curve, gamma_curve, lum_contrast_curve
+
+
+def channel_lut(curves) -> np.ndarray:
+    """
+    由逐通道的映射函数生成 cv2.LUT 可用的 (1, 256, 3) 查找表
+    :param curves: 单个函数 (三通道相同) 或三个函数的列表 (R, G, B)
+    """
+    if callable(curves):
+        curves = [curves] * 3
+    x = np.arange(256, dtype=np.float64)
+    table = np.stack([np.clip(curve(x), 0, 255) for curve in curves], axis=-1)
+    return table.astype(np.uint8).reshape(1, 256, 3)
+
+
+def vignette_mask(size: Tuple[int, int], strength: float) -> np.ndarray:
+    """
+    暗角蒙版 (与原 mask_vignette 的径向渐变相同)，返回 uint8 三通道，255 表示不变
+    :param strength: 模板中的 size 参数，越小暗角越重
+    """
+    w, h = size
+    Y, X = np.ogrid[:h, :w]
+    center_y, center_x = h / 2, w / 2
+    dist = np.sqrt((X - center_x) ** 2 + (Y - center_y) ** 2)
+    max_dist = np.sqrt(center_x ** 2 + center_y ** 2)
+    mask = np.clip(1 - ((dist / max_dist) ** 1.5) * (1 - strength), 0, 1)
+    mask = np.round(mask * 255).astype(np.uint8)
+    return np.repeat(mask[:, :, np.newaxis], 3, axis=2)
+
+
+def _write_cube_lut(lut: np.ndarray, path: str):
+    # 256 级的一维 .cube 查找表：8 位输入正好落在表项上，lut1d 的结果与 cv2.LUT 一致
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("LUT_1D_SIZE 256\n")
+        for x in range(256):
+            f.write(" ".join(f"{lut[0, x, c] / 255:.6f}" for c in range(3)) + "\n")
+
+
+def _escape_filter_path(path: str) -> str:
+    # 放在单引号内作为滤镜参数：滤镜图一层原样保留，选项一层还需要转义冒号 (Windows 盘符)
+    return path.replace("\\", "/").replace(":", "\\:")
+
+
+def _speed_audio_filter(speed: float, sample_rate: Optional[int]) -> str:
+    """
+    与 moviepy speedx 一致的音频变速：按新采样率重新解释样本再重采样回原采样率，音调随速度升降
+    不知道采样率时退回 atempo (保持音调)，单个 atempo 只接受 0.5-2.0，超出范围时串联多个
+    """
+    if sample_rate:
+        return f"asetrate={sample_rate * speed:.3f},aresample={sample_rate}"
+    factors = []
+    remaining = speed
+    while remaining > 2.0:
+        factors.append(2.0)
+        remaining /= 2.0
+    while remaining < 0.5:
+        factors.append(0.5)
+        remaining /= 0.5
+    factors.append(remaining)
+    return ",".join(f"atempo={f:.6f}" for f in factors)
+
+
+def _channel_mixer_filter(matrix: np.ndarray) -> str:
+    # 与 cv2.transform 相同：输出通道 i = sum_j matrix[i, j] * 输入通道 j
+    names = [f"{o}{i}" for o in "rgb" for i in "rgb"]
+    values = matrix.reshape(-1)
+    return "colorchannelmixer=" + ":".join(f"{n}={v:.6f}" for n, v in zip(names, values))
+
+
+class FilterGraph:
+    """
+    编译后的风格滤镜图
+    由查找表 (逐通道映射)、3x3 颜色矩阵 (饱和度) 和常量蒙版 (暗角) 三类节点组成，
+    相邻的查找表在编译时复合为一张。每帧只在预分配的输出缓冲区上顺序执行各节点，
+    不再重复计算蒙版，也没有浮点中间帧。
+    返回的帧就是输出缓冲区，调用方应在处理下一帧前用完它 (moviepy 写出时逐帧编码，满足这一点)。
+    """
+
+    def __init__(self, size: Tuple[int, int]):
+        w, h = size
+        self.size = (w, h)
+        self.stages = []
+        # 滤镜图按模板缓存后可能被多个会话同时使用，输出缓冲区按线程分配
+        self._local = threading.local()
+
+    def add_lut(self, lut: np.ndarray):
+        if self.stages and self.stages[-1][0] == "lut":
+            # 复合：先查上一张表，再查这一张
+            prev = self.stages[-1][1]
+            fused = np.stack([lut[0, :, c][prev[0, :, c]] for c in range(3)], axis=-1)
+            self.stages[-1] = ("lut", fused.reshape(1, 256, 3))
+        else:
+            self.stages.append(("lut", lut))
+
+    def add_matrix(self, matrix: np.ndarray):
+        self.stages.append(("matrix", matrix.astype(np.float32)))
+
+    def add_mask(self, mask: np.ndarray):
+        self.stages.append(("mask", mask))
+
+    def add_color_grading(self, grader: ColorGrader):
+        if grader.is_identity:
+            return
+        self.add_lut(grader.lut)
+        if grader.matrix is not None:
+            self.add_matrix(grader.matrix)
+
+    def add_filter(self, filter_type: str, filter_config: Dict) -> bool:
+        """
+        把一个模板滤镜编译进滤镜图
+        :return: 是否支持该滤镜类型
+        """
+        if filter_type == "colorx":
+            factor = filter_config.get("factor", 1.0)
+            factors = factor if isinstance(factor, (list, tuple)) else [factor] * 3
+            if any(f != 1.0 for f in factors):
+                self.add_lut(channel_lut([lambda x, f=f: colorx_curve(x, f) for f in factors]))
+        elif filter_type == "lum_contrast":
+            lum = filter_config.get("lum", 0)
+            contrast = filter_config.get("contrast", 0)
+            self.add_lut(channel_lut(lambda x: lum_contrast_curve(x, lum=lum, contrast=contrast)))
+        elif filter_type == "gamma_corr":
+            gamma = filter_config.get("gamma", 1.0)
+            self.add_lut(channel_lut(lambda x: gamma_curve(x, gamma)))
+        elif filter_type == "blur":
+            # 与原实现一致，暂不处理
+            pass
+        elif filter_type == "mask_vignette":
+            self.add_mask(vignette_mask(self.size, filter_config.get("size", 0.8)))
+        else:
+            return False
+        return True
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.stages
+
+    def __call__(self, frame: np.ndarray) -> np.ndarray:
+        if not self.stages:
+            return frame
+        if frame.dtype != np.uint8:
+            frame = np.clip(frame, 0, 255).astype(np.uint8)
+        # 第一个节点从输入帧读取，之后都在输出缓冲区上原地处理
+        out = getattr(self._local, "buffer", None)
+        if out is None or out.shape != frame.shape:
+            out = self._local.buffer = np.empty_like(frame)
+        src = frame
+        for kind, data in self.stages:
+            if kind == "lut":
+                cv2.LUT(src, data, dst=out)
+            elif kind == "matrix":
+                cv2.transform(src, data, dst=out)
+            elif kind == "mask":
+                cv2.multiply(src, data, dst=out, scale=1.0 / 255)
+            src = out
+        return out
+
+    def to_ffmpeg(self, work_dir: str, speed: float = 1.0, fps: Optional[float] = None,
+                  has_audio: bool = False, sample_rate: Optional[int] = None,
+                  pix_fmt: str = "yuv420p") -> Tuple[List[str], str, List[str]]:
+        """
+        翻译为等价的 ffmpeg filter_complex
+        查找表 -> 256 级 lut1d (与 cv2.LUT 逐级一致)，颜色矩阵 -> colorchannelmixer，
+        常量蒙版 -> 写成 PNG 后 blend multiply，速度 -> setpts + fps 保持原帧率，
+        音频 -> asetrate/aresample (与 moviepy speedx 一样音调随速度变化)。
+        各节点在 8 位整数上的舍入方式与 OpenCV 略有不同，结果与 Python 路径相差几个灰度级以内。
+        :param work_dir: 存放蒙版图片和查找表的临时目录
+        :param sample_rate: 音频采样率，未知时退回 atempo (保持音调)
+        :param pix_fmt: 输出像素格式
+        :return: (额外输入参数, filter_complex, -map 参数)，主输入视频为 0 号输入
+        """
+        inputs = []
+        chains = []
+        label = "[0:v]"
+        current = ["format=gbrp"]
+        for i, (kind, data) in enumerate(self.stages):
+            if kind == "lut":
+                lut_path = os.path.join(work_dir, f"lut_{i}.cube")
+                _write_cube_lut(data, lut_path)
+                current.append(f"lut1d=file='{_escape_filter_path(lut_path)}'")
+            elif kind == "matrix":
+                current.append(_channel_mixer_filter(data))
+            elif kind == "mask":
+                n = len(inputs) // 4
+                mask_path = os.path.join(work_dir, f"mask_{n}.png")
+                cv2.imwrite(mask_path, data[:, :, 0])
+                inputs += ["-loop", "1", "-i", mask_path]
+                if current:
+                    chains.append(f"{label}{','.join(current)}[pre{n}]")
+                    label = f"[pre{n}]"
+                # 连续两个蒙版之间没有其他节点时，上一个 blend 的输出直接作为输入
+                chains.append(f"[{n + 1}:v]format=gbrp[mask{n}]")
+                chains.append(f"{label}[mask{n}]blend=all_mode=multiply:shortest=1[post{n}]")
+                label = f"[post{n}]"
+                current = []
+
+        if speed != 1.0:
+            current.append(f"setpts=PTS/{speed}")
+            if fps:
+                current.append(f"fps={fps}")
+        current.append(f"format={pix_fmt}")
+        chains.append(f"{label}{','.join(current)}[vout]")
+
+        maps = ["-map", "[vout]"]
+        if has_audio:
+            if speed != 1.0:
+                chains.append(f"[0:a]{_speed_audio_filter(speed, sample_rate)}[aout]")
+                maps += ["-map", "[aout]"]
+            else:
+                maps += ["-map", "0:a"]
+        return inputs, ";".join(chains), maps
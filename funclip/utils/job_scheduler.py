@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# 任务调度 - 按功能 (ASR / 视觉理解 / 渲染 / 导出) 划分的有界任务池：并发上限、排队上限、取消和进度上报
+
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+
+class QueueFullError(RuntimeError):
+    """任务池的排队数已达上限"""
+
+
+class JobCancelled(RuntimeError):
+    """任务在排队或执行过程中被取消"""
+
+
+_local = threading.local()
+
+
+def current_job() -> Optional["Job"]:
+    """当前线程正在执行的任务 (不在调度器中执行时为 None)"""
+    return getattr(_local, "job", None)
+
+
+def report_progress(fraction: float, message: str = ""):
+    """供任务函数上报进度，不在调度器中执行时什么也不做"""
+    job = current_job()
+    if job is not None:
+        job.update(fraction, message)
+
+
+def check_cancelled():
+    """任务的取消检查点：任务已被取消时抛出 JobCancelled"""
+    job = current_job()
+    if job is not None and job.cancel_event.is_set():
+        raise JobCancelled(f"job {job.id} cancelled")
+
+
+def moviepy_logger(message: str = ""):
+    """
+    moviepy write_videofile / write_audiofile 的 logger：每写一帧都是一个取消检查点，
+    帧进度作为任务进度上报；不在调度器中执行时返回 None (不输出进度条)
+    """
+    if current_job() is None:
+        return None
+    from proglog import ProgressBarLogger  # moviepy 的依赖，只有渲染任务会用到
+
+    class _JobLogger(ProgressBarLogger):
+        def bars_callback(self, bar, attr, value, old_value=None):
+            check_cancelled()
+            total = self.bars[bar].get("total")
+            # 按百分比节流，避免每帧都刷新界面
+            if attr == "index" and total and int(100 * value / total) != int(100 * (old_value or 0) / total):
+                report_progress(value / total, message)
+
+    return _JobLogger()
+
+
+class Job:
+    _ids = itertools.count(1)
+
+    def __init__(self, pool: str, name: str, session: Optional[str] = None,
+                 progress_callback: Optional[Callable[[float, str], None]] = None):
+        self.id = next(self._ids)
+        self.pool = pool
+        self.name = name
+        self.session = session
+        self.state = "queued"        # queued / running / done / failed / cancelled
+        self.progress = 0.0
+        self.message = ""
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self._progress_callback = progress_callback
+
+    def update(self, fraction: float, message: str = ""):
+        self.progress = max(0.0, min(1.0, float(fraction)))
+        self.message = message
+        if self._progress_callback is not None:
+            try:
+                self._progress_callback(self.progress, message)
+            except Exception:
+                pass  # 进度显示失败不影响任务本身
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def to_dict(self) -> Dict:
+        now = time.time()
+        return {
+            "id": self.id,
+            "pool": self.pool,
+            "name": self.name,
+            "state": self.state,
+            "progress": round(self.progress, 3),
+            "message": self.message,
+            "waited": round((self.started or now) - self.submitted, 1),
+            "elapsed": round((self.finished or now) - self.started, 1) if self.started else 0.0,
+        }
+
+
+class JobPool:
+    """
+    一个功能的任务池
+    任务在提交它的线程中执行 (Gradio 的工作线程)，池只负责准入：最多 concurrency 个同时运行，
+    最多 max_queue 个排队，超过时立即拒绝；排队按提交顺序 (FIFO) 放行。
+    在另一个任务中提交的子任务 (如配乐任务中的语音识别) 继承外层任务的会话和进度显示，
+    取消会话时一并取消。
+    """
+
+    def __init__(self, name: str, concurrency: int = 1, max_queue: int = 8):
+        self.name = name
+        self.concurrency = max(1, int(concurrency))
+        self.max_queue = max(0, int(max_queue))
+        self._cond = threading.Condition()
+        self._waiting = deque()
+        self._running = []
+
+    def run(self, fn: Callable, args=(), kwargs=None, name: str = "", session: Optional[str] = None,
+            progress_callback: Optional[Callable[[float, str], None]] = None):
+        parent = current_job()
+        if parent is not None:
+            session = session or parent.session
+            progress_callback = progress_callback or parent._progress_callback
+        job = Job(self.name, name or getattr(fn, "__name__", "job"), session, progress_callback)
+        with self._cond:
+            if len(self._running) >= self.concurrency and len(self._waiting) >= self.max_queue:
+                raise QueueFullError(f"{self.name} queue is full ({self.max_queue} jobs waiting)")
+            self._waiting.append(job)
+            try:
+                while len(self._running) >= self.concurrency or self._waiting[0] is not job:
+                    if job.cancel_event.is_set():
+                        job.state = "cancelled"
+                        raise JobCancelled(f"job {job.id} cancelled while queued")
+                    position = self._waiting.index(job) + 1
+                    job.update(0.0, f"排队中: {self.name} 前面还有 {position - 1 + len(self._running)} 个任务")
+                    self._cond.wait(timeout=1.0)
+            finally:
+                self._waiting.remove(job)
+                self._cond.notify_all()
+            if job.cancel_event.is_set():
+                job.state = "cancelled"
+                raise JobCancelled(f"job {job.id} cancelled while queued")
+            job.state, job.started = "running", time.time()
+            self._running.append(job)
+
+        previous, _local.job = current_job(), job
+        job.update(0.0, f"{self.name}: 开始执行")
+        try:
+            result = fn(*args, **(kwargs or {}))
+            job.state = "done"
+            job.update(1.0, f"{self.name}: 完成")
+            return result
+        except JobCancelled:
+            job.state = "cancelled"
+            raise
+        except Exception:
+            job.state = "failed"
+            raise
+        finally:
+            _local.job = previous
+            job.finished = time.time()
+            with self._cond:
+                self._running.remove(job)
+                self._cond.notify_all()
+            logging.info(f"Job {job.id} ({self.name}/{job.name}) {job.state} in {job.finished - job.started:.1f}s")
+
+    def jobs(self):
+        with self._cond:
+            return list(self._running) + list(self._waiting)
+
+    def cancel(self, session: Optional[str] = None) -> int:
+        """取消某个会话 (session 为 None 时取消所有) 的排队中和运行中的任务"""
+        count = 0
+        with self._cond:
+            for job in list(self._running) + list(self._waiting):
+                if session is None or job.session == session:
+                    job.cancel()
+                    count += 1
+            self._cond.notify_all()
+        return count
+
+    def status(self) -> Dict:
+        with self._cond:
+            return {
+                "concurrency": self.concurrency,
+                "max_queue": self.max_queue,
+                "running": len(self._running),
+                "queued": len(self._waiting),
+            }
+
+
+class JobScheduler:
+    """按名字管理多个任务池"""
+
+    def __init__(self, pools: Dict[str, Dict]):
+        """
+        :param pools: {池名: {"concurrency": n, "max_queue": m}}
+        """
+        self.pools = {name: JobPool(name, **config) for name, config in pools.items()}
+
+    def run(self, pool: str, fn: Callable, *args, **kwargs):
+        return self.pools[pool].run(fn, args, kwargs)
+
+    def cancel(self, session: Optional[str] = None) -> int:
+        return sum(pool.cancel(session) for pool in self.pools.values())
+
+    def capacity(self) -> int:
+        """所有池同时运行和排队的任务数上限，也就是任务最多占用的调用线程数"""
+        return sum(pool.concurrency + pool.max_queue for pool in self.pools.values())
+
+    def session_jobs(self, session: Optional[str]):
+        return [job.to_dict() for pool in self.pools.values() for job in pool.jobs()
+                if session is None or job.session == session]
+
+    def status(self) -> Dict:
+        return {name: pool.status() for name, pool in self.pools.items()}
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# 子系统懒加载 - 模型等重量级组件在第一次使用时才加载，可选后台预热，并提供就绪状态查询
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+
+class LazySubsystem:
+    """
+    懒加载的子系统
+    第一次调用 get() 时执行 factory 并缓存结果；多个线程同时请求时只加载一次，其余线程等待。
+    warm_up() 在后台线程中提前加载，不阻塞调用方 (例如 Web 服务先绑定端口，模型随后就绪)。
+    """
+
+    def __init__(self, name: str, factory: Callable[[], object], description: str = ""):
+        self.name = name
+        self.description = description
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value = None
+        self.state = "idle"          # idle / loading / ready / failed
+        self.error = None
+        self.load_seconds = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def get(self):
+        """返回已加载的对象，必要时在当前线程加载；加载失败时抛出异常 (下次调用会重试)"""
+        if self.state == "ready":
+            return self._value
+        with self._lock:
+            if self.state == "ready":
+                return self._value
+            self.state, self.error = "loading", None
+            start = time.time()
+            print(f"[子系统] ⏳ 正在加载 {self.name}...")
+            try:
+                value = self._factory()
+            except Exception as e:
+                self.state, self.error = "failed", f"{type(e).__name__}: {e}"
+                logging.error(f"Failed to load subsystem {self.name}: {e}")
+                raise
+            self._value = value
+            self.load_seconds = round(time.time() - start, 1)
+            self.state = "ready"
+            print(f"[子系统] ✅ {self.name} 已就绪 ({self.load_seconds}s)")
+            return value
+
+    def warm_up(self) -> threading.Thread:
+        """在后台线程中加载"""
+        def _run():
+            try:
+                self.get()
+            except Exception:
+                pass  # 错误已记录在 state/error 中，真正使用时会重试并把异常交给调用方
+
+        thread = threading.Thread(target=_run, name=f"warmup-{self.name}", daemon=True)
+        thread.start()
+        return thread
+
+    def status(self) -> Dict:
+        return {
+            "state": self.state,
+            "description": self.description,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
+
+
+class SubsystemRegistry:
+    """一组懒加载子系统，按名字获取、批量预热、汇总就绪状态"""
+
+    def __init__(self):
+        self._subsystems: Dict[str, LazySubsystem] = {}
+
+    def register(self, name: str, factory: Callable[[], object], description: str = "") -> LazySubsystem:
+        subsystem = LazySubsystem(name, factory, description)
+        self._subsystems[name] = subsystem
+        return subsystem
+
+    def __getitem__(self, name: str) -> LazySubsystem:
+        return self._subsystems[name]
+
+    def get(self, name: str):
+        return self._subsystems[name].get()
+
+    def warm_up(self, names: Iterable[str]):
+        for name in names:
+            if name not in self._subsystems:
+                logging.warning(f"Unknown subsystem for warm-up: {name}")
+                continue
+            self._subsystems[name].warm_up()
+
+    def status(self, require: Optional[Iterable[str]] = None) -> Dict:
+        """
+        就绪状态汇总
+        :param require: 需要就绪的子系统，全部就绪时 ready 为 True (默认不要求任何子系统，即服务本身可用)
+        """
+        require = [n for n in (require or []) if n]
+        return {
+            "ready": all(n in self._subsystems and self._subsystems[n].ready for n in require),
+            "subsystems": {name: s.status() for name, s in self._subsystems.items()},
+        }
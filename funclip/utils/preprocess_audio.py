@@ -3,96 +3,142 @@
 # Lightweight audio preprocessing helpers.
 
 import os
+import tempfile
 
-import librosa
 import numpy as np
 import soundfile as sf
+import soxr
+from numpy.lib.stride_tricks import sliding_window_view
 
+from .ffmpeg_utils import run_ffmpeg
+from .loudness import LoudnessMeter, gain_to_target
+from .spectral_denoise import SpectralDenoiser
 
-def _to_mono_and_sr(wav, sr, target_sr=16000):
-    if wav.ndim > 1:
-        wav = wav[0]
-    if sr != target_sr:
-        wav = librosa.resample(wav, orig_sr=sr, target_sr=target_sr)
-        sr = target_sr
-    return wav, sr
-
-
-def _rms_normalize(wav, target_rms=0.1, eps=1e-8):
-    rms = np.sqrt(np.mean(np.square(wav)) + eps)
-    if rms < eps:
-        return wav
-    scale = target_rms / rms
-    return np.clip(wav * scale, -1.0, 1.0)
-
-
-def _lufs_normalize(wav, target_lufs=-20.0, eps=1e-9):
-    # Approximate integrated loudness using overall power (not true BS.1770)
-    power = np.mean(np.square(wav)) + eps
-    lufs = 10.0 * np.log10(power)
-    gain_db = target_lufs - lufs
-    gain = 10 ** (gain_db / 20.0)
-    wav = wav * gain
-    return np.clip(wav, -1.0, 1.0)
-
-
-def _highpass_preemphasis(wav, coef=0.97):
-    # simple pre-emphasis to attenuate low-frequency/rumble
-    if len(wav) < 2:
-        return wav
-    emphasized = np.append(wav[0], wav[1:] - coef * wav[:-1])
-    # avoid overflow
-    emphasized = np.clip(emphasized, -1.0, 1.0)
-    return emphasized
-
-
-def _damage_fix(wav):
-    # Replace NaN/inf, remove DC, soften clipping
-    wav = np.nan_to_num(wav, nan=0.0, posinf=0.0, neginf=0.0)
-    # Remove DC offset
-    wav = wav - np.mean(wav)
-    # Detect hard clipping
-    clip_thresh = 0.99
-    clipped = np.abs(wav) > clip_thresh
-    if clipped.any():
-        # Soft-limit to reduce distortion
-        wav = np.tanh(wav)
-    # Final safety clip
-    wav = np.clip(wav, -1.0, 1.0)
-    return wav
-
-
-def _simple_denoise(wav, sr):
-    # Spectral gating with noise estimated from low-energy frames
-    n_fft = 1024
-    hop = 256
-    win = 1024
-    stft = librosa.stft(wav, n_fft=n_fft, hop_length=hop, win_length=win)
-    mag, phase = np.abs(stft), np.exp(1j * np.angle(stft))
-
-    # Identify quiet frames by energy percentile
-    frame_energy = np.mean(mag, axis=0)
-    quiet_mask = frame_energy < np.percentile(frame_energy, 25)
-    if quiet_mask.any():
-        noise_profile = np.median(mag[:, quiet_mask], axis=1, keepdims=True)
-    else:
-        noise_profile = np.median(mag, axis=1, keepdims=True)
-
-    # Build soft mask
-    ratio = 1.5
-    thresh = noise_profile * ratio
-    mask = mag / (thresh + 1e-8)
-    mask = np.clip(mask, 0.0, 1.0)
-    # Smooth mask
-    mask = librosa.decompose.nn_filter(mask, aggregate=np.median, metric="cosine")
-    mask = np.clip(mask, 0.0, 1.0)
-
-    stft_denoised = mag * mask * phase
-    wav_denoised = librosa.istft(stft_denoised, hop_length=hop, length=len(wav))
-    # Final safety clip
-    if len(wav_denoised) != len(wav):
-        wav_denoised = np.resize(wav_denoised, wav.shape)
-    return np.clip(wav_denoised, -1.0, 1.0)
+
+BLOCK_FRAMES = 1 << 16
+
+
+def _read_blocks(file_path, block_frames=BLOCK_FRAMES):
+    # Fixed-size (channels, n) float32 blocks straight from soundfile
+    with sf.SoundFile(file_path) as f:
+        for block in f.blocks(blocksize=block_frames, dtype="float32", always_2d=True):
+            yield np.ascontiguousarray(block.T)
+
+
+class _Resampler:
+    # Streaming soxr resampler (same engine as librosa's default 'soxr_hq')
+    def __init__(self, orig_sr, target_sr):
+        self._stream = soxr.ResampleStream(orig_sr, target_sr, 1, dtype="float32", quality="HQ")
+
+    def push(self, block):
+        return self._stream.resample_chunk(block[0])[np.newaxis, :]
+
+    def flush(self):
+        return self._stream.resample_chunk(np.zeros(0, dtype=np.float32), last=True)[np.newaxis, :]
+
+
+class _PreEmphasis:
+    # First-order pre-emphasis (y[n] = x[n] - coef * x[n-1]) to attenuate
+    # low-frequency rumble, with the previous sample carried between blocks
+    def __init__(self, coef=0.97):
+        self.coef = coef
+        self._prev = None
+
+    def __call__(self, block):
+        prev = block[:, :1] if self._prev is None else self._prev
+        shifted = np.concatenate([prev, block[:, :-1]], axis=1)
+        out = block - self.coef * shifted
+        if self._prev is None:
+            out[:, 0] = block[:, 0]
+        self._prev = block[:, -1:]
+        return np.clip(out, -1.0, 1.0)
+
+
+class _FrameRMS:
+    # Centered frame RMS as in librosa.feature.rms, accumulated block by block
+    def __init__(self, frame_length=2048, hop_length=512):
+        self.frame_length = frame_length
+        self.hop = hop_length
+        self._carry = np.zeros(frame_length // 2, dtype=np.float32)
+        self._rms = []
+
+    def push(self, mono):
+        y = np.concatenate([self._carry, mono])
+        if len(y) < self.frame_length:
+            self._carry = y
+            return
+        n_frames = 1 + (len(y) - self.frame_length) // self.hop
+        frames = sliding_window_view(y[:(n_frames - 1) * self.hop + self.frame_length],
+                                     self.frame_length)[::self.hop]
+        self._rms.append(np.sqrt(np.mean(np.square(frames), axis=1)))
+        self._carry = y[n_frames * self.hop:]
+
+    def finish(self):
+        self.push(np.zeros(self.frame_length // 2, dtype=np.float32))
+        return np.concatenate(self._rms) if self._rms else np.zeros(0, dtype=np.float32)
+
+
+def _trim_bounds(rms, n_samples, top_db=30, hop_length=512, amin=1e-5):
+    # Same decision as librosa.effects.trim: frames within top_db of the loudest frame
+    if len(rms) == 0:
+        return 0, 0
+    db = 20.0 * np.log10(np.maximum(amin, rms)) - 20.0 * np.log10(max(amin, rms.max()))
+    non_silent = np.flatnonzero(db > -top_db)
+    if len(non_silent) == 0:
+        return 0, 0
+    start = int(non_silent[0] * hop_length)
+    end = min(n_samples, int((non_silent[-1] + 1) * hop_length))
+    return start, end
+
+
+def _damage_stats(file_path):
+    # Global DC offset and whether any sample is hard-clipped (|x - mean| > 0.99)
+    total, count = 0.0, 0
+    lo, hi = np.inf, -np.inf
+    for block in _read_blocks(file_path):
+        block = np.nan_to_num(block, nan=0.0, posinf=0.0, neginf=0.0)
+        total += float(np.sum(block, dtype=np.float64))
+        count += block.size
+        if block.size:
+            lo, hi = min(lo, float(block.min())), max(hi, float(block.max()))
+    mean = total / count if count else 0.0
+    soft_limit = count > 0 and (hi - mean > 0.99 or mean - lo > 0.99)
+    return mean, soft_limit
+
+
+def _damage_fix_block(block, mean, soft_limit):
+    # Replace NaN/inf, remove DC and soft-limit clipped signals with tanh
+    block = np.nan_to_num(block, nan=0.0, posinf=0.0, neginf=0.0) - np.float32(mean)
+    if soft_limit:
+        block = np.tanh(block)
+    return np.clip(block, -1.0, 1.0)
+
+
+def _front_end(file_path, sr, damage, to_16k_mono, highpass):
+    """
+    Stages before the global gains (damage fix, 16k mono, pre-emphasis),
+    streamed as (channels, n) blocks with resampler/filter state carried over.
+    :param damage: (mean, soft_limit) from _damage_stats, or None
+    """
+    resampler = _Resampler(sr, 16000) if to_16k_mono and sr != 16000 else None
+    preemphasis = _PreEmphasis() if highpass else None
+
+    def _finish(block):
+        return preemphasis(block) if preemphasis is not None else block
+
+    for block in _read_blocks(file_path):
+        if damage is not None:
+            block = _damage_fix_block(block, *damage)
+        if to_16k_mono:
+            block = block[:1]
+            if resampler is not None:
+                block = resampler.push(block)
+        if block.shape[1]:
+            yield _finish(block)
+    if resampler is not None:
+        block = resampler.flush()
+        if block.shape[1]:
+            yield _finish(block)
 
 
 def preprocess_audio_once(file_path,
@@ -105,27 +151,117 @@ def preprocess_audio_once(file_path,
                           damage_fix=False,
                           trim_silence=False,
                           output_dir=None):
-    wav, sr = librosa.load(file_path, sr=None, mono=False)
-    if damage_fix:
-        wav = _damage_fix(wav)
-    if to_16k_mono:
-        wav, sr = _to_mono_and_sr(wav, sr, target_sr=16000)
-    if highpass:
-        wav = _highpass_preemphasis(wav)
-    if rms_norm:
-        wav = _rms_normalize(wav)
-    if lufs_norm:
-        wav = _lufs_normalize(wav, target_lufs=target_lufs)
-    if denoise:
-        wav = _simple_denoise(wav, sr)
-    if trim_silence:
-        wav, _ = librosa.effects.trim(wav, top_db=30)
-
+    """
+    Streaming preprocessing: the file is read in fixed-size blocks and every
+    stage keeps its own carried state, so peak memory does not depend on the
+    input length. Global statistics (DC offset/clipping, RMS/loudness gain,
+    noise profile) are gathered in up to two analysis passes before the
+    output is written block by block; silence trimming copies the kept range
+    of the written file at the end.
+    """
     base = os.path.basename(file_path)
     pre_name = "pre_" + base
     if output_dir is None:
         output_dir = os.path.dirname(file_path)
     os.makedirs(output_dir, exist_ok=True)
     out_path = os.path.join(output_dir, pre_name)
-    sf.write(out_path, wav, sr)
+
+    decoded = None
+    try:
+        sf.info(file_path)
+    except RuntimeError:
+        # Formats libsndfile cannot read (aac/m4a...): decode once to a temporary wav
+        fd, decoded = tempfile.mkstemp(suffix=".wav", prefix="funclip_audio_")
+        os.close(fd)
+        run_ffmpeg(["-i", file_path, "-vn", "-c:a", "pcm_f32le", decoded])
+    source = decoded or file_path
+
+    try:
+        info = sf.info(source)
+        sr = 16000 if to_16k_mono else info.samplerate
+        channels = 1 if to_16k_mono else info.channels
+
+        # Pass 1: raw signal statistics for the damage fix
+        damage = _damage_stats(source) if damage_fix else None
+
+        # Pass 2: level and noise statistics after the front-end stages
+        rms_gain, lufs_gain = None, None
+        denoisers = None
+        if rms_norm or lufs_norm or denoise:
+            if denoise:
+                denoisers = [SpectralDenoiser(n_fft=1024, hop_length=256, ratio=1.5) for _ in range(channels)]
+                for d in denoisers:
+                    d.begin_estimate()
+            meter = LoudnessMeter(sr, channels, true_peak=False) if lufs_norm else None
+            sumsq, count = 0.0, 0
+            for block in _front_end(source, info.samplerate, damage, to_16k_mono, highpass):
+                sumsq += float(np.sum(np.square(block, dtype=np.float64)))
+                count += block.size
+                if meter is not None:
+                    meter.push(block)
+                if denoisers is not None:
+                    for d, channel in zip(denoisers, block):
+                        d.feed_estimate(channel)
+            mean_square = sumsq / count if count else 0.0
+            level_gain = 1.0
+            if rms_norm:
+                rms = np.sqrt(mean_square + 1e-8)
+                rms_gain = 0.1 / rms if rms >= 1e-8 else 1.0
+                level_gain *= rms_gain
+            if lufs_norm:
+                # Gated loudness is measured before the RMS gain, which shifts it by 20*log10(gain)
+                lufs = meter.integrated_loudness() + 20.0 * np.log10(level_gain)
+                lufs_gain = gain_to_target(lufs, target_lufs)
+                level_gain *= lufs_gain
+            if denoisers is not None:
+                # The gating mask is scale invariant: rescale the profile by the level gain
+                for d in denoisers:
+                    d.finish_estimate()
+                    d.noise_profile = d.noise_profile * np.float32(level_gain)
+                    d.begin()
+
+        # Pass 3: apply everything and write incrementally
+        write_path = out_path
+        if trim_silence:
+            write_path = os.path.join(output_dir, "pre_untrimmed_" + base)
+            frame_rms = _FrameRMS()
+        n_written = 0
+
+        def _write(f, block):
+            nonlocal n_written
+            if not block.shape[1]:
+                return
+            if trim_silence:
+                frame_rms.push(block.mean(axis=0))
+            f.write(block.T)
+            n_written += block.shape[1]
+
+        with sf.SoundFile(write_path, "w", samplerate=sr, channels=channels) as f:
+            for block in _front_end(source, info.samplerate, damage, to_16k_mono, highpass):
+                if rms_gain is not None:
+                    block = np.clip(block * np.float32(rms_gain), -1.0, 1.0)
+                if lufs_gain is not None:
+                    block = np.clip(block * np.float32(lufs_gain), -1.0, 1.0)
+                if denoisers is not None:
+                    block = np.clip(np.stack([d.push(c) for d, c in zip(denoisers, block)]), -1.0, 1.0)
+                _write(f, block)
+            if denoisers is not None:
+                _write(f, np.clip(np.stack([d.flush() for d in denoisers]), -1.0, 1.0))
+
+        if trim_silence:
+            start, end = _trim_bounds(frame_rms.finish(), n_written, top_db=30)
+            with sf.SoundFile(write_path) as src, \
+                    sf.SoundFile(out_path, "w", samplerate=sr, channels=channels) as dst:
+                src.seek(start)
+                remaining = end - start
+                while remaining > 0:
+                    block = src.read(min(BLOCK_FRAMES, remaining), dtype="float32", always_2d=True)
+                    if not len(block):
+                        break
+                    dst.write(block)
+                    remaining -= len(block)
+            os.remove(write_path)
+    finally:
+        if decoded is not None and os.path.exists(decoded):
+            os.remove(decoded)
     return out_path
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# 阶段一预处理规划 - 对比探测到的流参数与标准化要求，只执行需要的操作，结果按 输入文件签名+内容采样哈希+选项 缓存
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Dict, List
+
+from .ffmpeg_utils import probe_media
+from .file_utils import file_signature
+from .preprocess_audio import preprocess_audio_once
+from .preprocess_video import plan_video_preprocess, preprocess_video_once
+
+PREPROCESS_CACHE_DIR = ".preprocess_cache"
+
+# 这些音频处理依赖信号内容，无法通过探测判断是否已满足，设置了就执行
+_CONTENT_AUDIO_OPTIONS = ["rms_norm", "lufs_norm", "highpass", "denoise", "damage_fix", "trim_silence"]
+
+
+def content_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    输入文件的内容采样哈希：文件大小 + 头/中/尾各 chunk_size 字节，大文件也只读取 3MB
+    只覆盖采样区域，不能单独作为缓存键 (见 _cache_key)
+    """
+    size = os.path.getsize(path)
+    h = hashlib.sha1(str(size).encode("utf-8"))
+    with open(path, "rb") as f:
+        offsets = [0] if size <= 3 * chunk_size else [0, size // 2 - chunk_size // 2, size - chunk_size]
+        for offset in offsets:
+            f.seek(offset)
+            h.update(f.read(chunk_size if len(offsets) > 1 else size))
+    return h.hexdigest()
+
+
+def plan_preprocess(file_path: str, mode: str, options: Dict) -> List[str]:
+    """
+    需要执行的预处理步骤 (可能为空)
+    :param mode: "video" 或 "audio"
+    :param options: runner 的标准化选项 (std_fps/target_size/to_16k_mono/force_h264/... 以及音频处理开关)
+    """
+    info = probe_media(file_path)
+    if mode == "video":
+        plan = plan_video_preprocess(info,
+                                     target_fps=options.get("target_fps"),
+                                     target_size=options.get("target_size"),
+                                     to_16k_mono=options.get("to_16k_mono", False),
+                                     force_h264=options.get("force_h264", False),
+                                     target_bitrate=options.get("target_bitrate"),
+                                     force_cfr=options.get("force_cfr", False))
+        return plan["steps"]
+
+    steps = []
+    if options.get("to_16k_mono") and (info.get("sample_rate"), info.get("channels")) != (16000, 1):
+        steps.append("audio_16k_mono")
+    steps += [name for name in _CONTENT_AUDIO_OPTIONS if options.get(name)]
+    return steps
+
+
+def _cache_key(file_path: str, mode: str, options: Dict) -> str:
+    # 采样哈希无法区分只在采样区域之外不同的同大小文件，再加上与其它缓存相同的文件签名 (路径+大小+修改时间)
+    payload = {"input": content_hash(file_path), "file": file_signature(file_path), "mode": mode,
+               "options": {k: v for k, v in options.items() if v not in (None, False)}}
+    text = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def preprocess_input(file_path: str, mode: str, options: Dict, output_dir: str) -> str:
+    """
+    按需预处理输入文件
+    源文件已满足全部要求时直接返回原路径；否则在 output_dir/.preprocess_cache 中
+    查找同一文件 (签名和内容采样都相同)+相同选项的产物，命中则复用，未命中才真正编码
+    :return: 供后续识别使用的文件路径
+    """
+    steps = plan_preprocess(file_path, mode, options)
+    if not steps:
+        logging.warning("Input already satisfies the standardization options, skipping preprocessing.")
+        return file_path
+
+    cache_dir = os.path.join(output_dir, PREPROCESS_CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    key = _cache_key(file_path, mode, options)
+    artifact = os.path.join(cache_dir, f"pre_{key}{os.path.splitext(file_path)[1]}")
+    if os.path.exists(artifact):
+        logging.warning("Reusing preprocessed {} from cache: {}".format(mode, artifact))
+        return artifact
+
+    logging.warning("Preprocessing input ({})...".format(", ".join(steps)))
+    work_dir = tempfile.mkdtemp(prefix="work_", dir=cache_dir)
+    try:
+        if mode == "video":
+            produced = preprocess_video_once(file_path,
+                                             target_fps=options.get("target_fps"),
+                                             target_size=options.get("target_size"),
+                                             to_16k_mono=options.get("to_16k_mono", False),
+                                             force_h264=options.get("force_h264", False),
+                                             target_bitrate=options.get("target_bitrate"),
+                                             force_cfr=options.get("force_cfr", False),
+                                             output_dir=work_dir)
+        else:
+            produced = preprocess_audio_once(file_path,
+                                             to_16k_mono=options.get("to_16k_mono", False),
+                                             target_lufs=options.get("target_lufs", -20.0),
+                                             output_dir=work_dir,
+                                             **{name: bool(options.get(name)) for name in _CONTENT_AUDIO_OPTIONS})
+        os.replace(produced, artifact)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return artifact
@@ -2,11 +2,17 @@
 # -*- encoding: utf-8 -*-
 # Lightweight video preprocessing helpers.
 
+import logging
 import os
-from pathlib import Path
+import shutil
+from typing import Dict, List, Optional
 
-import moviepy.editor as mpy
-from moviepy.editor import AudioFileClip
+from .ffmpeg_utils import probe_media, run_ffmpeg
+
+# Codec / pixel format the preprocessed video is encoded to when it has to be re-encoded
+PRE_VIDEO_CODEC = "libx264"
+PRE_PIX_FMT = "yuv420p"
+PRE_AUDIO_CODEC = "aac"
 
 
 def parse_size(size_str):
@@ -18,6 +24,108 @@ def parse_size(size_str):
     return (int(_str[0]), int(_str[1]))
 
 
+def _parse_kbps(bitrate) -> Optional[float]:
+    if not bitrate:
+        return None
+    text = str(bitrate).strip().lower()
+    if text.endswith("k"):
+        return float(text[:-1])
+    if text.endswith("m"):
+        return float(text[:-1]) * 1000
+    return float(text) / 1000
+
+
+def _video_kbps(info: Dict) -> float:
+    # Video stream bitrate; without it, the container bitrate minus the audio
+    # stream (the container figure alone would count high-bitrate audio as video).
+    if info.get("video_bit_rate"):
+        return info["video_bit_rate"] / 1000
+    total = info.get("bit_rate") or 0
+    return max(total - (info.get("audio_bit_rate") or 0), 0) / 1000
+
+
+def plan_video_preprocess(info: Dict,
+                          target_fps=None,
+                          target_size=None,
+                          to_16k_mono=False,
+                          force_h264=False,
+                          target_bitrate=None,
+                          force_cfr=False) -> Dict:
+    """
+    Decide which preprocessing steps a probed source actually needs.
+    :param info: result of probe_media
+    :return: dict with "video_filters" (ffmpeg -vf chain), "encode_video",
+             "audio" ("copy", "encode" or None), "audio_args" and "steps"
+             (names of the steps that will run, empty when the source already
+             satisfies everything)
+    """
+    steps = []
+    filters = []
+    if target_size is not None and (info.get("width"), info.get("height")) != tuple(target_size):
+        filters.append(f"scale={target_size[0]}:{target_size[1]}")
+        steps.append("scale")
+
+    src_fps = info.get("fps") or 0.0
+    if target_fps is None and force_cfr:
+        # CFR requested but fps not specified: use the source fps rounded
+        target_fps = round(src_fps) if src_fps else None
+    if target_fps is not None and (info.get("variable_fps") or abs(src_fps - target_fps) > 0.01):
+        filters.append(f"fps={target_fps}")
+        steps.append("fps")
+
+    encode_video = bool(filters)
+    if force_h264 and info.get("video_codec") != "h264":
+        encode_video = True
+        steps.append("h264")
+    src_kbps = _video_kbps(info)
+    target_kbps = _parse_kbps(target_bitrate)
+    if target_kbps and (not src_kbps or src_kbps > target_kbps * 1.05):
+        encode_video = True
+        steps.append("bitrate")
+
+    audio, audio_args = None, []
+    if info.get("has_audio"):
+        audio = "copy"
+        if to_16k_mono and (info.get("sample_rate"), info.get("channels")) != (16000, 1):
+            audio_args = ["-ar", "16000", "-ac", "1"]
+            steps.append("audio_16k_mono")
+        if audio_args or info.get("audio_codec") != "aac":
+            audio = "encode"
+            if "audio_16k_mono" not in steps:
+                steps.append("audio_aac")
+
+    return {
+        "video_filters": filters,
+        "encode_video": encode_video,
+        "target_fps": target_fps,
+        "audio": audio,
+        "audio_args": audio_args,
+        "steps": steps,
+    }
+
+
+def build_preprocess_args(file_path: str, out_path: str, plan: Dict,
+                          target_bitrate=None, threads: int = 0) -> List[str]:
+    """One ffmpeg command for a plan; untouched streams are stream-copied."""
+    args = ["-i", file_path, "-map", "0:v:0"]
+    if plan["audio"] is not None:
+        args += ["-map", "0:a:0"]
+    if plan["encode_video"]:
+        if plan["video_filters"]:
+            args += ["-vf", ",".join(plan["video_filters"])]
+        args += ["-c:v", PRE_VIDEO_CODEC, "-preset", "medium", "-pix_fmt", PRE_PIX_FMT]
+        if target_bitrate:
+            args += ["-b:v", str(target_bitrate)]
+    else:
+        args += ["-c:v", "copy"]
+    if plan["audio"] == "encode":
+        args += ["-c:a", PRE_AUDIO_CODEC] + plan["audio_args"]
+    elif plan["audio"] == "copy":
+        args += ["-c:a", "copy"]
+    args += ["-threads", str(threads), out_path]
+    return args
+
+
 def preprocess_video_once(file_path,
                           target_fps=None,
                           target_size=None,
@@ -26,34 +134,33 @@ def preprocess_video_once(file_path,
                           target_bitrate=None,
                           force_cfr=False,
                           output_dir=None):
-    clip = mpy.VideoFileClip(file_path)
-    if target_size is not None and clip.size != list(target_size):
-        clip = clip.resize(newsize=target_size)
-    if target_fps is not None:
-        clip = clip.set_fps(target_fps)
-    elif force_cfr:
-        # if CFR requested but fps not specified, use source fps rounded
-        target_fps = round(clip.fps)
-        clip = clip.set_fps(target_fps)
-    if to_16k_mono and clip.audio is not None:
-        temp_audio = file_path + ".tmp.wav"
-        clip.audio.write_audiofile(temp_audio, fps=16000, nbytes=2, codec="pcm_s16le", ffmpeg_params=["-ac", "1"])
-        new_audio = AudioFileClip(temp_audio)
-        clip = clip.set_audio(new_audio)
+    """
+    Scale / CFR / audio downmix / codec / bitrate in a single ffmpeg run, no
+    temporary files. Steps the probed source already satisfies are skipped;
+    streams that need no change are stream-copied, and a source that needs
+    nothing at all is copied as-is.
+    """
     base = os.path.basename(file_path)
     pre_name = "pre_" + base
     if output_dir is None:
         output_dir = os.path.dirname(file_path)
     os.makedirs(output_dir, exist_ok=True)
     out_path = os.path.join(output_dir, pre_name)
-    write_kwargs = {
-        "fps": target_fps or clip.fps,
-        "audio_codec": "aac",
-    }
-    if force_h264:
-        write_kwargs["codec"] = "libx264"
-    if target_bitrate:
-        write_kwargs["bitrate"] = target_bitrate
-    clip.write_videofile(out_path, **write_kwargs)
-    clip.close()
+
+    plan = plan_video_preprocess(probe_media(file_path), target_fps, target_size, to_16k_mono,
+                                 force_h264, target_bitrate, force_cfr)
+    if not plan["steps"]:
+        logging.info(f"Video preprocessing: {base} already conforms, copying")
+        shutil.copyfile(file_path, out_path)
+        return out_path
+
+    logging.info(f"Video preprocessing: {base} -> {', '.join(plan['steps'])}")
+    root, ext = os.path.splitext(out_path)
+    tmp_path = root + ".part" + ext
+    try:
+        run_ffmpeg(build_preprocess_args(file_path, tmp_path, plan, target_bitrate))
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
     return out_path
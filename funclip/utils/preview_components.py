@@ -4,10 +4,14 @@
 
 import gradio as gr
 import os
-import time
+import json
+import hashlib
+import tempfile
+import threading
 from typing import Optional, Tuple, Dict, Any
-from moviepy.editor import VideoFileClip
 from .export_manager import ExportManager, VideoPreviewManager
+from .ffmpeg_utils import probe_media, run_ffmpeg
+from .file_utils import file_signature
 
 class PreviewAndExportUI:
     """
@@ -98,6 +102,16 @@ class PreviewAndExportUI:
                 value=""
             )
             
+            # 预览片段起点 (占总时长的百分比)
+            components['preview_start'] = gr.Slider(
+                minimum=0,
+                maximum=100,
+                value=0,
+                step=1,
+                label="🔍 预览起点 (%)",
+                info="从视频的任意位置截取3秒预览"
+            )
+            
             # 导出按钮
             with gr.Row():
                 components['export_preview_btn'] = gr.Button(
@@ -261,6 +275,9 @@ class PreviewAndExportUI:
             print("="*80 + "\n")
             return None, message, None, "❌ 导出失败"
 
+    # 导出预览缓存目录
+    PREVIEW_CACHE_DIR = os.path.join(tempfile.gettempdir(), "funclip_export_preview")
+    
     def handle_export_preview(
         self,
         video_path: str,
@@ -270,10 +287,17 @@ class PreviewAndExportUI:
         custom_height: Optional[int],
         custom_bitrate: str,
         custom_fps: Optional[int],
-        preview_seconds: int = 3
+        preview_seconds: int = 3,
+        preview_start: float = 0
     ) -> Tuple[Optional[str], str, str]:
         """
-        生成短预览片段(仅前3秒)，用于在导出前查看效果
+        从视频任意位置生成短预览片段，用于在导出前查看效果
+        使用输入端快速定位(-ss 在 -i 之前)和 ultrafast 预设直接编码目标尺寸，
+        结果按 (源文件, 参数, 时间窗口) 缓存
+        
+        参数:
+            preview_start: 预览起点，占总时长的百分比 (0-100)
+        
         返回: (预览视频路径, 视频信息文本, 日志)
         """
         print("\n" + "="*80)
@@ -290,15 +314,14 @@ class PreviewAndExportUI:
         print(f"[预览导出] 🎯 目标平台: {platform}")
         
         try:
-            print(f"[预览导出] 🔧 加载视频...")
-            clip = VideoFileClip(video_path)
-            duration = clip.duration
+            probed = probe_media(video_path)
+            duration = probed["duration"]
             sub_duration = min(duration, preview_seconds)
-            print(f"[预览导出] ✂️ 截取前 {sub_duration:.1f}秒 (总时长: {duration:.1f}秒)")
-            clip = clip.subclip(0, sub_duration)
+            start = (duration - sub_duration) * min(max(float(preview_start or 0), 0.0), 100.0) / 100.0
+            print(f"[预览导出] ✂️ 截取 {start:.1f}s - {start + sub_duration:.1f}s (总时长: {duration:.1f}秒)")
 
             # 解析目标分辨率
-            original_width, original_height = clip.size
+            original_width, original_height = probed["width"], probed["height"]
             print(f"[预览导出] 📏 原始分辨率: {original_width}x{original_height}")
             
             if custom_width and custom_height:
@@ -315,49 +338,54 @@ class PreviewAndExportUI:
                 target_width, target_height = original_width, original_height
                 print(f"[预览导出] 📐 保持原始分辨率")
 
-            if (target_width, target_height) != (original_width, original_height):
-                print(f"[预览导出] 🔄 调整分辨率: {original_width}x{original_height} → {target_width}x{target_height}")
-                clip = clip.resize((target_width, target_height))
-
-            # 生成预览文件路径
-            preview_path = os.path.join(
-                "/tmp",
-                f"funclip_export_preview_{int(time.time())}.mp4"
-            )
-            print(f"[预览导出] 💾 临时文件路径: {preview_path}")
-
             # 轻量编码，降低码率加快出片
             bitrate = (custom_bitrate.strip() if custom_bitrate else None) or "1500k"
             fps = int(custom_fps) if custom_fps else None
-            print(f"[预览导出] ⚙️ 编码参数: 码率={bitrate}, 帧率={fps or '原始'}, 预设=superfast")
-            print(f"[预览导出] ⏳ 开始编码导出...")
-            
-            clip.write_videofile(
-                preview_path,
-                codec="libx264",
-                audio_codec="aac",
-                bitrate=bitrate,
-                fps=fps or None,
-                preset="superfast",
-                threads=2,
-                logger=None
-            )
 
-            clip.close()
+            # 同一源文件、同样参数、同一时间窗口的预览直接复用
+            cache_key = hashlib.sha1(json.dumps([
+                file_signature(video_path), target_width, target_height,
+                bitrate, fps, round(start, 3), round(sub_duration, 3)
+            ], sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+            os.makedirs(self.PREVIEW_CACHE_DIR, exist_ok=True)
+            preview_path = os.path.join(self.PREVIEW_CACHE_DIR, f"preview_{cache_key}.mp4")
+            print(f"[预览导出] 💾 预览文件路径: {preview_path}")
+
+            cached = os.path.exists(preview_path)
+            if cached:
+                print(f"[预览导出] ♻️ 命中预览缓存")
+            else:
+                print(f"[预览导出] ⚙️ 编码参数: 码率={bitrate}, 帧率={fps or '原始'}, 预设=ultrafast")
+                print(f"[预览导出] ⏳ 开始编码导出...")
+                vf = f"scale={target_width}:{target_height}"
+                if fps:
+                    vf += f",fps={fps}"
+                # 每个请求写自己的临时文件，同样的预览并发生成时不会互相覆盖
+                tmp_path = preview_path[:-4] + f".part{os.getpid()}_{threading.get_ident()}.mp4"
+                try:
+                    run_ffmpeg([
+                        "-ss", f"{start:.3f}", "-i", video_path, "-t", f"{sub_duration:.3f}",
+                        "-vf", vf,
+                        "-c:v", "libx264", "-preset", "ultrafast", "-b:v", bitrate,
+                        "-pix_fmt", "yuv420p",
+                        "-c:a", "aac",
+                        "-movflags", "+faststart",
+                        tmp_path
+                    ])
+                    os.replace(tmp_path, preview_path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
 
             print(f"[预览导出] ✅ 预览生成成功!")
             print(f"[预览导出] 📊 获取预览视频信息...")
             info = self.preview_manager.get_video_info(preview_path)
             info_text = self.preview_manager.format_video_info(info)
-            log = f"✅ 预览生成成功 (前{sub_duration:.1f}s)\n路径: {preview_path}\n分辨率: {target_width}x{target_height}\n码率: {bitrate}"
+            log = f"✅ 预览生成成功 ({start:.1f}s 起 {sub_duration:.1f}s){' [缓存]' if cached else ''}\n路径: {preview_path}\n分辨率: {target_width}x{target_height}\n码率: {bitrate}"
             print(f"[预览导出] 🎉 完成! 文件: {preview_path}")
             print("="*80 + "\n")
             return preview_path, info_text, log
         except Exception as e:
-            try:
-                clip.close()
-            except Exception:
-                pass
             err = f"❌ 预览生成失败: {e}"
             print(f"[预览导出] ❌ 生成失败: {e}")
             print("="*80 + "\n")
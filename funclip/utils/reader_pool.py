@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# 视频读取器池 - 按文件复用 VideoFileClip (及其 ffmpeg 读帧进程)，引用计数借还，限制打开总数，空闲超时自动关闭
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from moviepy.editor import VideoFileClip
+
+
+def _reader_key(path: str, audio: bool):
+    # 文件被覆盖后 (大小/修改时间变化) 不再复用旧的读取器
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_size, int(st.st_mtime), audio
+
+
+class ReaderLease:
+    """一次借用；release() 可重复调用，只生效一次"""
+
+    def __init__(self, pool: "VideoReaderPool", entry: "_Entry"):
+        self._pool = pool
+        self._entry = entry
+        self.clip = entry.clip
+
+    def release(self, reusable: bool = True):
+        if self._entry is not None:
+            entry, self._entry = self._entry, None
+            self._pool._release(entry, reusable)
+
+
+class _Entry:
+    __slots__ = ("key", "clip", "refs", "last_used")
+
+    def __init__(self, key):
+        self.key = key
+        self.clip = None
+        self.refs = 0
+        self.last_used = time.time()
+
+
+class VideoReaderPool:
+    """
+    线程安全的 VideoFileClip 池
+    VideoFileClip 内部的读帧/读音频进程带有读取位置，多个线程同时使用会互相打乱，所以读取器独占借出，
+    引用计数归零后留在池中供同一文件的下一个请求复用，省去重新探测和启动进程。
+    - 打开的读取器总数不超过 max_open：达到上限时先关闭最久未用的空闲读取器，没有空闲的就等待归还
+    - 空闲超过 idle_timeout 秒的读取器由后台线程关闭，池空后线程退出
+    - 借出期间出错的读取器直接关闭，不放回池中
+    长期运行的服务因此只保留有限个 ffmpeg 子进程，不随请求数增长。
+    """
+
+    def __init__(self, max_open: int = 8, idle_timeout: float = 120.0, max_idle_per_file: int = 2):
+        self.max_open = max(1, max_open)
+        self.idle_timeout = idle_timeout
+        self.max_idle_per_file = max_idle_per_file
+        self._cond = threading.Condition()
+        self._entries = []
+        self._reaper = None
+
+    def acquire(self, path: str, audio: bool = True) -> ReaderLease:
+        """借出一个读取器，用完必须 release (或使用 lease 上下文管理器)"""
+        key = _reader_key(path, audio)
+        with self._cond:
+            while True:
+                self._reap_locked(time.time())
+                idle = [e for e in self._entries if e.key == key and e.refs == 0 and e.clip is not None]
+                if idle:
+                    entry = max(idle, key=lambda e: e.last_used)
+                    entry.refs += 1
+                    return ReaderLease(self, entry)
+                if len(self._entries) < self.max_open:
+                    entry = _Entry(key)
+                    entry.refs = 1        # 占位，打开期间不计为空闲
+                    self._entries.append(entry)
+                    break
+                victims = [e for e in self._entries if e.refs == 0 and e.clip is not None]
+                if victims:
+                    self._close_locked(min(victims, key=lambda e: e.last_used))
+                    continue
+                self._cond.wait()
+
+        # 启动 ffmpeg 较慢，在锁外进行
+        try:
+            entry.clip = VideoFileClip(path, audio=audio)
+        except Exception:
+            with self._cond:
+                self._entries.remove(entry)
+                self._cond.notify_all()
+            raise
+        self._ensure_reaper()
+        return ReaderLease(self, entry)
+
+    @contextmanager
+    def lease(self, path: str, audio: bool = True):
+        lease = self.acquire(path, audio)
+        ok = False
+        try:
+            yield lease.clip
+            ok = True
+        finally:
+            lease.release(reusable=ok)
+
+    def _release(self, entry: _Entry, reusable: bool):
+        with self._cond:
+            entry.refs -= 1
+            entry.last_used = time.time()
+            if not reusable:
+                self._close_locked(entry)
+            elif entry.refs == 0:
+                idle = [e for e in self._entries if e.key == entry.key and e.refs == 0]
+                while len(idle) > self.max_idle_per_file:
+                    oldest = min(idle, key=lambda e: e.last_used)
+                    idle.remove(oldest)
+                    self._close_locked(oldest)
+            self._cond.notify_all()
+
+    def _close_locked(self, entry: _Entry):
+        if entry in self._entries:
+            self._entries.remove(entry)
+        try:
+            entry.clip.close()
+        except Exception:
+            pass
+        self._cond.notify_all()
+
+    def _reap_locked(self, now: float):
+        for entry in [e for e in self._entries
+                      if e.refs == 0 and e.clip is not None and now - e.last_used > self.idle_timeout]:
+            self._close_locked(entry)
+
+    def _ensure_reaper(self):
+        with self._cond:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap_loop, name="video-reader-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        with self._cond:
+            while self._entries:
+                self._cond.wait(timeout=max(1.0, self.idle_timeout / 2))
+                self._reap_locked(time.time())
+            self._reaper = None
+
+    def close_all(self):
+        """关闭所有空闲读取器 (借出中的在归还时照常处理)"""
+        with self._cond:
+            for entry in [e for e in self._entries if e.refs == 0 and e.clip is not None]:
+                self._close_locked(entry)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "open": len(self._entries),
+                "in_use": sum(1 for e in self._entries if e.refs > 0),
+                "max_open": self.max_open,
+            }
+
+
+# 进程内共享的读取器池
+video_readers = VideoReaderPool()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# 配乐视频渲染计划 - 可复现、可序列化、按计划哈希缓存渲染结果
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+def part_path(path: str) -> str:
+    """本进程、本线程独有的临时文件名，写完后用 os.replace 换成 path，并发写同一文件互不干扰"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.part{os.getpid()}_{threading.get_ident()}{ext}"
+
+
+def _write_json(path: str, payload, **kwargs):
+    tmp_path = part_path(path)
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, **kwargs)
+    os.replace(tmp_path, path)
+
+
+def _digest(payload) -> str:
+    text = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+class RenderPlan:
+    """
+    配乐视频的渲染计划
+    记录镜头列表、每个镜头的源区间/目标时长/卡点、转场类型与时长以及随机种子。
+    同样的计划一定渲染出同样的结果，因此可以用计划哈希作为缓存键。
+    """
+
+    VERSION = 1
+
+    def __init__(self, video: Dict, bgm: Optional[Dict], seed: int = 0,
+                 shots: Optional[List[Dict]] = None, summary: str = ""):
+        self.video = video
+        self.bgm = bgm
+        self.seed = seed
+        self.shots = shots or []
+        self.summary = summary
+
+    def add_shot(self, src_start, src_end, duration, beat, speed=1.0,
+                 transition="cut", transition_duration=0.0):
+        """
+        添加一个镜头
+        :param src_start/src_end: 源视频中的截取区间 (秒)
+        :param duration: 变速后的目标时长 (含转场重叠)
+        :param beat: 该镜头对齐的节拍时间点 (秒)
+        :param transition: 与上一个镜头之间的转场类型
+        """
+        index = len(self.shots)
+        self.shots.append({
+            "index": index,
+            "src_start": round(float(src_start), 4),
+            "src_end": round(float(src_end), 4),
+            "duration": round(float(duration), 4),
+            "beat": round(float(beat), 4),
+            "speed": round(float(speed), 4),
+            "transition": transition,
+            "transition_duration": round(float(transition_duration), 4),
+            "seed": self.seed * 1000 + index,
+        })
+
+    def to_dict(self) -> Dict:
+        return {
+            "version": self.VERSION,
+            "video": self.video,
+            "bgm": self.bgm,
+            "seed": self.seed,
+            "shots": self.shots,
+            "summary": self.summary,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "RenderPlan":
+        return cls(video=data["video"], bgm=data.get("bgm"), seed=data.get("seed", 0),
+                   shots=data.get("shots", []), summary=data.get("summary", ""))
+
+    def save(self, path: str):
+        _write_json(path, self.to_dict(), indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> "RenderPlan":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    def fingerprint(self) -> str:
+        """整个计划的哈希 (摘要文本只用于展示，不参与哈希)"""
+        payload = self.to_dict()
+        payload.pop("summary", None)
+        return _digest(payload)
+
+    def segment_keys(self, frames: List[Tuple[int, int]], layer_starts: List[float], fps: float,
+                     encoder: Optional[Dict] = None) -> List[str]:
+        """
+        每个镜头片段的哈希
+        片段 i = 从上一个镜头进入的转场窗口 + 镜头 i 的主体(去掉与下一个镜头重叠的尾部)，
+        因此它取决于源视频、本镜头参数、上一个镜头(有转场时)以及下一个转场的时长。
+        片段按绝对帧切割，同样的镜头移动到时间线上别的位置后，帧数可能相差 1 帧，
+        采样时刻相对镜头开始的相位也会变化，所以帧数和首帧相位也计入哈希。
+        :param frames: segment_frames() 的结果
+        :param layer_starts: 每个镜头在时间线上的开始时间 (秒)
+        """
+        def _shot_key(shot):
+            key = {k: v for k, v in shot.items() if k not in ("index", "beat", "seed")}
+            if shot["transition"] == "glitch":
+                # 只有 glitch 转场用到随机种子
+                key["seed"] = shot["seed"]
+            return key
+
+        keys = []
+        for i, shot in enumerate(self.shots):
+            prev = self.shots[i - 1] if i > 0 and shot["transition_duration"] > 0 else None
+            tail = self.shots[i + 1]["transition_duration"] if i + 1 < len(self.shots) else 0.0
+            first, count = frames[i]
+            keys.append(_digest({
+                "version": self.VERSION,
+                "video": self.video,
+                "encoder": encoder,
+                "shot": _shot_key(shot),
+                "prev": _shot_key(prev) if prev else None,
+                "tail": tail,
+                "fps": round(float(fps), 4),
+                "frames": count,
+                "phase": round(first / fps - layer_starts[i], 4),
+            }))
+        return keys
+
+
+def segment_frames(layer_starts: List[float], duration: float, fps: float) -> List[Tuple[int, int]]:
+    """
+    时间线按镜头切成片段后每个片段的 (起始帧, 帧数)
+    片段 i 从镜头 i 开始的那一帧开始，到镜头 i+1 开始的那一帧之前结束，
+    各片段首尾相接，帧数之和等于整条时间线的帧数，拼接后不会相对配乐漂移。
+    """
+    total = int(round(duration * fps))
+    starts = [0] + [min(int(round(start * fps)), total) for start in layer_starts[1:]]
+    ends = starts[1:] + [total]
+    return [(first, max(end - first, 0)) for first, end in zip(starts, ends)]
+
+
+class RenderCache:
+    """
+    渲染结果缓存
+    以计划哈希为键保存输出文件和对应的计划 JSON，
+    以片段哈希为键保存已编码的镜头片段，并缓存源视频的分析结果(人声区间、视觉变化点)。
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.segment_dir = os.path.join(cache_dir, "segments")
+        os.makedirs(self.segment_dir, exist_ok=True)
+
+    def segment_path(self, key: str) -> str:
+        return os.path.join(self.segment_dir, f"seg_{key}.mp4")
+
+    def _analysis_path(self, video_signature: Dict) -> str:
+        return os.path.join(self.cache_dir, f"analysis_{_digest(video_signature)}.json")
+
+    def load_analysis(self, video_signature: Dict) -> Dict:
+        path = self._analysis_path(video_signature)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logging.warning(f"Failed to load analysis cache {path}: {e}")
+            return {}
+
+    def save_analysis(self, video_signature: Dict, analysis: Dict):
+        _write_json(self._analysis_path(video_signature), analysis)
+
+    def _paths(self, plan: RenderPlan):
+        key = plan.fingerprint()
+        return (os.path.join(self.cache_dir, f"musical_{key}.mp4"),
+                os.path.join(self.cache_dir, f"musical_{key}.json"))
+
+    def lookup(self, plan: RenderPlan) -> Optional[str]:
+        video_path, plan_path = self._paths(plan)
+        if os.path.exists(video_path) and os.path.exists(plan_path):
+            return video_path
+        return None
+
+    def store(self, plan: RenderPlan, rendered_path: str) -> str:
+        video_path, plan_path = self._paths(plan)
+        _place_file(rendered_path, video_path)
+        plan.save(plan_path)
+        return video_path
+
+    @staticmethod
+    def export(cached_path: str, output_path: str) -> str:
+        """把缓存文件放到用户期望的输出路径"""
+        if os.path.abspath(cached_path) != os.path.abspath(output_path):
+            _place_file(cached_path, output_path)
+        return output_path
+
+
+def _place_file(src: str, dst: str):
+    # 同一文件系统上优先使用硬链接，避免复制大文件；先放到临时名再替换，并发写同一目标时不会互相删除
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return  # 已经是同一个文件 (rename 到同一 inode 的链接不会生效)
+    tmp_path = part_path(dst)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        logging.info(f"Hard link unavailable, copying {src} -> {dst}")
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Block-wise spectral gating denoiser with constant memory.
+
+from typing import Iterable, Iterator
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import ndimage
+from scipy.signal import get_window
+
+
+class SpectralDenoiser:
+    """
+    Spectral gating with a noise profile estimated from the quietest frames.
+
+    Equivalent to a centered STFT / ISTFT round trip (zero padded, Hann
+    window), but computed over fixed-size blocks of frames: each block is
+    analysed with a few frames of context on each side, its gain mask is
+    smoothed with a separable filter (median over time, mean over
+    frequency), and the result is overlap-added with the tail carried to the
+    next block. Memory use depends on ``block_frames``, not on the length of
+    the recording.
+
+    Usage: call ``estimate_noise`` with the signal as an iterable of mono
+    blocks, then iterate ``process`` over the same signal. For streaming,
+    the same steps are available push-style (``begin_estimate`` /
+    ``feed_estimate`` / ``finish_estimate`` and ``begin`` / ``push`` /
+    ``flush``).
+    """
+
+    def __init__(self, n_fft=1024, hop_length=256, ratio=1.5, time_size=9, freq_size=3,
+                 block_frames=2048, quiet_percentile=25, max_profile_frames=8192):
+        if n_fft % hop_length:
+            raise ValueError("n_fft must be a multiple of hop_length")
+        self.n_fft = n_fft
+        self.hop = hop_length
+        self.ratio = ratio
+        self.time_size = time_size
+        self.freq_size = freq_size
+        self.context = time_size // 2
+        self.block_frames = block_frames
+        self.quiet_percentile = quiet_percentile
+        self.max_profile_frames = max_profile_frames
+        self.window = get_window("hann", n_fft, fftbins=True).astype(np.float32)
+        self.noise_profile = None
+
+    def _stft(self, samples: np.ndarray) -> np.ndarray:
+        frames = sliding_window_view(samples, self.n_fft)[::self.hop]
+        return np.fft.rfft(frames * self.window, axis=1).T
+
+    def begin_estimate(self):
+        """Start a new noise estimate; feed the signal with ``feed_estimate``."""
+        self._est_carry = np.zeros(self.n_fft // 2, dtype=np.float32)
+        self._est_energies, self._est_mag, self._est_idx = [], [], []
+        self._est_stride, self._est_frame = 1, 0
+
+    def feed_estimate(self, block: np.ndarray):
+        y = np.concatenate([self._est_carry, np.asarray(block, dtype=np.float32)])
+        if len(y) < self.n_fft:
+            self._est_carry = y
+            return
+        n_frames = 1 + (len(y) - self.n_fft) // self.hop
+        mag = np.abs(self._stft(y[:(n_frames - 1) * self.hop + self.n_fft]))
+        self._est_carry = y[n_frames * self.hop:]
+
+        energy = mag.mean(axis=0)
+        idx = np.arange(self._est_frame, self._est_frame + n_frames)
+        sel = idx % self._est_stride == 0
+        self._est_energies.append(energy)
+        self._est_mag.append(mag[:, sel])
+        self._est_idx.append(idx[sel])
+        self._est_frame += n_frames
+        if sum(len(i) for i in self._est_idx) > self.max_profile_frames:
+            self._est_stride *= 2
+            mags, idxs = np.concatenate(self._est_mag, axis=1), np.concatenate(self._est_idx)
+            sel = idxs % self._est_stride == 0
+            self._est_mag, self._est_idx = [mags[:, sel]], [idxs[sel]]
+
+    def finish_estimate(self) -> np.ndarray:
+        """
+        Noise magnitude profile: per-bin median over frames whose mean
+        magnitude lies below the ``quiet_percentile`` of all frames.
+        Frame energies are kept for every frame; spectra only for an evenly
+        decimated subset of at most ``max_profile_frames`` frames.
+        """
+        # trailing padding, as in a centered STFT
+        self.feed_estimate(np.zeros(self.n_fft // 2, dtype=np.float32))
+        n_bins = self.n_fft // 2 + 1
+        if not self._est_energies:
+            self.noise_profile = np.zeros((n_bins, 1), dtype=np.float32)
+            return self.noise_profile
+        energies = np.concatenate(self._est_energies)
+        mags, idxs = np.concatenate(self._est_mag, axis=1), np.concatenate(self._est_idx)
+        quiet = energies[idxs] < np.percentile(energies, self.quiet_percentile)
+        source = mags[:, quiet] if quiet.any() else mags
+        self.noise_profile = np.median(source, axis=1, keepdims=True).astype(np.float32)
+        self._est_energies = self._est_mag = self._est_idx = None
+        return self.noise_profile
+
+    def estimate_noise(self, blocks: Iterable[np.ndarray]) -> np.ndarray:
+        """Estimate the noise profile from a signal given as an iterable of mono blocks."""
+        self.begin_estimate()
+        for block in blocks:
+            self.feed_estimate(block)
+        return self.finish_estimate()
+
+    def _smooth(self, mask: np.ndarray) -> np.ndarray:
+        mask = ndimage.median_filter(mask, size=(1, self.time_size), mode="nearest")
+        return ndimage.uniform_filter1d(mask, self.freq_size, axis=0, mode="nearest")
+
+    def _overlap_add(self, frames: np.ndarray):
+        # frames: (n, n_fft) windowed synthesis frames -> summed signal and window power
+        n, ratio, hop = frames.shape[0], self.n_fft // self.hop, self.hop
+        acc = np.zeros((n + ratio - 1, hop), dtype=np.float32)
+        norm = np.zeros_like(acc)
+        parts = frames.reshape(n, ratio, hop)
+        w2 = (self.window ** 2).reshape(ratio, hop)
+        for j in range(ratio):
+            acc[j:j + n] += parts[:, j]
+            norm[j:j + n] += w2[j]
+        return acc.reshape(-1), norm.reshape(-1)
+
+    def begin(self):
+        """Start denoising a new signal; feed it with ``push`` and end with ``flush``."""
+        if self.noise_profile is None:
+            raise RuntimeError("a noise profile must be estimated before denoising")
+        pad = self.n_fft // 2
+        self._buf = np.zeros(pad, dtype=np.float32)   # input, padded coordinates from _buf_start
+        self._buf_start = 0
+        self._next_frame = 0
+        self._tail = np.zeros(self.n_fft - self.hop, dtype=np.float32)
+        self._tail_norm = np.zeros_like(self._tail)
+        self._to_skip = pad                            # leading padding to drop from the output
+        self._total_in = 0
+        self._emitted = 0
+
+    def _emit(self, signal: np.ndarray, final: bool = False) -> np.ndarray:
+        if self._to_skip:
+            dropped = min(self._to_skip, len(signal))
+            signal = signal[dropped:]
+            self._to_skip -= dropped
+        if final:
+            signal = signal[:max(0, self._total_in - self._emitted)]
+        self._emitted += len(signal)
+        return signal
+
+    def _run(self, block: np.ndarray, final: bool) -> np.ndarray:
+        n_fft, hop, ctx = self.n_fft, self.hop, self.context
+        thresh = self.noise_profile * self.ratio + 1e-8
+        self._buf = np.concatenate([self._buf, block])
+        buf_end = self._buf_start + len(self._buf)
+        if buf_end < n_fft:
+            return np.zeros(0, dtype=np.float32)
+        available = 1 + (buf_end - n_fft) // hop
+        end = available if final else available - ctx
+
+        outputs = []
+        while self._next_frame < end:
+            f0 = self._next_frame
+            f1 = min(end, f0 + self.block_frames)
+            c0, c1 = max(0, f0 - ctx), min(available, f1 + ctx)
+            seg = self._buf[c0 * hop - self._buf_start:(c1 - 1) * hop + n_fft - self._buf_start]
+            spec = self._stft(seg)
+            mask = np.clip(np.abs(spec) / thresh, 0.0, 1.0)
+            mask = np.clip(self._smooth(mask), 0.0, 1.0)
+            core = slice(f0 - c0, f1 - c0)
+            frames = np.fft.irfft((spec[:, core] * mask[:, core]).T, n=n_fft, axis=1)
+            acc, norm = self._overlap_add((frames * self.window).astype(np.float32))
+            acc[:len(self._tail)] += self._tail
+            norm[:len(self._tail)] += self._tail_norm
+            done = (f1 - f0) * hop
+            outputs.append(self._emit(acc[:done] / np.maximum(norm[:done], 1e-8)))
+            self._tail, self._tail_norm = acc[done:], norm[done:]
+            self._next_frame = f1
+
+        keep_from = max(0, self._next_frame - ctx) * hop
+        self._buf = self._buf[keep_from - self._buf_start:]
+        self._buf_start = keep_from
+        if final:
+            outputs.append(self._emit(self._tail / np.maximum(self._tail_norm, 1e-8), final=True))
+        return np.concatenate(outputs) if outputs else np.zeros(0, dtype=np.float32)
+
+    def push(self, block: np.ndarray) -> np.ndarray:
+        """Denoise the next block of input; returns whatever output is complete (may be empty)."""
+        block = np.asarray(block, dtype=np.float32)
+        self._total_in += len(block)
+        return self._run(block, final=False)
+
+    def flush(self) -> np.ndarray:
+        """Finish the signal; returns the remaining output."""
+        return self._run(np.zeros(self.n_fft // 2, dtype=np.float32), final=True)
+
+    def process(self, blocks: Iterable[np.ndarray]) -> Iterator[np.ndarray]:
+        """
+        Denoise a signal given as an iterable of mono blocks, yielding output
+        blocks. The output has exactly as many samples as the input.
+        """
+        self.begin()
+        for block in blocks:
+            out = self.push(block)
+            if len(out):
+                yield out
+        out = self.flush()
+        if len(out):
+            yield out
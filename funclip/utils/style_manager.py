@@ -4,12 +4,21 @@
 
 import os
 import json
+import shutil
 import logging
+import tempfile
+import threading
+from collections import OrderedDict
 from typing import Dict, List, Optional, Tuple, Any
-from moviepy.editor import VideoFileClip, ColorClip, CompositeVideoClip
+from moviepy.editor import ColorClip, CompositeVideoClip
 from moviepy.video.fx import all as vfx
 import numpy as np
 import cv2
+from .color_grading import ColorGrader
+from .filter_graph import FilterGraph
+from .ffmpeg_utils import probe_media, run_ffmpeg
+from .job_scheduler import JobCancelled, moviepy_logger
+from .reader_pool import video_readers
 
 
 class StyleTemplateManager:
@@ -18,6 +27,9 @@ class StyleTemplateManager:
     支持应用预设的视频风格模板，包括色彩分级、滤镜、转场、字幕样式等
     """
     
+    # 最多缓存的已编译滤镜图数量 (不同模板、尺寸、开关组合)
+    MAX_FILTER_GRAPHS = 32
+    
     def __init__(self, template_file: Optional[str] = None):
         """
         初始化风格模板管理器
@@ -34,6 +46,9 @@ class StyleTemplateManager:
         
         self.template_file = template_file
         self.templates = self._load_templates()
+        # 已编译的滤镜图 {(模板, 尺寸, 开关): FilterGraph}，按最近使用淘汰，多个工作线程共用
+        self._filter_graphs = OrderedDict()
+        self._filter_graphs_lock = threading.Lock()
     
     def _load_templates(self) -> Dict:
         """
@@ -101,7 +116,8 @@ class StyleTemplateManager:
         apply_color_grading: bool = True,
         apply_filters: bool = True,
         apply_speed: bool = False,
-        custom_subtitle_config: Optional[Dict] = None
+        custom_subtitle_config: Optional[Dict] = None,
+        backend: str = "ffmpeg"
     ) -> Tuple[bool, str, Dict]:
         """
         应用风格模板到视频
@@ -114,6 +130,8 @@ class StyleTemplateManager:
             apply_filters: 是否应用滤镜
             apply_speed: 是否应用速度调整
             custom_subtitle_config: 自定义字幕配置（将覆盖模板配置）
+            backend: "ffmpeg" 把滤镜图翻译为 ffmpeg 滤镜链在单个进程中处理 (失败时回退)，
+                     "python" 逐帧在 Python 中处理
         
         返回:
             (成功标志, 消息, 应用的配置)
@@ -131,46 +149,28 @@ class StyleTemplateManager:
                 print(f"[风格管理器] ❌ 视频文件不存在: {video_path}")
                 return False, f"❌ 视频文件不存在: {video_path}", {}
             
-            print(f"[风格管理器] 📂 正在加载视频: {os.path.basename(video_path)}")
             self.logger.info(f"开始应用风格模板: {template_name} -> {video_path}")
             
-            # 加载视频
-            video = VideoFileClip(video_path)
-            original_duration = video.duration
-            print(f"[风格管理器] ✅ 视频加载完成 (时长: {original_duration:.1f}秒)")
-            
             # 应用的配置记录
             applied_config = {
                 "template_name": template_name,
                 "effects": []
             }
             
-            # 1. 应用色彩分级
+            # 1-2. 色彩分级和滤镜 (编译为一个滤镜图)
             if apply_color_grading and "color_grading" in template:
-                print(f"[风格管理器] 🎨 正在应用色彩分级...")
-                video = self._apply_color_grading(video, template["color_grading"])
                 applied_config["effects"].append("color_grading")
-                print(f"[风格管理器] ✅ 色彩分级完成")
                 self.logger.info("✓ 应用色彩分级")
-            
-            # 2. 应用滤镜
             if apply_filters and "filters" in template:
-                filter_list = template['filters']
-                print(f"[风格管理器] 🎭 正在应用 {len(filter_list)} 个滤镜: {', '.join(filter_list)}")
-                video = self._apply_filters(video, filter_list)
                 applied_config["effects"].append("filters")
-                print(f"[风格管理器] ✅ 滤镜应用完成")
-                self.logger.info(f"✓ 应用滤镜: {', '.join(filter_list)}")
+                self.logger.info(f"✓ 应用滤镜: {', '.join(template['filters'])}")
             
-            # 3. 应用速度调整
-            if apply_speed and "speed" in template:
+            # 3. 速度调整
+            speed_factor = 1.0
+            if apply_speed and "speed" in template and template["speed"] != 1.0:
                 speed_factor = template["speed"]
-                if speed_factor != 1.0:
-                    print(f"[风格管理器] ⚡ 正在调整速度: {speed_factor}x")
-                    video = video.fx(vfx.speedx, speed_factor)
-                    applied_config["effects"].append(f"speed_{speed_factor}x")
-                    print(f"[风格管理器] ✅ 速度调整完成")
-                    self.logger.info(f"✓ 调整速度: {speed_factor}x")
+                applied_config["effects"].append(f"speed_{speed_factor}x")
+                self.logger.info(f"✓ 调整速度: {speed_factor}x")
             
             # 4. 记录字幕配置（用于后续处理）
             subtitle_config = custom_subtitle_config or template.get("subtitle", {})
@@ -189,23 +189,24 @@ class StyleTemplateManager:
             if output_dir:
                 os.makedirs(output_dir, exist_ok=True)
             
-            # 导出视频
-            print(f"[风格管理器] 💾 正在导出视频...")
-            print(f"[风格管理器]    编码器: H.264, 预设: medium, 线程: 4")
-            self.logger.info(f"正在导出风格化视频...")
-            
-            video.write_videofile(
-                output_path,
-                codec="libx264",
-                audio_codec="aac",
-                fps=video.fps,
-                preset="medium",
-                threads=4,
-                logger=None
-            )
-            
-            video.close()
-            print(f"[风格管理器] ✅ 视频导出完成")
+            durations = None
+            if backend == "ffmpeg":
+                try:
+                    durations = self._render_style_ffmpeg(
+                        video_path, output_path, template_name,
+                        apply_color_grading, apply_filters, speed_factor
+                    )
+                except JobCancelled:
+                    raise
+                except Exception as e:
+                    print(f"[风格管理器] ⚠️ ffmpeg 滤镜链处理失败，回退到逐帧处理: {e}")
+                    self.logger.warning(f"ffmpeg 风格后端失败，回退到 Python 后端: {e}")
+            if durations is None:
+                durations = self._render_style_python(
+                    video_path, output_path, template_name,
+                    apply_color_grading, apply_filters, speed_factor
+                )
+            original_duration, new_duration = durations
             
             # 检查文件大小
             file_size_mb = os.path.getsize(output_path) / (1024 * 1024)
@@ -214,7 +215,7 @@ class StyleTemplateManager:
             success_msg = f"✅ 风格应用成功!\n"
             success_msg += f"🎨 模板: {template_name}\n"
             success_msg += f"📁 输出: {output_path}\n"
-            success_msg += f"⏱️ 时长: {original_duration:.1f}s → {video.duration:.1f}s\n"
+            success_msg += f"⏱️ 时长: {original_duration:.1f}s → {new_duration:.1f}s\n"
             success_msg += f"💾 大小: {file_size_mb:.2f} MB\n"
             success_msg += f"✨ 效果: {', '.join(applied_config['effects'])}"
             
@@ -222,6 +223,8 @@ class StyleTemplateManager:
             self.logger.info(success_msg)
             return True, success_msg, applied_config
             
+        except JobCancelled:
+            raise
         except Exception as e:
             error_msg = f"❌ 应用风格失败: {str(e)}"
             print(f"[风格管理器] ❌ 错误: {str(e)}")
@@ -230,80 +233,184 @@ class StyleTemplateManager:
             traceback.print_exc()
             return False, error_msg, {}
     
-    def _apply_color_grading(self, video: VideoFileClip, color_config: Dict) -> VideoFileClip:
+    def _render_style_python(
+        self,
+        video_path: str,
+        output_path: str,
+        template_name: str,
+        apply_color_grading: bool,
+        apply_filters: bool,
+        speed_factor: float
+    ) -> Tuple[float, float]:
         """
-        应用色彩分级
+        逐帧在 Python 中应用滤镜图并用 moviepy 写出
+        
+        返回:
+            (原始时长, 输出时长)
+        """
+        print(f"[风格管理器] 📂 正在加载视频: {os.path.basename(video_path)}")
+        with video_readers.lease(video_path) as video:
+            original_duration = video.duration
+            print(f"[风格管理器] ✅ 视频加载完成 (时长: {original_duration:.1f}秒)")
+        
+            # 色彩分级和滤镜编译为一个滤镜图，每帧一次处理
+            filter_graph = self.compile_filter_graph(
+                template_name, tuple(video.size),
+                apply_color_grading=apply_color_grading,
+                apply_filters=apply_filters
+            )
+            if not filter_graph.is_empty:
+                print(f"[风格管理器] 🎨 滤镜图: {len(filter_graph.stages)} 个节点")
+                video = video.fl_image(filter_graph)
+        
+            if speed_factor != 1.0:
+                print(f"[风格管理器] ⚡ 正在调整速度: {speed_factor}x")
+                video = video.fx(vfx.speedx, speed_factor)
+                print(f"[风格管理器] ✅ 速度调整完成")
+        
+            # 导出视频
+            print(f"[风格管理器] 💾 正在导出视频...")
+            print(f"[风格管理器]    编码器: H.264, 预设: medium, 线程: 4")
+            self.logger.info(f"正在导出风格化视频...")
+        
+            video.write_videofile(
+                output_path,
+                codec="libx264",
+                audio_codec="aac",
+                fps=video.fps,
+                preset="medium",
+                threads=4,
+                logger=moviepy_logger("风格化导出")
+            )
+        
+            new_duration = video.duration
+        print(f"[风格管理器] ✅ 视频导出完成")
+        return original_duration, new_duration
+    
+    def _render_style_ffmpeg(
+        self,
+        video_path: str,
+        output_path: str,
+        template_name: str,
+        apply_color_grading: bool,
+        apply_filters: bool,
+        speed_factor: float
+    ) -> Tuple[float, float]:
+        """
+        把滤镜图翻译为 ffmpeg 滤镜链 (lut1d / colorchannelmixer / 蒙版 blend / setpts+asetrate)，
+        解码、处理、编码都在一个 ffmpeg 进程中完成
+        
+        返回:
+            (原始时长, 输出时长)
+        """
+        info = probe_media(video_path)
+        original_duration = info["duration"]
+        print(f"[风格管理器] 📂 输入视频: {os.path.basename(video_path)} (时长: {original_duration:.1f}秒)")
+        
+        filter_graph = self.compile_filter_graph(
+            template_name, (info["width"], info["height"]),
+            apply_color_grading=apply_color_grading,
+            apply_filters=apply_filters
+        )
+        
+        work_dir = tempfile.mkdtemp(prefix="funclip_style_")
+        try:
+            inputs, filter_complex, maps = filter_graph.to_ffmpeg(
+                work_dir, speed=speed_factor, fps=info.get("fps"), has_audio=info["has_audio"],
+                sample_rate=info.get("sample_rate")
+            )
+            print(f"[风格管理器] 💾 正在用 ffmpeg 滤镜链导出视频...")
+            print(f"[风格管理器]    滤镜链: {filter_complex}")
+            self.logger.info(f"正在导出风格化视频 (ffmpeg)...")
+            args = ["-i", video_path] + inputs + ["-filter_complex", filter_complex] + maps
+            args += ["-c:v", "libx264", "-preset", "medium"]
+            if info["has_audio"]:
+                args += ["-c:a", "aac"]
+            args += ["-movflags", "+faststart", output_path]
+            run_ffmpeg(args)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        
+        print(f"[风格管理器] ✅ 视频导出完成")
+        return original_duration, original_duration / speed_factor
+    
+    def compile_filter_graph(
+        self,
+        template_name: str,
+        frame_size: Tuple[int, int],
+        apply_color_grading: bool = True,
+        apply_filters: bool = True
+    ) -> FilterGraph:
+        """
+        把模板的色彩分级和滤镜编译为滤镜图，按 (模板, 画面尺寸) 缓存
         
         参数:
-            video: 视频片段
-            color_config: 色彩配置
+            template_name: 模板名称
+            frame_size: 画面尺寸 (宽, 高)
+            apply_color_grading: 是否包含色彩分级
+            apply_filters: 是否包含滤镜
         
         返回:
-            处理后的视频片段
+            编译后的滤镜图
+        """
+        key = (template_name, tuple(frame_size), apply_color_grading, apply_filters)
+        with self._filter_graphs_lock:
+            graph = self._filter_graphs.get(key)
+            if graph is not None:
+                self._filter_graphs.move_to_end(key)
+                print(f"[滤镜图] ♻️ 复用已编译的滤镜图: {template_name} {frame_size[0]}x{frame_size[1]}")
+                return graph
+        
+        template = self.get_template(template_name) or {}
+        graph = FilterGraph(frame_size)
+        
+        if apply_color_grading and "color_grading" in template:
+            print(f"[风格管理器] 🎨 正在编译色彩分级...")
+            self._compile_color_grading(graph, template["color_grading"])
+            print(f"[风格管理器] ✅ 色彩分级完成")
+        
+        if apply_filters and "filters" in template:
+            filter_list = template["filters"]
+            print(f"[风格管理器] 🎭 正在编译 {len(filter_list)} 个滤镜: {', '.join(filter_list)}")
+            self._compile_filters(graph, filter_list)
+            print(f"[风格管理器] ✅ 滤镜编译完成")
+        
+        with self._filter_graphs_lock:
+            self._filter_graphs[key] = graph
+            while len(self._filter_graphs) > self.MAX_FILTER_GRAPHS:
+                self._filter_graphs.popitem(last=False)
+        return graph
+    
+    def _compile_color_grading(self, graph: FilterGraph, color_config: Dict):
+        """
+        编译色彩分级: 亮度/对比度/Gamma/色温融合为查找表，饱和度为 3x3 矩阵
+        
+        参数:
+            graph: 滤镜图
+            color_config: 色彩配置
         """
         try:
-            # 提取参数
-            brightness = color_config.get("brightness", 1.0)
-            contrast = color_config.get("contrast", 1.0)
-            saturation = color_config.get("saturation", 1.0)
-            gamma = color_config.get("gamma", 1.0)
-            
-            print(f"[色彩分级] 参数: 亮度={brightness}, 对比度={contrast}, 饱和度={saturation}, Gamma={gamma}")
-            
-            # 应用亮度调整
-            if brightness != 1.0:
-                print(f"[色彩分级] ⚡ 应用亮度调整: {brightness}x")
-                video = video.fx(vfx.colorx, brightness)
-            
-            # 应用对比度调整（通过lum_contrast）
-            if contrast != 1.0:
-                contrast_offset = (contrast - 1.0) * 0.5
-                print(f"[色彩分级] 📊 应用对比度调整: {contrast}x (offset={contrast_offset:.2f})")
-                video = video.fx(vfx.lum_contrast, lum=0, contrast=contrast_offset)
+            grader = ColorGrader(color_config)
+            print(f"[色彩分级] 参数: 亮度={grader.brightness}, 对比度={grader.contrast}, 饱和度={grader.saturation}, "
+                  f"Gamma={grader.gamma}, 色温={grader.temperature}")
             
-            # 应用gamma调整
-            if gamma != 1.0:
-                print(f"[色彩分级] 🌟 应用Gamma校正: {gamma}")
-                video = video.fx(vfx.gamma_corr, gamma)
-            
-            # 实现饱和度调整（通过HSV色彩空间）
-            if saturation != 1.0:
-                print(f"[色彩分级] 🎨 应用饱和度调整: {saturation}x")
-                
-                def adjust_saturation(get_frame, t):
-                    import cv2
-                    frame = get_frame(t)
-                    
-                    # RGB to HSV
-                    hsv = cv2.cvtColor(frame.astype(np.uint8), cv2.COLOR_RGB2HSV).astype(np.float32)
-                    
-                    # 调整饱和度通道 (H, S, V)
-                    hsv[:, :, 1] = np.clip(hsv[:, :, 1] * saturation, 0, 255)
-                    
-                    # HSV to RGB
-                    rgb = cv2.cvtColor(hsv.astype(np.uint8), cv2.COLOR_HSV2RGB)
-                    
-                    return rgb
-                
-                video = video.fl(adjust_saturation)
+            if grader.is_identity:
+                print(f"[色彩分级] ℹ️ 参数均为默认值，跳过")
+                return
             
+            graph.add_color_grading(grader)
             print(f"[色彩分级] ✅ 色彩分级完成")
-            return video
-            
+        
         except Exception as e:
             self.logger.warning(f"色彩分级应用失败: {e}")
-            return video
     
-    def _apply_filters(self, video: VideoFileClip, filters: List[str]) -> VideoFileClip:
+    def _compile_filters(self, graph: FilterGraph, filters: List[str]):
         """
-        应用滤镜列表
+        编译滤镜列表
         
         参数:
-            video: 视频片段
+            graph: 滤镜图
             filters: 滤镜名称列表
-        
-        返回:
-            处理后的视频片段
         """
         filter_defs = self.templates.get("filter_definitions", {})
         
@@ -313,87 +420,17 @@ class StyleTemplateManager:
                 self.logger.warning(f"未定义的滤镜: {filter_name}")
                 continue
             
-            print(f"[滤镜] [{i}/{len(filters)}] 正在应用: {filter_name}")
+            filter_config = filter_defs[filter_name]
+            filter_type = filter_config.get("type")
+            print(f"[滤镜] [{i}/{len(filters)}] 🎭 编译滤镜 '{filter_name}' (类型: {filter_type})")
             try:
-                video = self._apply_single_filter(video, filter_name, filter_defs[filter_name])
-                print(f"[滤镜] ✅ {filter_name} 应用完成")
+                if graph.add_filter(filter_type, filter_config):
+                    print(f"[滤镜] ✅ {filter_name} 编译完成")
+                else:
+                    self.logger.warning(f"不支持的滤镜类型: {filter_type}")
             except Exception as e:
                 print(f"[滤镜] ⚠️  {filter_name} 应用失败: {e}")
                 self.logger.warning(f"滤镜 {filter_name} 应用失败: {e}")
-        
-        return video
-    
-    def _apply_single_filter(
-        self, 
-        video: VideoFileClip, 
-        filter_name: str, 
-        filter_config: Dict
-    ) -> VideoFileClip:
-        """
-        应用单个滤镜
-        
-        参数:
-            video: 视频片段
-            filter_name: 滤镜名称
-            filter_config: 滤镜配置
-        
-        返回:
-            处理后的视频片段
-        """
-        filter_type = filter_config.get("type")
-        print(f"[滤镜] 🎭 应用滤镜 '{filter_name}' (类型: {filter_type})")
-        
-        if filter_type == "colorx":
-            factor = filter_config.get("factor", 1.0)
-            return video.fx(vfx.colorx, factor)
-        
-        elif filter_type == "lum_contrast":
-            lum = filter_config.get("lum", 0)
-            contrast = filter_config.get("contrast", 0)
-            return video.fx(vfx.lum_contrast, lum=lum, contrast=contrast)
-        
-        elif filter_type == "gamma_corr":
-            gamma = filter_config.get("gamma", 1.0)
-            return video.fx(vfx.gamma_corr, gamma)
-        
-        elif filter_type == "blur":
-            # moviepy的blur效果
-            kernel_size = filter_config.get("kernel_size", 3)
-            # 注意：需要额外处理
-            return video
-        
-        elif filter_type == "mask_vignette":
-            # 暗角效果
-            size = filter_config.get("size", 0.8)
-            print(f"[滤镜] 🌑 暗角效果强度: {1-size:.2f}")
-            
-            def vignette_effect(get_frame, t):
-                frame = get_frame(t)
-                h, w = frame.shape[:2]
-                
-                # 创建径向渐变蒙版
-                Y, X = np.ogrid[:h, :w]
-                center_y, center_x = h / 2, w / 2
-                
-                # 计算每个像素到中心的距离
-                dist_from_center = np.sqrt((X - center_x)**2 + (Y - center_y)**2)
-                max_dist = np.sqrt(center_x**2 + center_y**2)
-                
-                # 创建渐变蒙版 - 增强效果
-                mask = 1 - ((dist_from_center / max_dist) ** 1.5) * (1 - size)
-                mask = np.clip(mask, 0, 1)
-                
-                # 应用蒙版
-                if len(frame.shape) == 3:
-                    mask = mask[:, :, np.newaxis]
-                
-                return (frame * mask).astype(np.uint8)
-            
-            return video.fl(vignette_effect)
-        
-        else:
-            self.logger.warning(f"不支持的滤镜类型: {filter_type}")
-            return video
     
     def get_subtitle_config(self, template_name: str) -> Dict:
         """
@@ -449,7 +486,8 @@ class StyleTemplateManager:
             info += f"  • 亮度: {cg.get('brightness', 1.0)}\n"
             info += f"  • 对比度: {cg.get('contrast', 1.0)}\n"
             info += f"  • 饱和度: {cg.get('saturation', 1.0)}\n"
-            info += f"  • Gamma: {cg.get('gamma', 1.0)}\n\n"
+            info += f"  • Gamma: {cg.get('gamma', 1.0)}\n"
+            info += f"  • 色温: {cg.get('temperature', 1.0)}\n\n"
         
         # 滤镜信息
         if "filters" in template:
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# 时间线渲染器 - 基于起止事件维护活动图层集合，只在转场重叠处合成
+
+import numpy as np
+from moviepy.editor import VideoClip
+from .transitions import TransitionCompositor
+
+
+class TimelineRenderer:
+    """
+    时间线渲染器
+    用按时间排序的起止事件列表维护当前活动的图层集合：
+    只有一个图层活动时直接返回该图层的帧，两个图层重叠(转场)时才调用合成器混合。
+    渲染开销只与输出时长相关，与图层数量无关。
+    """
+
+    def __init__(self, size):
+        w, h = size
+        self.size = (w, h)
+        self.layers = []
+        self.compositor = TransitionCompositor(size)
+        self._black = np.zeros((h, w, 3), dtype=np.uint8)
+        self._events = None
+        self._cursor = 0
+        self._active = []
+        self._last_t = None
+
+    def add_layer(self, clip, start, transition="cut", overlap=0.0, seed=0):
+        """
+        添加一个图层
+        :param start: 图层在时间线上的开始时间 (秒)
+        :param transition: 与上一个图层重叠时使用的转场类型
+        :param overlap: 与上一个图层的重叠时长 (秒)
+        :param seed: 转场随机种子
+        """
+        self.layers.append({
+            "clip": clip,
+            "start": start,
+            "end": start + clip.duration,
+            "transition": transition,
+            "overlap": overlap,
+            "seed": seed,
+        })
+        self._events = None
+
+    @property
+    def duration(self):
+        return max((layer["end"] for layer in self.layers), default=0.0)
+
+    def _build_events(self):
+        # 同一时刻先处理结束事件，保证区间为 [start, end)
+        events = []
+        for idx, layer in enumerate(self.layers):
+            events.append((layer["start"], 1, idx))
+            events.append((layer["end"], 0, idx))
+        events.sort()
+        self._events = events
+        self._reset()
+
+    def _reset(self):
+        self._cursor = 0
+        self._active = []
+        self._last_t = None
+
+    def _advance(self, t):
+        if self._events is None:
+            self._build_events()
+        if self._last_t is not None and t < self._last_t:
+            # 向后跳转 (seek) 时重放事件
+            self._reset()
+        events = self._events
+        while self._cursor < len(events) and events[self._cursor][0] <= t:
+            _, is_start, idx = events[self._cursor]
+            if is_start:
+                self._active.append(idx)
+            elif idx in self._active:
+                self._active.remove(idx)
+            self._cursor += 1
+        self._last_t = t
+        return self._active
+
+    def _layer_frame(self, layer, t):
+        clip = layer["clip"]
+        local_t = min(max(t - layer["start"], 0.0), clip.duration - 1e-3)
+        return clip.get_frame(local_t)
+
+    def make_frame(self, t):
+        active = self._advance(t)
+        if not active:
+            return self._black
+        if len(active) == 1:
+            return self._layer_frame(self.layers[active[0]], t)
+
+        # 重叠区间：取最近开始的两个图层进行混合
+        prev_layer, next_layer = (self.layers[i] for i in sorted(active)[-2:])
+        overlap = next_layer["overlap"]
+        progress = (t - next_layer["start"]) / overlap if overlap > 0 else 1.0
+        return self.compositor.blend(
+            next_layer["transition"],
+            self._layer_frame(prev_layer, t),
+            self._layer_frame(next_layer, t),
+            progress,
+            seed=next_layer["seed"],
+        )
+
+    def to_clip(self, fps=None):
+        """生成可直接写出的 VideoClip (不含音频)"""
+        clip = VideoClip(make_frame=self.make_frame, duration=self.duration)
+        if fps:
+            clip = clip.set_fps(fps)
+        return clip
@@ -1,80 +1,113 @@
-from moviepy.editor import CompositeVideoClip, TextClip, ColorClip
-import math
+import random
+import numpy as np
+import cv2
 
-class TransFX:
+
+def _ease_out(progress):
+    # 使用 ease-out 曲线让运动更自然 (1 - (1-x)^3)
+    return 1 - pow(1 - progress, 3)
+
+
+class TransitionCompositor:
     """
-    定义“进场”特效 (Entry Effects)。
-    这些特效只应用于当前镜头(Incoming Clip)，通过合成覆盖在上一个镜头之上。
+    帧级转场合成器 (Frame-level Compositor)
+    只在转场重叠窗口内工作：输入上一个镜头的帧(prev)和当前镜头的帧(next)，
+    使用 OpenCV 仿射变换 + 预分配缓冲区合成一帧输出。
+    注意：返回的帧是内部缓冲区，在下一次调用前有效。
     """
 
+    def __init__(self, size):
+        w, h = size
+        self.size = (w, h)
+        self._out = np.empty((h, w, 3), dtype=np.uint8)
+        self._warp = np.empty((h, w, 3), dtype=np.uint8)
+        self._matrix = np.zeros((2, 3), dtype=np.float32)
+
     @staticmethod
-    def slide_in(clip, duration, direction='left'):
-        """
-        推镜转场 (Slide/Push)
-        镜头从屏幕外滑入，覆盖前一个镜头。
-        """
-        w, h = clip.size
-        
-        def pos(t):
-            # t 从 0 到 duration
-            if t >= duration:
-                return (0, 0)
-            
-            progress = t / duration
-            # 使用 ease-out 曲线让运动更自然 (1 - (1-x)^3)
-            ease = 1 - pow(1 - progress, 3) 
-            
-            if direction == 'left': # 从右往左进
-                return (int(w * (1 - ease)), 0)
-            elif direction == 'right': # 从左往右进
-                return (int(-w * (1 - ease)), 0)
-            elif direction == 'up': # 从下往上进
-                return (0, int(h * (1 - ease)))
-            elif direction == 'down': # 从上往下进
-                return (0, int(-h * (1 - ease)))
-            return (0,0)
+    def _as_uint8(frame):
+        if frame.dtype != np.uint8:
+            frame = np.clip(frame, 0, 255).astype(np.uint8)
+        return frame
 
-        # 必须设置 composite 才能应用 position
-        return clip.set_position(pos)
+    def _translate(self, src, dst, dx, dy):
+        """将 src 平移 (dx, dy) 后覆盖到 dst 上，超出部分保留 dst 原像素"""
+        m = self._matrix
+        m[0, 0], m[0, 1], m[0, 2] = 1.0, 0.0, dx
+        m[1, 0], m[1, 1], m[1, 2] = 0.0, 1.0, dy
+        cv2.warpAffine(src, m, self.size, dst=dst,
+                       flags=cv2.INTER_NEAREST, borderMode=cv2.BORDER_TRANSPARENT)
 
-    @staticmethod
-    def zoom_in(clip, duration):
+    def _scale(self, src, dst, scale):
+        """将 src 以画面中心缩放后覆盖到 dst 上"""
+        w, h = self.size
+        m = self._matrix
+        m[0, 0], m[0, 1], m[0, 2] = scale, 0.0, (1 - scale) * w / 2
+        m[1, 0], m[1, 1], m[1, 2] = 0.0, scale, (1 - scale) * h / 2
+        cv2.warpAffine(src, m, self.size, dst=dst,
+                       flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_TRANSPARENT)
+
+    def blend(self, kind, prev_frame, next_frame, progress, seed=0):
         """
-        缩放进场 (Zoom In / Scale Up)
-        镜头从小变大，伴随透明度变化。
+        合成转场窗口内的一帧
+        :param kind: 转场类型 (slide_left / slide_up / zoom_in / crossfade / fade_black / glitch ...)
+        :param progress: 转场进度 0.0 -> 1.0
+        :param seed: 随机种子 (glitch 抖动)，同样的种子和进度总是得到同一帧
         """
-        def resize_func(t):
-            if t >= duration:
-                return 1.0
-            # 0.5 -> 1.0
-            progress = t / duration
-            ease = 1 - pow(1 - progress, 3)
-            return 0.5 + 0.5 * ease
+        prev_frame = self._as_uint8(prev_frame)
+        next_frame = self._as_uint8(next_frame)
+        progress = min(max(progress, 0.0), 1.0)
+        out = self._out
+        w, h = self.size
 
-        # 同时应用 resize 和 fadein
-        # 注意：MoviePy 的 resize 比较耗时
-        return clip.resize(resize_func).fadein(duration)
+        if kind.startswith(("slide_", "wipe_")):
+            # 推镜转场 (Slide/Push)：镜头从屏幕外滑入，覆盖前一个镜头
+            ease = _ease_out(progress)
+            direction = kind.split('_')[1]
+            dx, dy = 0.0, 0.0
+            if direction == 'left':  # 从右往左进
+                dx = w * (1 - ease)
+            elif direction == 'right':  # 从左往右进
+                dx = -w * (1 - ease)
+            elif direction == 'up':  # 从下往上进
+                dy = h * (1 - ease)
+            elif direction == 'down':  # 从上往下进
+                dy = -h * (1 - ease)
+            np.copyto(out, prev_frame)
+            self._translate(next_frame, out, dx, dy)
+            if kind.startswith("wipe"):
+                # 划像 (Wipe) 简化版：Slide + 前半段叠化
+                alpha = min(1.0, progress * 2)
+                np.copyto(self._warp, out)
+                cv2.addWeighted(self._warp, alpha, prev_frame, 1 - alpha, 0, dst=out)
+            return out
 
-    @staticmethod
-    def wipe_in(clip, duration, direction='left'):
-        """
-        划像转场 (Wipe) - 简化版使用 Slide 模拟，或者结合 Mask
-        为了性能，这里使用带边缘模糊的 Slide 模拟 Wipe
-        """
-        # 真正的 Wipe 需要动 Mask，这里用 Slide + Crossfade 模拟类似效果
-        return TransFX.slide_in(clip, duration, direction).crossfadein(duration / 2)
+        if kind == "zoom_in":
+            # 缩放进场 (Zoom In)：镜头从 0.5 倍放大到 1.0 倍，伴随透明度变化
+            ease = _ease_out(progress)
+            np.copyto(self._warp, prev_frame)
+            self._scale(next_frame, self._warp, 0.5 + 0.5 * ease)
+            cv2.addWeighted(self._warp, progress, prev_frame, 1 - progress, 0, dst=out)
+            return out
 
-    @staticmethod
-    def glitch(clip, duration):
-        """
-        故障风 (Glitch) - 简单的闪烁色差模拟
-        """
-        # 简单模拟：快速闪白 + 随机位置抖动
-        import random
-        def pos(t):
-            if t > duration: return (0,0)
-            if random.random() > 0.5:
-                return (random.randint(-10, 10), random.randint(-10, 10))
-            return (0,0)
-        
-        return clip.set_position(pos).fadein(0.1)
\ No newline at end of file
+        if kind == "crossfade":
+            cv2.addWeighted(next_frame, progress, prev_frame, 1 - progress, 0, dst=out)
+            return out
+
+        if kind == "fade_black":
+            # 当前镜头从黑场淡入，直接覆盖前一个镜头
+            cv2.multiply(next_frame, (progress, progress, progress, 0), dst=out, dtype=cv2.CV_8U)
+            return out
+
+        if kind == "glitch":
+            # 故障风 (Glitch)：当前镜头随机位置抖动，覆盖前一个镜头
+            rng = random.Random(seed * 100003 + int(progress * 10000))
+            dx, dy = 0, 0
+            if rng.random() > 0.5:
+                dx, dy = rng.randint(-10, 10), rng.randint(-10, 10)
+            np.copyto(out, prev_frame)
+            self._translate(next_frame, out, dx, dy)
+            return out
+
+        # 未知类型：等同于硬切
+        np.copyto(out, next_frame)
+        return out
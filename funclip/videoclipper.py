@@ -7,9 +7,13 @@ import re
 import os
 import sys
 import copy
+import json
+import hashlib
+import tempfile
 import librosa
 import logging
 import argparse
+import threading
 import numpy as np
 import soundfile as sf
 import cv2
@@ -22,23 +26,36 @@ from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
 from utils.subtitle_utils import generate_srt, generate_srt_clip
 from utils.argparse_tools import ArgumentParser, get_commandline_args
 from utils.trans_utils import pre_proc, proc, write_state, load_state, proc_spk, convert_pcm_to_float
-from llm.video_understanding import ShotDetector, VideoSemanticUnderstander
 from multi_video_concat import concat_videos
-from utils.preprocess_video import preprocess_video_once, parse_size
-from utils.preprocess_audio import preprocess_audio_once
+from utils.preprocess_video import parse_size
+from utils.preprocess_plan import preprocess_input
 
 from moviepy.editor import VideoFileClip, AudioFileClip, CompositeAudioClip, concatenate_videoclips, vfx
 from utils.music_manager import MusicManager 
 from utils.director import Director
 from utils.export_manager import ExportManager, VideoPreviewManager
 import librosa
-from utils.transitions import TransFX
+from utils.timeline import TimelineRenderer
+from utils.render_plan import RenderPlan, RenderCache, part_path, segment_frames
+from utils.file_utils import file_signature
+from utils.ffmpeg_utils import concat_segments, probe_media, run_ffmpeg
+from utils.reader_pool import video_readers
+from utils.beat_tracker import BeatTracker, extend_beats
+from utils.loudness import measure_file, measure_intervals, gain_to_target
+from utils.daemon_client import daemon_address, daemon_status, submit_job
+from utils.job_scheduler import JobCancelled, check_cancelled, moviepy_logger, report_progress
 
 class VideoClipper():
+    # 配乐视频片段的编码参数 (所有片段一致，才能无损拼接)
+    SEGMENT_ENCODER = {"codec": "libx264", "preset": "medium", "ffmpeg_params": ["-pix_fmt", "yuv420p"]}
+    # 背景音乐响度：没有人声时的目标响度、比人声低多少 LU、增益后真峰值的上限
+    BGM_TARGET_LUFS = -20.0
+    BGM_DUCK_LU = 8.0
+    BGM_PEAK_CEILING_DBTP = -1.0
+
     def __init__(self, funasr_model):
         logging.warning("Initializing VideoClipper.")
         self.funasr_model = funasr_model
-        self.GLOBAL_COUNT = 0
         self.video_understander = None
         self.shot_detector = None
         self.export_manager = ExportManager()
@@ -46,6 +63,8 @@ class VideoClipper():
 
     def init_semantic_understander(self, model_path, device="cuda"):
         try:
+            # torch/transformers 只在真正使用视觉理解时导入
+            from llm.video_understanding import ShotDetector, VideoSemanticUnderstander
             self.video_understander = VideoSemanticUnderstander(model_path=model_path, device=device)
             self.shot_detector = ShotDetector(threshold=0.7)
             logging.info("VideoSemanticUnderstander initialized successfully.")
@@ -64,7 +83,9 @@ class VideoClipper():
 
         try:
             # 1. 检测镜头
+            report_progress(0.0, "镜头检测")
             shots = self.shot_detector.detect(video_path, threshold=0.7)
+            check_cancelled()
             if not shots:
                 return "No shots detected.", None
                 
@@ -97,6 +118,8 @@ class VideoClipper():
             
             return ui_output, final_data_wrapper
             
+        except JobCancelled:
+            raise
         except Exception as e:
             logging.error(f"Error during semantic understanding: {e}")
             return f"Error: {e}", None
@@ -116,6 +139,8 @@ class VideoClipper():
             logging.warning("Input wav shape: {}, only first channel reserved.".format(data.shape))
             data = data[:,0]
         state['audio_input'] = (sr, data)
+        check_cancelled()
+        report_progress(0.2, "语音识别")
         if sd_switch == 'Yes':
             rec_result = self.funasr_model.generate(data, 
                                                     return_spk_res=True,
@@ -140,6 +165,7 @@ class VideoClipper():
                                                     en_post_proc=self.lang=='en',
                                                     cache={})
             res_srt = generate_srt(rec_result[0]['sentence_info'])
+        check_cancelled()
         state['recog_res_raw'] = rec_result[0]['raw_text']
         state['timestamp'] = rec_result[0]['timestamp']
         state['sentences'] = rec_result[0]['sentence_info']
@@ -212,30 +238,26 @@ class VideoClipper():
         return (sr, res_audio), message, clip_srt
 
     def video_recog(self, video_filename, sd_switch='no', hotwords="", output_dir=None):
-        video = mpy.VideoFileClip(video_filename)
-        
         # 准备输出文件名
         if output_dir is not None:
             os.makedirs(output_dir, exist_ok=True)
             _, base_name = os.path.split(video_filename)
             base_name, _ = os.path.splitext(base_name)
             clip_video_file = base_name + '_clip.mp4'
-            audio_file = base_name + '.wav'
-            audio_file = os.path.join(output_dir, audio_file)
+            audio_dir = output_dir
         else:
             base_name, _ = os.path.splitext(video_filename)
             clip_video_file = base_name + '_clip.mp4'
-            audio_file = base_name + '.wav'
+            audio_dir = os.path.dirname(os.path.abspath(video_filename))
 
-        # state 初始化
+        # state 初始化 (只保存文件名，不保存打开的读取器，state 可以在会话间安全传递)
         state = {
             'video_filename': video_filename,
             'clip_video_file': clip_video_file,
-            'video': video,
         }
 
         # --- [修改点]：针对无声视频的兼容处理 ---
-        if video.audio is None:
+        if not probe_media(video_filename).get('has_audio'):
             logging.warning("⚠️ No audio track found in video. Skipping ASR.")
             # 构造一个空的 state，骗过后续流程
             state['sentences'] = [] # 空的识别结果
@@ -247,19 +269,31 @@ class VideoClipper():
         # -------------------------------------
 
         # 如果有声音，走正常流程
+        # 每个请求使用独立的临时音频文件，同一视频的并发识别互不覆盖
+        fd, audio_file = tempfile.mkstemp(prefix=base_name + '_', suffix='.wav', dir=audio_dir)
+        os.close(fd)
         try:
-            video.audio.write_audiofile(audio_file)
+            report_progress(0.0, "提取音轨")
+            run_ffmpeg(["-i", video_filename, "-vn", "-acodec", "pcm_s16le", audio_file])
+            check_cancelled()
             wav = librosa.load(audio_file, sr=16000)[0]
-            
             if os.path.exists(audio_file):
                 os.remove(audio_file)
                 
             return self.recog((16000, wav), sd_switch, state, hotwords, output_dir)
             
+        except JobCancelled:
+            if os.path.exists(audio_file):
+                os.remove(audio_file)
+            raise
         except Exception as e:
             # 兜底捕获音频处理错误
             logging.error(f"Error processing audio: {e}")
+            if os.path.exists(audio_file):
+                os.remove(audio_file)
             state['sentences'] = []
+            # 标记识别失败，调用方不应把空结果当作"没有人声"缓存下来
+            state['recog_error'] = str(e)
             return "", "", state
 
     def video_clip(self, 
@@ -277,7 +311,6 @@ class VideoClipper():
         recog_res_raw = state['recog_res_raw']
         timestamp = state['timestamp']
         sentences = state['sentences']
-        video = state['video']
         clip_video_file = state['clip_video_file']
         video_filename = state['video_filename']
         
@@ -311,79 +344,123 @@ class VideoClipper():
         else:  # AI clip pass timestamp as input directly
             all_ts = [[i[0]*16.0, i[1]*16.0] for i in timestamp_list]
         
-        srt_index = 0
-        time_acc_ost = 0.0
         ts = all_ts
         # ts.sort()
         clip_srt = ""
         if len(ts):
             if self.lang == 'en' and isinstance(sentences, str):
                 sentences = sentences.split()
-            start, end = ts[0][0] / 16000, ts[0][1] / 16000
-            srt_clip, subs, srt_index = generate_srt_clip(sentences, start, end, begin_index=srt_index, time_acc_ost=time_acc_ost)
-            start, end = start+start_ost/1000.0, end+end_ost/1000.0
-            video_clip = video.subclip(start, end)
-            start_end_info = "from {} to {}".format(start, end)
-            clip_srt += srt_clip
-            if add_sub:
-                generator = lambda txt: TextClip(txt, font='./font/STHeitiMedium.ttc', fontsize=font_size, color=font_color)
-                subtitles = SubtitlesClip(subs, generator)
-                video_clip = CompositeVideoClip([video_clip, subtitles.set_pos(('center','bottom'))])
-            concate_clip = [video_clip]
-            time_acc_ost += end+end_ost/1000.0 - (start+start_ost/1000.0)
-            for _ts in ts[1:]:
-                start, end = _ts[0] / 16000, _ts[1] / 16000
-                srt_clip, subs, srt_index = generate_srt_clip(sentences, start, end, begin_index=srt_index-1, time_acc_ost=time_acc_ost)
-                if not len(subs):
-                    continue
-                chi_subs = []
-                sub_starts = subs[0][0][0]
-                for sub in subs:
-                    chi_subs.append(((sub[0][0]-sub_starts, sub[0][1]-sub_starts), sub[1]))
-                start, end = start+start_ost/1000.0, end+end_ost/1000.0
-                _video_clip = video.subclip(start, end)
-                start_end_info += ", from {} to {}".format(str(start)[:5], str(end)[:5])
-                clip_srt += srt_clip
-                if add_sub:
-                    generator = lambda txt: TextClip(txt, font='./font/STHeitiMedium.ttc', fontsize=font_size, color=font_color)
-                    subtitles = SubtitlesClip(chi_subs, generator)
-                    _video_clip = CompositeVideoClip([_video_clip, subtitles.set_pos(('center','bottom'))])
-                    # _video_clip.write_videofile("debug.mp4", audio_codec="aac")
-                concate_clip.append(copy.copy(_video_clip))
-                time_acc_ost += end+end_ost/1000.0 - (start+start_ost/1000.0)
-            message = "{} periods found in the audio: ".format(len(ts)) + start_end_info
-            logging.warning("Concating...")
-            if len(concate_clip) > 1:
-                video_clip = concatenate_videoclips(concate_clip)
-            # clip_video_file = clip_video_file[:-4] + '_no{}.mp4'.format(self.GLOBAL_COUNT)
-            if output_dir is not None:
-                os.makedirs(output_dir, exist_ok=True)
-                _, file_with_extension = os.path.split(clip_video_file)
-                clip_video_file_name, _ = os.path.splitext(file_with_extension)
-                print(output_dir, clip_video_file)
-                clip_video_file = os.path.join(output_dir, "{}_no{}.mp4".format(clip_video_file_name, self.GLOBAL_COUNT))
-                temp_audio_file = os.path.join(output_dir, "{}_tempaudio_no{}.mp4".format(clip_video_file_name, self.GLOBAL_COUNT))
+            # 输出文件名由 源文件 + 裁剪区间 + 字幕参数 决定：并发请求互不覆盖，相同请求直接复用已有结果
+            clip_video_file = self._clip_output_path(
+                clip_video_file, output_dir, video_filename, ts, start_ost, end_ost,
+                add_sub, font_size, font_color, sentences)
+            if os.path.exists(clip_video_file):
+                logging.warning("Clip already rendered, reusing {}".format(clip_video_file))
+                clip_srt, message = self._render_clip(
+                    None, ts, sentences, start_ost, end_ost, add_sub, font_size, font_color, None)
             else:
-                clip_video_file = clip_video_file[:-4] + '_no{}.mp4'.format(self.GLOBAL_COUNT)
-                temp_audio_file = clip_video_file[:-4] + '_tempaudio_no{}.mp4'.format(self.GLOBAL_COUNT)
-            video_clip.write_videofile(clip_video_file, audio_codec="aac", temp_audiofile=temp_audio_file)
-            self.GLOBAL_COUNT += 1
+                with video_readers.lease(video_filename) as video:
+                    clip_srt, message = self._render_clip(
+                        video, ts, sentences, start_ost, end_ost, add_sub, font_size, font_color,
+                        clip_video_file)
         else:
             clip_video_file = video_filename
             message = "No period found in the audio, return raw speech. You may check the recognition result and try other destination text."
             srt_clip = ''
         return clip_video_file, message, clip_srt
-    
+
+    def _clip_output_path(self, clip_video_file, output_dir, video_filename, ts, start_ost, end_ost,
+                          add_sub, font_size, font_color, sentences):
+        """按内容寻址的裁剪结果路径: <原文件名>_<请求摘要>.mp4"""
+        payload = {
+            "video": file_signature(video_filename),
+            "ts": [[float(b), float(e)] for b, e in ts],
+            "ost": [start_ost, end_ost],
+            # 烧录字幕时字幕文本也决定画面内容
+            "sub": [font_size, font_color, str(sentences)] if add_sub else None,
+        }
+        digest = hashlib.sha1(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+            _, file_with_extension = os.path.split(clip_video_file)
+            clip_video_file_name, _ = os.path.splitext(file_with_extension)
+            return os.path.join(output_dir, "{}_{}.mp4".format(clip_video_file_name, digest))
+        return clip_video_file[:-4] + '_{}.mp4'.format(digest)
+
+    def _render_clip(self, video, ts, sentences, start_ost, end_ost, add_sub, font_size, font_color,
+                     clip_video_file):
+        """
+        拼接各区间并写出 (video 为本请求借出的读取器；为 None 时只生成字幕和日志，不渲染)
+        :return: (clip_srt, message)
+        """
+        srt_index = 0
+        time_acc_ost = 0.0
+        clip_srt = ""
+        start, end = ts[0][0] / 16000, ts[0][1] / 16000
+        srt_clip, subs, srt_index = generate_srt_clip(sentences, start, end, begin_index=srt_index, time_acc_ost=time_acc_ost)
+        start, end = start+start_ost/1000.0, end+end_ost/1000.0
+        video_clip = video.subclip(start, end) if video is not None else None
+        start_end_info = "from {} to {}".format(start, end)
+        clip_srt += srt_clip
+        if add_sub and video is not None:
+            generator = lambda txt: TextClip(txt, font='./font/STHeitiMedium.ttc', fontsize=font_size, color=font_color)
+            subtitles = SubtitlesClip(subs, generator)
+            video_clip = CompositeVideoClip([video_clip, subtitles.set_pos(('center','bottom'))])
+        concate_clip = [video_clip]
+        time_acc_ost += end+end_ost/1000.0 - (start+start_ost/1000.0)
+        for _ts in ts[1:]:
+            check_cancelled()
+            start, end = _ts[0] / 16000, _ts[1] / 16000
+            srt_clip, subs, srt_index = generate_srt_clip(sentences, start, end, begin_index=srt_index-1, time_acc_ost=time_acc_ost)
+            if not len(subs):
+                continue
+            chi_subs = []
+            sub_starts = subs[0][0][0]
+            for sub in subs:
+                chi_subs.append(((sub[0][0]-sub_starts, sub[0][1]-sub_starts), sub[1]))
+            start, end = start+start_ost/1000.0, end+end_ost/1000.0
+            _video_clip = video.subclip(start, end) if video is not None else None
+            start_end_info += ", from {} to {}".format(str(start)[:5], str(end)[:5])
+            clip_srt += srt_clip
+            if add_sub and video is not None:
+                generator = lambda txt: TextClip(txt, font='./font/STHeitiMedium.ttc', fontsize=font_size, color=font_color)
+                subtitles = SubtitlesClip(chi_subs, generator)
+                _video_clip = CompositeVideoClip([_video_clip, subtitles.set_pos(('center','bottom'))])
+                # _video_clip.write_videofile("debug.mp4", audio_codec="aac")
+            if video is not None:
+                concate_clip.append(copy.copy(_video_clip))
+            time_acc_ost += end+end_ost/1000.0 - (start+start_ost/1000.0)
+        message = "{} periods found in the audio: ".format(len(ts)) + start_end_info
+        if video is None:
+            return clip_srt, message
+        logging.warning("Concating...")
+        if len(concate_clip) > 1:
+            video_clip = concatenate_videoclips(concate_clip)
+        # 先写到本请求独有的临时文件，完成后再原子地换成最终文件名
+        part_id = "{}_{}".format(os.getpid(), threading.get_ident())
+        part_file = clip_video_file[:-4] + '.part{}.mp4'.format(part_id)
+        temp_audio_file = clip_video_file[:-4] + '_tempaudio{}.mp4'.format(part_id)
+        try:
+            video_clip.write_videofile(part_file, audio_codec="aac", temp_audiofile=temp_audio_file,
+                                       logger=moviepy_logger("渲染裁剪片段") or "bar")
+            os.replace(part_file, clip_video_file)
+        finally:
+            for path in (part_file, temp_audio_file):
+                if os.path.exists(path):
+                    os.remove(path)
+        return clip_srt, message
+
     # --- 辅助方法 1: 提取音乐节拍 ---
-    def _get_music_beats(self, audio_path):
+    def _get_music_beats(self, audio_path, min_duration=None):
         """
-        使用 librosa 提取音乐节拍时间点 (秒)
+        流式分析整首 BGM 的节拍时间点 (秒)，结果按曲目缓存
+        :param min_duration: 视频可能的最大时长，BGM 循环时按曲目时长把节拍延伸到该时长
         """
         try:
-            # 加载音频 (只读取前3分钟以节省时间，通常BGM是循环的)
-            y, sr = librosa.load(audio_path, duration=180)
-            tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
-            beat_times = librosa.frames_to_time(beat_frames, sr=sr)
+            grid = BeatTracker().analyze(audio_path)
+            beat_times = grid['beats']
+            if min_duration is not None:
+                beat_times = extend_beats(beat_times, grid['duration'], min_duration)
             return beat_times
         except Exception as e:
             logging.error(f"Beat tracking failed for {audio_path}: {e}")
@@ -512,21 +589,142 @@ class VideoClipper():
         cap.release()
         return detected_relative_time
     
+    # --- 辅助方法 4: 按渲染计划合成画面 ---
+    def _render_plan_visuals(self, plan, original_video, speech_timestamps):
+        """
+        按 RenderPlan 切割、变速并合成所有镜头 (含只保留人声的原音)
+        :return: (合成后的片段, 每个镜头在时间线上的开始时间)
+        """
+        processed_clips = []
+        for shot in plan.shots:
+            # 切割视频
+            clip = original_video.subclip(shot['src_start'], shot['src_end'])
+
+            # 去除原背景音 (只留人声)
+            clip = self._isolate_speech(clip, shot['src_start'], speech_timestamps)
+
+            # 变速处理
+            if shot['speed'] != 1.0:
+                try: clip = clip.fx(vfx.speedx, shot['speed'])
+                except: pass
+            processed_clips.append(clip)
+
+        # --- 智能拼接 (含音频防重叠) ---
+        # 画面：时间线渲染器只在相邻镜头重叠的窗口内合成转场，其余帧直接透传
+        logging.info("Compositing layers...")
+        timeline = TimelineRenderer(original_video.size)
+        audio_layers = []
+        layer_starts = []
+        cursor = 0.0
+        for idx, clip in enumerate(processed_clips):
+            shot = plan.shots[idx]
+            t_dur = 0.0
+            if idx > 0:
+                # 重叠时长不能超过相邻两个镜头本身的长度
+                t_dur = min(shot['transition_duration'], processed_clips[idx-1].duration, clip.duration)
+
+            start_pos = max(cursor - t_dur, 0.0)
+
+            # 音频防重叠处理
+            if idx > 0 and audio_layers:
+                prev_audio = audio_layers[-1]
+                prev_audio_allowed_duration = start_pos - prev_audio.start
+                if prev_audio_allowed_duration > 0 and prev_audio_allowed_duration < prev_audio.duration:
+                    new_audio = prev_audio.subclip(0, prev_audio_allowed_duration)
+                    new_audio = new_audio.audio_fadeout(0.05)
+                    audio_layers[-1] = new_audio.set_start(prev_audio.start)
+
+            if clip.audio is not None:
+                audio_layers.append(clip.audio.set_start(start_pos))
+            timeline.add_layer(clip.without_audio(), start_pos,
+                               transition=shot['transition'], overlap=t_dur, seed=shot['seed'])
+            layer_starts.append(start_pos)
+            cursor = start_pos + clip.duration
+
+        final_video_clip = timeline.to_clip(fps=original_video.fps)
+        if audio_layers:
+            final_video_clip = final_video_clip.set_audio(
+                CompositeAudioClip(audio_layers).set_duration(final_video_clip.duration))
+        return final_video_clip, layer_starts
+
+    # --- 辅助方法: 背景音乐响度匹配 ---
+    def _bgm_gain(self, bgm_path, video_path=None, speech_timestamps=None):
+        """
+        按 BS.1770 积分响度计算背景音乐增益：有人声时比人声低 BGM_DUCK_LU，否则对齐到 BGM_TARGET_LUFS
+        人声响度只在源视频的人声区间内测量；增益不会让背景音乐的真峰值超过 BGM_PEAK_CEILING_DBTP
+        测量失败时退回固定的 0.3
+        """
+        try:
+            target = self.BGM_TARGET_LUFS
+            if video_path and speech_timestamps:
+                voice_lufs = measure_intervals(video_path, speech_timestamps).integrated_loudness()
+                if np.isfinite(voice_lufs):
+                    target = voice_lufs - self.BGM_DUCK_LU
+            bgm_meter = measure_file(bgm_path, true_peak=True)
+            bgm_lufs = bgm_meter.integrated_loudness()
+            if not np.isfinite(bgm_lufs):
+                return 0.3
+            gain = gain_to_target(bgm_lufs, target)
+            peak_db = bgm_meter.true_peak_db()
+            if np.isfinite(peak_db):
+                gain = min(gain, 10.0 ** ((self.BGM_PEAK_CEILING_DBTP - peak_db) / 20.0))
+            logging.info(f"BGM loudness {bgm_lufs:.1f} LUFS / {peak_db:.1f} dBTP -> "
+                         f"target {target:.1f} LUFS (gain {gain:.2f})")
+            return gain
+        except Exception as e:
+            logging.warning(f"Loudness measurement failed, using default BGM volume: {e}")
+            return 0.3
+
+    # --- 辅助方法 5: 片段级增量渲染 ---
+    def _render_segments(self, plan, visuals, layer_starts, fps, render_cache):
+        """
+        把时间线按镜头切成片段分别编码并缓存，参数和时间线位置都未变的片段直接复用。
+        片段 i = 进入镜头 i 的转场窗口 + 镜头 i 的主体，边界是绝对帧号，
+        每个片段按帧数精确编码，拼接后的总帧数与整条时间线一致。
+        :return: (片段路径列表, 本次新编码的片段数)
+        """
+        frames = segment_frames(layer_starts, visuals.duration, fps)
+        keys = plan.segment_keys(frames, layer_starts, fps, encoder=self.SEGMENT_ENCODER)
+        seg_paths = []
+        rendered = 0
+        for i, (key, (first, count)) in enumerate(zip(keys, frames)):
+            check_cancelled()
+            report_progress(i / len(keys), f"渲染片段 {i+1}/{len(keys)}")
+            if count == 0:
+                continue
+            seg_path = render_cache.segment_path(key)
+            if not os.path.exists(seg_path):
+                seg_start = first / fps
+                logging.info(f"Encoding segment {i+1}/{len(keys)} (frames {first} - {first + count - 1})")
+                tmp_path = part_path(seg_path)
+                # moviepy 在 [0, duration) 内每 1/fps 取一帧，时长取 count - 0.5 帧才能恰好得到 count 帧
+                visuals.subclip(seg_start, seg_start + (count - 0.5) / fps).write_videofile(
+                    tmp_path, fps=fps, audio=False, logger=None, **self.SEGMENT_ENCODER)
+                os.replace(tmp_path, seg_path)
+                rendered += 1
+            seg_paths.append(seg_path)
+        return seg_paths, rendered
+
     # --- 核心主方法 ---
-    def generate_musical_video(self, video_path, music_root, output_path, shots_data_wrapper=None, custom_bgm_path=None):
+    def generate_musical_video(self, video_path, music_root, output_path, shots_data_wrapper=None, custom_bgm_path=None,
+                               seed=0, cache_dir=None, recog_fn=None):
         """
         全自动配乐与转场生成 (单曲循环 + 炫酷转场 + 音频防重叠 + 支持自定义音乐)
         :param custom_bgm_path: [新增] 用户上传的音乐路径，如果存在则优先使用
+        :param seed: 转场规划的随机种子，相同输入 + 相同种子得到相同结果
+        :param cache_dir: 渲染缓存目录，默认为输出目录下的 .musical_cache
+        :param recog_fn: 识别源视频人声的函数 (视频路径 -> video_recog 的返回值)，默认直接调用 video_recog；
+                         界面通过它把识别放进 ASR 任务池，受 ASR 的并发上限约束
         """
         logging.info(f"Processing Auto-Music for: {video_path}")
         
         # =================================================
         # 步骤 1: 视觉理解
         # =================================================
-        if self.video_understander is None:
-            return None, "Error: Semantic Understander not initialized"
-
         if shots_data_wrapper is None:
+            # 只有需要现场推理时才依赖视觉模型，已有语义结果时不必加载
+            if self.video_understander is None:
+                return None, "Error: Semantic Understander not initialized"
             logging.info("No pre-calculated tags provided, running inference...")
             shots = self.shot_detector.detect(video_path, threshold=0.85)
             shots_list, global_summary = self.video_understander.understand(video_path, shots)
@@ -553,39 +751,58 @@ class VideoClipper():
             return None, "Error: No matching music found or custom BGM is invalid."
         logging.info(f"Selected BGM: {bgm_path}")
 
-        bgm_beats = self._get_music_beats(bgm_path)
+        # 变速最多放慢到 0.5x，输出时长不会超过源镜头总时长的两倍
+        max_output_duration = 2.0 * sum(shot['end'] - shot['start'] for shot in shots_list)
+        bgm_beats = self._get_music_beats(bgm_path, min_duration=max_output_duration)
         
         # =================================================
         # 步骤 3: 转场规划
         # =================================================
         logging.info("Planning transitions...")
         director = Director(None) 
-        transitions = director.decide_transitions(shots_list)
+        transitions = director.decide_transitions(shots_list, seed=seed)
         
         # =================================================
-        # 步骤 4: 视觉渲染 (含智能剪辑、卡点、特效)
+        # 步骤 4: 渲染计划 (含智能剪辑、卡点、转场)
         # =================================================
-        logging.info("Step 4: Rendering Visuals...")
-        original_video = VideoFileClip(video_path)
-        processed_clips = []
-        
+        logging.info("Step 4: Planning Render...")
+        plan = RenderPlan(video=file_signature(video_path), bgm=file_signature(bgm_path),
+                          seed=seed, summary=global_summary)
+
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(output_path)), ".musical_cache")
+        render_cache = RenderCache(cache_dir)
+        # 源视频的分析结果 (人声区间、视觉变化点) 只与源视频有关，换音乐时直接复用
+        analysis = render_cache.load_analysis(plan.video)
+        visual_changes = analysis.setdefault('visual_changes', {})
+        # 规划只需要源视频时长，不占用读取器
+        source_duration = probe_media(video_path)["duration"]
+
         current_global_time = 0.0
-        
+
         # 预处理人声时间戳 (用于去除原声背景音)
         # 注意：这里需要先跑一次 video_recog 才能拿到 state
-        _, _, state = self.video_recog(video_path)
-        asr_sentences = state.get('sentences', [])
-        speech_timestamps = [] 
-        for sent in asr_sentences:
-            s = sent['timestamp'][0][0] / 1000.0
-            e = sent['timestamp'][-1][1] / 1000.0
-            speech_timestamps.append((s, e))
-        
+        if 'speech' in analysis:
+            speech_timestamps = [tuple(x) for x in analysis['speech']]
+        else:
+            _, _, state = (recog_fn or self.video_recog)(video_path)
+            asr_sentences = state.get('sentences', [])
+            speech_timestamps = []
+            for sent in asr_sentences:
+                s = sent['timestamp'][0][0] / 1000.0
+                e = sent['timestamp'][-1][1] / 1000.0
+                speech_timestamps.append((s, e))
+            # 识别失败时本次按无人声处理，但不写入缓存，下次重新识别
+            if 'recog_error' not in state:
+                analysis['speech'] = speech_timestamps
+
         for i, shot in enumerate(shots_list):
+            check_cancelled()
+            report_progress(i / len(shots_list), f"规划镜头 {i+1}/{len(shots_list)}")
             start_t = shot['start']
             end_t = shot['end']
             original_dur = end_t - start_t
-            
+
             # --- 智能剪辑逻辑 ---
             # 检查人声覆盖
             has_speech = False
@@ -593,13 +810,16 @@ class VideoClipper():
                 if max(start_t, s) < min(end_t, e):
                     has_speech = True
                     break
-            
+
             target_cut_duration = original_dur
             if has_speech:
                 logging.info(f"Shot {i}: Has speech, keeping full duration.")
             else:
                 # 局部视觉检测 (防拖沓)
-                visual_change_time = self._find_visual_change_point(video_path, start_t, end_t, threshold=0.85)
+                change_key = f"{start_t:.3f}-{end_t:.3f}"
+                if change_key not in visual_changes:
+                    visual_changes[change_key] = self._find_visual_change_point(video_path, start_t, end_t, threshold=0.85)
+                visual_change_time = visual_changes[change_key]
                 limit_dur = 5.0
                 if visual_change_time < original_dur:
                     target_cut_duration = min(visual_change_time, limit_dur)
@@ -610,109 +830,99 @@ class VideoClipper():
             trans_duration = 0.0
             trans_type = "cut"
             if i > 0 and (i-1) < len(transitions):
-                trans_info = transitions[i-1]
-                trans_type = trans_info['type']
-                trans_duration = trans_info['duration']
+                trans_type = transitions[i-1]['type']
+                trans_duration = transitions[i-1]['duration']
 
             # 计算卡点 (基于智能剪辑后的时长)
             net_duration = self._snap_to_beat(target_cut_duration, current_global_time, bgm_beats)
 
             # 计算物理总时长
             gross_duration = net_duration + trans_duration
-            
-            # 切割视频
-            actual_end_t = min(start_t + gross_duration, original_video.duration)
-            clip = original_video.subclip(start_t, actual_end_t)
-            
-            # 去除原背景音 (只留人声)
-            clip = self._isolate_speech(clip, start_t, speech_timestamps)
-            
-            # 变速处理
-            current_clip_dur = clip.duration
+
+            # 切割区间与变速系数
+            actual_end_t = min(start_t + gross_duration, source_duration)
+            speed_factor = 1.0
+            current_clip_dur = actual_end_t - start_t
             if abs(current_clip_dur - gross_duration) > 0.05 and gross_duration > 0.1:
-                speed_factor = current_clip_dur / gross_duration
-                if 0.5 <= speed_factor <= 2.0:
-                    try: clip = clip.fx(vfx.speedx, speed_factor)
-                    except: pass
-            
-            # 应用转场特效
-            if trans_duration > 0:
-                try:
-                    if trans_type == "slide_left": clip = TransFX.slide_in(clip, trans_duration, 'left')
-                    elif trans_type == "slide_up": clip = TransFX.slide_in(clip, trans_duration, 'up')
-                    elif trans_type == "zoom_in": clip = TransFX.zoom_in(clip, trans_duration)
-                    elif trans_type == "crossfade": clip = clip.crossfadein(trans_duration)
-                    elif trans_type == "fade_black": clip = clip.fadein(trans_duration)
-                    elif trans_type == "glitch": clip = TransFX.glitch(clip, trans_duration)
-                except: pass
+                if 0.5 <= current_clip_dur / gross_duration <= 2.0:
+                    speed_factor = current_clip_dur / gross_duration
 
-            processed_clips.append(clip)
             current_global_time += net_duration
+            plan.add_shot(start_t, actual_end_t, gross_duration, beat=current_global_time,
+                          speed=speed_factor, transition=trans_type, transition_duration=trans_duration)
 
-        # --- 4.2 智能拼接 (含音频防重叠) ---
-        logging.info("Compositing layers...")
-        final_layers = []
-        cursor = 0.0
-        
-        for idx, clip in enumerate(processed_clips):
-            t_dur = 0.0
-            if idx > 0 and (idx-1) < len(transitions):
-                t_dur = transitions[idx-1]['duration']
-            
-            start_pos = cursor - t_dur
-            if start_pos < 0: start_pos = 0
-            
-            # 音频防重叠处理
-            if idx > 0:
-                prev_clip = final_layers[-1]
-                prev_audio_allowed_duration = start_pos - prev_clip.start
-                if prev_clip.audio is not None and prev_audio_allowed_duration > 0:
-                    new_audio = prev_clip.audio.subclip(0, prev_audio_allowed_duration)
-                    new_audio = new_audio.audio_fadeout(0.05)
-                    final_layers[-1] = prev_clip.set_audio(new_audio)
+        render_cache.save_analysis(plan.video, analysis)
 
-            clip = clip.set_start(start_pos)
-            final_layers.append(clip)
-            cursor = start_pos + clip.duration
-            
-        final_video_clip = CompositeVideoClip(final_layers)
-        
-        # 裁剪总时长
-        total_dur = final_layers[-1].end
-        final_video_clip = final_video_clip.subclip(0, total_dur)
+        # 相同的计划直接复用缓存结果
+        plan_key = plan.fingerprint()
+        cached_path = render_cache.lookup(plan)
+        if cached_path is not None:
+            logging.info(f"Render plan {plan_key} unchanged, reusing cached output: {cached_path}")
+            RenderCache.export(cached_path, output_path)
+            return output_path, f"Success (cached).\nBGM: {os.path.basename(bgm_path)}\nPlan: {plan_key}\nSummary: {global_summary}"
 
-        # =================================================
-        # 步骤 5: 音频混合 (BGM + 只有人声的原音)
-        # =================================================
-        logging.info("Step 5: Mixing Audio Layers...")
-        final_audio_layers = []
-        if final_video_clip.audio:
-            final_audio_layers.append(final_video_clip.audio)
-        
-        try:
-            bgm = AudioFileClip(bgm_path)
-            # 循环铺满
-            if bgm.duration < final_video_clip.duration:
-                bgm = bgm.fx(vfx.loop, duration=final_video_clip.duration)
-            else:
-                bgm = bgm.subclip(0, final_video_clip.duration)
-            
-            bgm = bgm.audio_fadein(1.0).audio_fadeout(1.0)
-            bgm = bgm.volumex(0.3) # 设定背景音量
-            final_audio_layers.append(bgm)
-        except Exception as e:
-            logging.error(f"Error mixing BGM: {e}")
+        # 背景音乐的响度测量不依赖源视频读取器，在借用之前完成
+        bgm_gain = self._bgm_gain(bgm_path, video_path, speech_timestamps)
+
+        # 源视频读取器只在合成画面、编码片段和写出音轨时借用 (人声层从读取器读取音频)，
+        # 任何返回或异常路径都会归还
+        audio_file = None
+        with video_readers.lease(video_path) as original_video:
+            logging.info("Step 4.2: Rendering Visuals...")
+            final_video_clip, layer_starts = self._render_plan_visuals(plan, original_video, speech_timestamps)
+            fps = original_video.fps
+            seg_paths, rendered = self._render_segments(plan, final_video_clip.without_audio(), layer_starts, fps, render_cache)
+            logging.info(f"Segments: {rendered} encoded, {len(seg_paths) - rendered} reused from cache.")
+
+            # =================================================
+            # 步骤 5: 音频混合 (BGM + 只有人声的原音)
+            # =================================================
+            logging.info("Step 5: Mixing Audio Layers...")
+            final_audio_layers = []
+            if final_video_clip.audio:
+                final_audio_layers.append(final_video_clip.audio)
+
+            bgm_source = None
+            try:
+                bgm = bgm_source = AudioFileClip(bgm_path)
+                # 循环铺满
+                if bgm.duration < final_video_clip.duration:
+                    bgm = bgm.fx(vfx.loop, duration=final_video_clip.duration)
+                else:
+                    bgm = bgm.subclip(0, final_video_clip.duration)
+
+                bgm = bgm.audio_fadein(1.0).audio_fadeout(1.0)
+                bgm = bgm.volumex(bgm_gain) # 按响度设定背景音量
+                final_audio_layers.append(bgm)
+            except Exception as e:
+                logging.error(f"Error mixing BGM: {e}")
+
+            try:
+                if final_audio_layers:
+                    # 同一计划可能被并发渲染，每次运行写自己的音轨文件
+                    audio_file = part_path(os.path.join(cache_dir, f"audio_{plan_key}.m4a"))
+                    final_audio = CompositeAudioClip(final_audio_layers).set_duration(final_video_clip.duration)
+                    final_audio.write_audiofile(audio_file, fps=44100, codec='aac', logger=moviepy_logger("混合音轨"))
+            except Exception:
+                if audio_file and os.path.exists(audio_file):
+                    os.remove(audio_file)
+                raise
+            finally:
+                if bgm_source is not None:
+                    bgm_source.close()
 
-        if final_audio_layers:
-            final_video_clip.audio = CompositeAudioClip(final_audio_layers)
-        
         # =================================================
-        # 步骤 6: 导出
+        # 步骤 6: 导出 (无损拼接片段 + 混入新音轨)
         # =================================================
         logging.info(f"Writing result to {output_path}...")
-        final_video_clip.write_videofile(output_path, audio_codec='aac')
-        
-        return output_path, f"Success.\nBGM: {os.path.basename(bgm_path)}\nSummary: {global_summary}"
+        try:
+            concat_segments(seg_paths, output_path, audio_path=audio_file)
+        finally:
+            if audio_file and os.path.exists(audio_file):
+                os.remove(audio_file)
+        render_cache.store(plan, output_path)
+
+        return output_path, f"Success.\nBGM: {os.path.basename(bgm_path)}\nPlan: {plan_key}\nSummary: {global_summary}"
     
     def export_video_with_preset(self, video_path, output_path, resolution="原始/Original", 
                                   platform="通用/Universal", **kwargs):
@@ -870,7 +1080,7 @@ def get_parser():
     parser.add_argument(
         "--pre_audio_lufs_norm",
         action='store_true',
-        help="Optional: approximate LUFS normalization before recognition.",
+        help="Optional: BS.1770 gated loudness normalization before recognition.",
     )
     parser.add_argument(
         "--pre_audio_trim_silence",
@@ -899,48 +1109,42 @@ def get_parser():
         action='store_true',
         help="Optional: force constant frame rate output.",
     )
+    parser.add_argument(
+        "--no_daemon",
+        action='store_true',
+        help="Run in this process even if a FunClip daemon is running (see daemon.py).",
+    )
     return parser
 
 
-def preprocess_video_once(file_path, target_fps=None, target_size=None, to_16k_mono=False, output_dir=None):
-    clip = mpy.VideoFileClip(file_path)
-    if target_size is not None and clip.size != list(target_size):
-        clip = clip.resize(newsize=target_size)
-    if target_fps is not None:
-        clip = clip.set_fps(target_fps)
-    if to_16k_mono and clip.audio is not None:
-        temp_audio = file_path + ".tmp.wav"
-        clip.audio.write_audiofile(temp_audio, fps=16000, nbytes=2, codec="pcm_s16le", ffmpeg_params=["-ac", "1"])
-        new_audio = AudioFileClip(temp_audio)
-        clip = clip.set_audio(new_audio)
-    base = os.path.basename(file_path)
-    pre_name = "pre_" + base
-    if output_dir is None:
-        output_dir = os.path.dirname(file_path)
-    os.makedirs(output_dir, exist_ok=True)
-    out_path = os.path.join(output_dir, pre_name)
-    clip.write_videofile(out_path, fps=target_fps or clip.fps, audio_codec="aac")
-    clip.close()
-    return out_path
-
-
-def preprocess_audio_once(file_path, to_16k_mono=False, output_dir=None):
-    if not to_16k_mono:
-        return file_path
-    wav, sr = librosa.load(file_path, sr=None, mono=False)
-    if wav.ndim > 1:
-        wav = wav[0]
-    if sr != 16000:
-        wav = librosa.resample(wav, orig_sr=sr, target_sr=16000)
-        sr = 16000
-    base = os.path.basename(file_path)
-    pre_name = "pre_" + base
-    if output_dir is None:
-        output_dir = os.path.dirname(file_path)
-    os.makedirs(output_dir, exist_ok=True)
-    out_path = os.path.join(output_dir, pre_name)
-    sf.write(out_path, wav, sr)
-    return out_path
+FUNASR_MODELS = {
+    'zh': dict(model="iic/speech_seaco_paraformer_large_asr_nat-zh-cn-16k-common-vocab8404-pytorch",
+               vad_model="damo/speech_fsmn_vad_zh-cn-16k-common-pytorch",
+               punc_model="damo/punc_ct-transformer_zh-cn-common-vocab272727-pytorch",
+               spk_model="damo/speech_campplus_sv_zh-cn_16k-common"),
+    'en': dict(model="iic/speech_paraformer_asr-en-16k-vocab4199-pytorch",
+               vad_model="damo/speech_fsmn_vad_zh-cn-16k-common-pytorch",
+               punc_model="damo/punc_ct-transformer_zh-cn-common-vocab272727-pytorch",
+               spk_model="damo/speech_campplus_sv_zh-cn_16k-common"),
+}
+_funasr_models = {}
+_funasr_lock = threading.Lock()
+
+
+def load_funasr_model(lang='zh'):
+    """
+    Build the FunASR AutoModel (ASR + VAD + punctuation + speaker) for a language.
+    Models are kept per process, so a long-running process (daemon.py,
+    launch.py) pays the start-up cost once.
+    """
+    if lang not in FUNASR_MODELS:
+        raise ValueError("Unsupported lang: {}, choose one of {}".format(lang, list(FUNASR_MODELS)))
+    with _funasr_lock:
+        if lang not in _funasr_models:
+            from funasr import AutoModel
+            logging.warning("Initializing modelscope asr pipeline.")
+            _funasr_models[lang] = AutoModel(**FUNASR_MODELS[lang])
+        return _funasr_models[lang]
 
 
 def runner(stage, file, sd_switch, output_dir, dest_text, dest_spk, start_ost, end_ost, output_file, config=None, lang='zh',
@@ -986,53 +1190,26 @@ def runner(stage, file, sd_switch, output_dir, dest_text, dest_spk, start_ost, e
 
     target_size = parse_size(std_size) if std_size is not None else None
     if stage == 1 and (std_fps is not None or target_size is not None or pre_audio_16k_mono or pre_audio_rms_norm or pre_audio_highpass or pre_audio_denoise or pre_audio_damage_fix or pre_audio_lufs_norm or pre_audio_trim_silence or pre_video_h264 or pre_video_bitrate or pre_video_cfr):
-        logging.warning("Preprocessing input with standardization options...")
+        options = {
+            "target_fps": std_fps,
+            "target_size": target_size,
+            "to_16k_mono": pre_audio_16k_mono,
+        }
         if mode == 'video':
-            file = preprocess_video_once(file,
-                                         target_fps=std_fps,
-                                         target_size=target_size,
-                                         to_16k_mono=pre_audio_16k_mono,
-                                         force_h264=pre_video_h264,
-                                         target_bitrate=pre_video_bitrate,
-                                         force_cfr=pre_video_cfr,
-                                         output_dir=output_dir)
-            logging.warning("Preprocessed video saved to {}".format(file))
-        elif mode == 'audio':
-            file = preprocess_audio_once(file,
-                                         to_16k_mono=pre_audio_16k_mono,
-                                         rms_norm=pre_audio_rms_norm,
-                                         highpass=pre_audio_highpass,
-                                         denoise=pre_audio_denoise,
-                                         damage_fix=pre_audio_damage_fix,
-                                         lufs_norm=pre_audio_lufs_norm,
-                                         target_lufs=pre_audio_target_lufs,
-                                         trim_silence=pre_audio_trim_silence,
-                                         output_dir=output_dir)
-            logging.warning("Preprocessed audio saved to {}".format(file))
+            options.update(force_h264=pre_video_h264, target_bitrate=pre_video_bitrate, force_cfr=pre_video_cfr)
+        else:
+            options.update(rms_norm=pre_audio_rms_norm, highpass=pre_audio_highpass, denoise=pre_audio_denoise,
+                           damage_fix=pre_audio_damage_fix, lufs_norm=pre_audio_lufs_norm,
+                           target_lufs=pre_audio_target_lufs, trim_silence=pre_audio_trim_silence)
+        file = preprocess_input(file, mode, options, output_dir)
+        logging.warning("Stage 1 input: {}".format(file))
     while output_dir.endswith('/'):
         output_dir = output_dir[:-1]
     if not os.path.exists(output_dir):
         os.mkdir(output_dir)
     if stage == 1:
-        from funasr import AutoModel
-        # initialize funasr automodel
-        logging.warning("Initializing modelscope asr pipeline.")
-        if lang == 'zh':
-            funasr_model = AutoModel(model="iic/speech_seaco_paraformer_large_asr_nat-zh-cn-16k-common-vocab8404-pytorch",
-                    vad_model="damo/speech_fsmn_vad_zh-cn-16k-common-pytorch",
-                    punc_model="damo/punc_ct-transformer_zh-cn-common-vocab272727-pytorch",
-                    spk_model="damo/speech_campplus_sv_zh-cn_16k-common",
-                    )
-            audio_clipper = VideoClipper(funasr_model)
-            audio_clipper.lang = 'zh'
-        elif lang == 'en':
-            funasr_model = AutoModel(model="iic/speech_paraformer_asr-en-16k-vocab4199-pytorch",
-                                vad_model="damo/speech_fsmn_vad_zh-cn-16k-common-pytorch",
-                                punc_model="damo/punc_ct-transformer_zh-cn-common-vocab272727-pytorch",
-                                spk_model="damo/speech_campplus_sv_zh-cn_16k-common",
-                                )
-            audio_clipper = VideoClipper(funasr_model)
-            audio_clipper.lang = 'en'
+        audio_clipper = VideoClipper(load_funasr_model(lang))
+        audio_clipper.lang = lang
         if mode == 'audio':
             logging.warning("Recognizing audio file: {}".format(file))
             wav, sr = librosa.load(file, sr=16000)
@@ -1047,6 +1224,7 @@ def runner(stage, file, sd_switch, output_dir, dest_text, dest_spk, start_ost, e
         write_state(output_dir, state)
         logging.warning("Recognition successed. You can copy the text segment from below and use stage 2.")
         print(res_text)
+        return res_text
     if stage == 2:
         audio_clipper = VideoClipper(None)
         if mode == 'audio':
@@ -1064,6 +1242,7 @@ def runner(stage, file, sd_switch, output_dir, dest_text, dest_spk, start_ost, e
             with open(clip_srt_file, 'w') as fout:
                 fout.write(srt_clip)
                 logging.warning("Write clipped subtitle to {}".format(clip_srt_file))
+            return output_file
         if mode == 'video':
             state = load_state(output_dir)
             state['video_filename'] = file
@@ -1072,13 +1251,13 @@ def runner(stage, file, sd_switch, output_dir, dest_text, dest_spk, start_ost, e
             else:
                 state['clip_video_file'] = output_file
             clip_srt_file = state['clip_video_file'][:-3] + 'srt'
-            state['video'] = mpy.VideoFileClip(file)
             clip_video_file, message, srt_clip = audio_clipper.video_clip(dest_text, start_ost, end_ost, state, dest_spk=dest_spk)
             logging.warning("Clipping Log: {}".format(message))
             logging.warning("Save clipped mp4 file to {}".format(clip_video_file))
             with open(clip_srt_file, 'w') as fout:
                 fout.write(srt_clip)
                 logging.warning("Write clipped subtitle to {}".format(clip_srt_file))
+            return clip_video_file
 
 
 def main(cmd=None):
@@ -1086,7 +1265,18 @@ def main(cmd=None):
     parser = get_parser()
     args = parser.parse_args(cmd)
     kwargs = vars(args)
-    runner(**kwargs)
+    no_daemon = kwargs.pop('no_daemon')
+    # Forward to a running daemon so the models are not loaded again for this call.
+    # Multi-file concatenation resolves paths against the caller, so it always runs locally.
+    if not no_daemon and ',' not in kwargs['file'] and daemon_status() is not None:
+        logging.warning("Forwarding stage {} to the FunClip daemon at {}".format(kwargs['stage'], daemon_address()))
+        result = submit_job(kwargs)['result']
+        if kwargs['stage'] == 1:
+            print(result)
+        else:
+            logging.warning("Save clipped file to {}".format(result))
+        return result
+    return runner(**kwargs)
 
 
 if __name__ == '__main__':